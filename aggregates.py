@@ -0,0 +1,232 @@
+"""Materialized summary counts kept next to the log.
+
+Both front ends add the rows of each submission to ``<log>.aggregates.json``
+after saving, so reports read O(groups) numbers instead of re-reading the
+workbook. A reaction is counted once (by its barcoded_cell_sample_name) even
+though it has one row per modality.
+
+    python aggregates.py report [--log datalog.xlsx]
+    python aggregates.py rebuild [--log datalog.xlsx]
+"""
+import os
+import json
+import argparse
+
+from logstore import iter_rows, sidecar_path, DEFAULT_LOG_PATH
+
+# Reaction-level groupings: group name -> column the group key is read from
+REACTION_GROUPS = {
+    "donor": "donor_name",
+    "experiment_date": "experiment_start_date",
+    "study": "study",
+    "tissue_region": "tissue_name",
+    "tile": "tissue_name",
+}
+
+
+def aggregates_path(workbook_path):
+    return sidecar_path(workbook_path, '.aggregates.json')
+
+
+def empty_aggregates():
+    groups = {group: {} for group in REACTION_GROUPS}
+    groups["library_method"] = {}
+    return {"rows": 0, "reactions": 0, "groups": groups}
+
+
+def tissue_region(tissue_name):
+    """Return the BS/CX/CB part of a tissue name like CJ24.56.001.BS.05.03"""
+    parts = str(tissue_name).split(".")
+    return parts[3] if len(parts) == 6 else "unknown"
+
+
+def group_key(group, row):
+    value = row.get(REACTION_GROUPS[group])
+    if value is None:
+        return "unknown"
+    return tissue_region(value) if group == "tissue_region" else str(value)
+
+
+def add_rows(aggregates, rows, seen_reactions=None):
+    """Fold appended rows into the aggregates in place
+
+    seen_reactions tracks reactions already counted; within one submission it can be
+    omitted because every reaction in it is new.
+    """
+    seen_reactions = set() if seen_reactions is None else seen_reactions
+    groups = aggregates["groups"]
+
+    for row in rows:
+        aggregates["rows"] += 1
+
+        method = groups["library_method"].setdefault(str(row.get("library_method")), {"libraries": 0, "passed": 0})
+        method["libraries"] += 1
+        if row.get("library_prep_pass_fail") == "Pass":
+            method["passed"] += 1
+
+        reaction = row.get("barcoded_cell_sample_name")
+        if reaction in seen_reactions:
+            continue
+        seen_reactions.add(reaction)
+        aggregates["reactions"] += 1
+
+        cells_loaded = row.get("enriched_cell_sample_quantity_count") or 0
+        for group in REACTION_GROUPS:
+            entry = groups[group].setdefault(group_key(group, row), {"reactions": 0, "cells_loaded": 0})
+            entry["reactions"] += 1
+            entry["cells_loaded"] += cells_loaded
+    return aggregates
+
+
+def remove_rows(aggregates, rows):
+    """Take the rows of an undone submission back out of the aggregates in place"""
+    groups = aggregates["groups"]
+    removed_reactions = set()
+
+    for row in rows:
+        aggregates["rows"] -= 1
+
+        method_key = str(row.get("library_method"))
+        method = groups["library_method"].get(method_key)
+        if method:
+            method["libraries"] -= 1
+            if row.get("library_prep_pass_fail") == "Pass":
+                method["passed"] -= 1
+            if method["libraries"] <= 0:
+                del groups["library_method"][method_key]
+
+        reaction = row.get("barcoded_cell_sample_name")
+        if reaction in removed_reactions:
+            continue
+        removed_reactions.add(reaction)
+        aggregates["reactions"] -= 1
+
+        cells_loaded = row.get("enriched_cell_sample_quantity_count") or 0
+        for group in REACTION_GROUPS:
+            key = group_key(group, row)
+            entry = groups[group].get(key)
+            if not entry:
+                continue
+            entry["reactions"] -= 1
+            entry["cells_loaded"] -= cells_loaded
+            if entry["reactions"] <= 0:
+                del groups[group][key]
+    return aggregates
+
+
+def change_pass_flags(aggregates, frame, values_by_location):
+    """Move pass counts for library_prep_pass_fail values changed in place
+
+    frame is the log as read before the change (read_frame); values_by_location
+    maps (shard name, sheet name, row number) to the new flag.
+    """
+    methods = aggregates["groups"]["library_method"]
+    rows = frame.set_index(['_shard', '_sheet', '_row'])
+    for location, value in values_by_location.items():
+        old = rows.at[location, "library_prep_pass_fail"] if "library_prep_pass_fail" in rows else None
+        method = methods.get(str(rows.at[location, "library_method"]))
+        if method is None or (old == "Pass") == (value == "Pass"):
+            continue
+        method["passed"] += 1 if value == "Pass" else -1
+    return aggregates
+
+
+def build_aggregates(workbook_path):
+    """Compute the aggregates from scratch with one pass over the log"""
+    aggregates = empty_aggregates()
+    add_rows(aggregates, iter_rows(workbook_path), set())
+    return aggregates
+
+
+def save_aggregates(workbook_path, aggregates):
+    with open(aggregates_path(workbook_path), 'w') as f:
+        json.dump(aggregates, f, indent=4)
+
+
+def load_aggregates(workbook_path):
+    path = aggregates_path(workbook_path)
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            try:
+                return json.load(f)
+            except json.JSONDecodeError:
+                pass
+    return None
+
+
+def settle_aggregates(workbook_path, appended, removed):
+    """Build missing aggregates from the log as it was before a batch of journal entries
+
+    appended and removed are the rows of entries already written to (or
+    removed from) the log whose aggregates step has not run yet; each step
+    then counts its rows exactly once.
+    """
+    if load_aggregates(workbook_path) is not None:
+        return
+    aggregates = remove_rows(build_aggregates(workbook_path), appended)
+    save_aggregates(workbook_path, add_rows(aggregates, removed))
+
+
+def update_aggregates(workbook_path, rows):
+    """Add a submission's rows; the first time, build from the log (which already holds them)"""
+    aggregates = load_aggregates(workbook_path)
+    if aggregates is None:
+        aggregates = build_aggregates(workbook_path)
+    else:
+        add_rows(aggregates, rows)
+    save_aggregates(workbook_path, aggregates)
+    return aggregates
+
+
+def remove_from_aggregates(workbook_path, rows):
+    """Remove an undone submission's rows; without stored aggregates there is nothing to do"""
+    aggregates = load_aggregates(workbook_path)
+    if aggregates is not None:
+        save_aggregates(workbook_path, remove_rows(aggregates, rows))
+    return aggregates
+
+
+def update_pass_flags(workbook_path, frame, values_by_location):
+    """Apply QC flag changes written to the log; without stored aggregates there is nothing to do"""
+    aggregates = load_aggregates(workbook_path)
+    if aggregates is not None:
+        save_aggregates(workbook_path, change_pass_flags(aggregates, frame, values_by_location))
+    return aggregates
+
+
+def summary_tables(aggregates):
+    """Return {group: (column names, rows)} ready to print or show in a table"""
+    tables = {}
+    for group in REACTION_GROUPS:
+        entries = aggregates["groups"].get(group, {})
+        tables[group] = (["reactions", "cells_loaded"],
+                         [(key, entry["reactions"], entry["cells_loaded"]) for key, entry in sorted(entries.items())])
+
+    rows = []
+    for method, entry in sorted(aggregates["groups"].get("library_method", {}).items()):
+        pass_rate = f"{100 * entry['passed'] / entry['libraries']:.1f}%" if entry["libraries"] else "-"
+        rows.append((method, entry["libraries"], entry["passed"], pass_rate))
+    tables["library_method"] = (["libraries", "passed", "pass_rate"], rows)
+    return tables
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summary counts for the data log.")
+    parser.add_argument('command', choices=['report', 'rebuild'])
+    parser.add_argument('--log', default=DEFAULT_LOG_PATH)
+    args = parser.parse_args()
+
+    aggregates = load_aggregates(args.log)
+    if args.command == 'rebuild' or aggregates is None:
+        aggregates = build_aggregates(args.log)
+        save_aggregates(args.log, aggregates)
+
+    print(f"{aggregates['reactions']} reactions, {aggregates['rows']} rows")
+    for group, (columns, rows) in summary_tables(aggregates).items():
+        print(f"\n{group}: " + ", ".join(columns))
+        for row in rows:
+            print("  " + "  ".join(str(value) for value in row))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,227 @@
+"""Append-only, hash-chained audit trail of who wrote what to the log.
+
+Every submission and undo applied to the log adds one line to
+``<log>.audit.jsonl``, with the OS user and station that submitted it, when
+(UTC), the rows it wrote or removed and the counter values it changed:
+
+    {"seq": 7, "time": "2025-03-24T15:02:44Z", "user": "lcaceres", "host": "bench-2", "op": "append",
+     "shard": "datalog.xlsx", "sheet": "HMBA", "first_row": 12, "last_row": 15, "rows": 4,
+     "counter_changes": [...], "prev": "<hash of entry 6>", "hash": "<sha256 of prev + this entry>"}
+
+Each hash covers the previous one, so editing, removing or reordering a line
+breaks the chain from there on (``verify``). ``<log>.audit.json`` keeps the
+last sequence number and hash, the size of the trail and the byte offset of
+each day's first entry, so an entry is added without reading the trail and a
+day range is read as one stretch of it. Times come from the submitting
+station's clock; once one runs behind an earlier entry, queries scan the
+whole trail and filter by time instead:
+
+    python audit.py [--log datalog.xlsx] list [--user NAME] [--since 2025-03-01] [--until 2025-03-31]
+    python audit.py [--log datalog.xlsx] verify
+"""
+import os
+import sys
+import json
+import socket
+import bisect
+import getpass
+import hashlib
+import argparse
+from datetime import datetime, timezone
+
+from logstore import sidecar_path, LEGACY_SHEET, DEFAULT_LOG_PATH
+
+GENESIS_HASH = "0" * 64
+
+# Fields of the listing, in order
+LIST_FIELDS = ["seq", "time", "user", "host", "op", "shard", "sheet", "first_row", "last_row"]
+
+
+def audit_path(workbook_path):
+    return sidecar_path(workbook_path, '.audit.jsonl')
+
+
+def state_path(workbook_path):
+    return sidecar_path(workbook_path, '.audit.json')
+
+
+def current_user():
+    """Login name of the person running the logger"""
+    try:
+        return getpass.getuser()
+    except (KeyError, OSError, ImportError):
+        return os.environ.get('USERNAME') or "unknown"
+
+
+def utc_now():
+    return datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def submitted_by():
+    """Who and when, recorded on a journal entry when it is submitted"""
+    return {"user": current_user(), "host": socket.gethostname(), "time": utc_now()}
+
+
+def entry_hash(prev, record):
+    payload = json.dumps(record, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256((prev + payload).encode('utf-8')).hexdigest()
+
+
+# --- Index ---
+def empty_state():
+    return {"last_seq": 0, "last_hash": GENESIS_HASH, "size": 0, "last_key": None,
+            "last_time": "", "ordered": True, "days": {}}
+
+
+def _index(state, record, offset, size):
+    state["last_seq"] = record["seq"]
+    state["last_hash"] = record["hash"]
+    state["size"] = size
+    if record["time"] < state["last_time"]:
+        state["ordered"] = False  # a station's clock is behind; days are no longer byte ranges
+    state["last_time"] = max(state["last_time"], record["time"])
+    state["days"].setdefault(record["time"][:10], offset)  # first entry of the day
+
+
+def rebuild_state(workbook_path):
+    """Index the trail from scratch (the index was lost or does not match the trail)"""
+    state = empty_state()
+    path = audit_path(workbook_path)
+    if not os.path.exists(path):
+        return state
+    with open(path, 'rb') as f:
+        offset = 0
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                break  # torn last line from a crash mid-write
+            _index(state, record, offset, offset + len(line))
+            offset += len(line)
+    return state
+
+
+def load_state(workbook_path):
+    path = state_path(workbook_path)
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            try:
+                state = json.load(f)
+            except json.JSONDecodeError:
+                state = None
+        if state is not None and "ordered" in state:
+            return state
+    return rebuild_state(workbook_path)  # missing, unreadable or from an older version
+
+
+def save_state(workbook_path, state):
+    with open(state_path(workbook_path), 'w') as f:
+        json.dump(state, f)
+
+
+# --- Recording ---
+def record_entry(workbook_path, entry):
+    """Add an applied journal entry (submission or undo) to the trail; called under the log lock"""
+    # Identifies the entry, so a replay after a crash between this and its journal marker adds nothing
+    key = [entry.get("time"), entry["shard"], entry.get("sheet") or LEGACY_SHEET, entry["first_row"],
+           entry.get("op", "append")]
+    state = load_state(workbook_path)
+    if state.get("last_key") == key:
+        return None
+
+    path = audit_path(workbook_path)
+    size = os.path.getsize(path) if os.path.exists(path) else 0
+    if size < state["size"]:
+        state = rebuild_state(workbook_path)  # the index is ahead of the trail
+
+    record = {"seq": state["last_seq"] + 1, "time": entry.get("time") or utc_now(),
+              "user": entry.get("user") or "unknown", "host": entry.get("host"), "op": entry.get("op", "append"),
+              "shard": entry["shard"], "sheet": entry.get("sheet") or LEGACY_SHEET,
+              "first_row": entry["first_row"], "last_row": entry["first_row"] + len(entry["rows"]) - 1,
+              "rows": len(entry["rows"]), "counter_changes": entry.get("counter_changes", []),
+              "prev": state["last_hash"]}
+    record["hash"] = entry_hash(record["prev"], record)
+    line = (json.dumps(record, default=str) + "\n").encode('utf-8')
+
+    with open(path, 'ab') as f:
+        f.truncate(state["size"])  # drop a line torn by a crash before it was indexed
+        f.write(line)
+        f.flush()
+        os.fsync(f.fileno())
+    _index(state, record, state["size"], state["size"] + len(line))
+    state["last_key"] = key
+    save_state(workbook_path, state)
+    return record
+
+
+# --- Queries ---
+def query(workbook_path, user=None, since=None, until=None):
+    """Entries by user and/or within days (YYYY-MM-DD, inclusive), in order"""
+    path = audit_path(workbook_path)
+    if not os.path.exists(path):
+        return []
+    state = load_state(workbook_path)
+
+    start, end = 0, state["size"]
+    if state["ordered"]:
+        # Entries are in time order, so a day range is a byte range of the trail
+        days = sorted(state["days"])
+        first = bisect.bisect_left(days, since) if since else 0
+        start = state["days"][days[first]] if first < len(days) else state["size"]
+        after = bisect.bisect_right(days, until) if until else len(days)
+        end = state["days"][days[after]] if after < len(days) else state["size"]
+
+    with open(path, 'rb') as f:
+        f.seek(start)
+        records = (json.loads(line) for line in f.read(end - start).splitlines())
+        return [record for record in records
+                if (user is None or record["user"] == user)
+                and (not since or record["time"][:10] >= since) and (not until or record["time"][:10] <= until)]
+
+
+def verify(workbook_path):
+    """Check the hash chain; returns (entries checked, None) or (seq, problem) at the first break"""
+    state = load_state(workbook_path)
+    prev, count = GENESIS_HASH, 0
+    path = audit_path(workbook_path)
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    return count + 1, "cannot be read"
+                stored = record.pop("hash", None)
+                if record.get("prev") != prev or entry_hash(prev, record) != stored:
+                    return record.get("seq"), "does not match the entries before it (edited, removed or reordered)"
+                prev, count = stored, count + 1
+    if prev != state["last_hash"]:
+        return count, "is the last entry, but later entries were removed"
+    return count, None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query or verify the audit trail of the log.")
+    parser.add_argument('--log', default=DEFAULT_LOG_PATH)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    list_parser = subparsers.add_parser('list', help="List submissions and undos")
+    list_parser.add_argument('--user')
+    list_parser.add_argument('--since', help="First day, YYYY-MM-DD (UTC)")
+    list_parser.add_argument('--until', help="Last day, YYYY-MM-DD (UTC)")
+    subparsers.add_parser('verify', help="Check that no entry was changed or removed")
+    args = parser.parse_args()
+
+    if args.command == 'verify':
+        seq, problem = verify(args.log)
+        if problem:
+            print(f"Audit trail broken: entry {seq} {problem}.")
+            sys.exit(1)
+        print(f"Audit trail intact ({seq} entries).")
+        return
+
+    for record in query(args.log, args.user, args.since, args.until):
+        print("\t".join(str(record.get(field, "")) for field in LIST_FIELDS))
+
+
+if __name__ == '__main__':
+    main()
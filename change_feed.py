@@ -0,0 +1,216 @@
+"""Checkpointed change feed for syncing the log to the LIMS/portal.
+
+Every change to the log is appended to ``<log>.changes.jsonl`` with a
+monotonic sequence number:
+
+    {"seq": 12, "op": "append", "shard": "datalog.xlsx", "sheet": "HMBA", "row": 57, "data": {...}}
+
+``op`` is ``append`` for new rows, ``update`` for columns set later (pool
+names) and ``delete`` for the rows of an undone submission.
+
+``<log>.changes.json`` holds the last sequence number issued and the last
+one the receiving system acknowledged, together with the byte offset just
+after it in the feed. An export seeks straight to that offset, so its cost
+depends on the changes since the checkpoint, not on the size of the log.
+The feed is fsynced before the state is saved, and the last sequence number
+is taken as the larger of the state's and the feed's last line, so a crash in
+between never issues a number twice.
+
+    python change_feed.py export --format csv --out today.csv [--ack]
+    python change_feed.py ack SEQ
+"""
+import os
+import sys
+import csv
+import json
+import argparse
+
+from logstore import sidecar_path, LEGACY_SHEET, DEFAULT_LOG_PATH
+
+FEED_FIELDS = ["seq", "op", "shard", "sheet", "row"]
+
+# Bytes read from the end of the feed at a time to find its last line
+TAIL_BLOCK = 4096
+
+
+def feed_path(workbook_path):
+    return sidecar_path(workbook_path, '.changes.jsonl')
+
+
+def state_path(workbook_path):
+    return sidecar_path(workbook_path, '.changes.json')
+
+
+def load_state(workbook_path):
+    path = state_path(workbook_path)
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            try:
+                return json.load(f)
+            except json.JSONDecodeError:
+                pass
+    return {"last_seq": 0, "acked_seq": 0, "acked_offset": 0}
+
+
+def save_state(workbook_path, state):
+    with open(state_path(workbook_path), 'w') as f:
+        json.dump(state, f, indent=4)
+
+
+def _feed_tail(path):
+    """(seq of the last complete line, size up to the end of it); a line torn by a crash is not counted"""
+    if not os.path.exists(path):
+        return 0, 0
+    with open(path, 'rb') as f:
+        size = f.seek(0, os.SEEK_END)
+        block = min(size, TAIL_BLOCK)
+        while True:
+            f.seek(size - block)
+            lines = f.read(block).split(b"\n")
+            # lines[-1] is what follows the last newline (empty unless torn); lines[-2] the last line if whole
+            if len(lines) >= 3 or block == size:
+                break
+            block = min(size, block * 2)
+    complete = size - len(lines[-1])
+    try:
+        return (json.loads(lines[-2])["seq"] if len(lines) >= 2 else 0), complete
+    except (json.JSONDecodeError, KeyError):
+        return 0, complete
+
+
+def append_changes(workbook_path, changes):
+    """Append (op, shard name, sheet name, row number, data) changes to the feed and return their sequence numbers
+
+    Callers hold the log lock (see journal.py), which keeps sequence numbers unique across stations.
+    """
+    state = load_state(workbook_path)
+    path = feed_path(workbook_path)
+    last_seq, size = _feed_tail(path)
+    state["last_seq"] = max(state["last_seq"], last_seq)  # the state is behind after a crash before it was saved
+    seqs = []
+    with open(path, 'ab') as f:
+        f.truncate(size)  # drop a line torn by a crash mid-write
+        for op, shard_name, sheet_name, row_idx, data in changes:
+            state["last_seq"] += 1
+            seqs.append(state["last_seq"])
+            f.write((json.dumps({"seq": state["last_seq"], "op": op, "shard": shard_name, "sheet": sheet_name,
+                                 "row": row_idx, "data": data}, default=str) + "\n").encode('utf-8'))
+        f.flush()
+        os.fsync(f.fileno())
+    save_state(workbook_path, state)
+    return seqs
+
+
+def record_appends(workbook_path, shard_path, sheet_name, first_row, rows):
+    """Feed the rows of a submission, written to consecutive rows of a sheet starting at first_row"""
+    shard_name = os.path.basename(shard_path)
+    return append_changes(workbook_path, [("append", shard_name, sheet_name, first_row + offset, row)
+                                          for offset, row in enumerate(rows)])
+
+
+def record_updates(workbook_path, header, values_by_location):
+    """Feed a bulk update of one column, given as {(shard name, sheet name, row number): value}"""
+    return append_changes(workbook_path, [("update", shard_name, sheet_name, row_idx, {header: value})
+                                          for (shard_name, sheet_name, row_idx), value in values_by_location.items()])
+
+
+def record_deletes(workbook_path, shard_path, sheet_name, first_row, rows):
+    """Feed tombstones for the rows of an undone submission"""
+    shard_name = os.path.basename(shard_path)
+    return append_changes(workbook_path, [("delete", shard_name, sheet_name, first_row + offset,
+                                           {"krienen_lab_identifier": row.get("krienen_lab_identifier"),
+                                            "library_name": row.get("library_name")})
+                                          for offset, row in enumerate(rows)])
+
+
+def iter_pending(workbook_path, state=None):
+    """Yield (change, end offset) for every change after the acknowledged checkpoint"""
+    state = state or load_state(workbook_path)
+    path = feed_path(workbook_path)
+    if not os.path.exists(path):
+        return
+    with open(path, 'rb') as f:
+        f.seek(state["acked_offset"])
+        for line in iter(f.readline, b''):
+            if not line.strip():
+                continue
+            change = json.loads(line)
+            change.setdefault("sheet", LEGACY_SHEET)  # fed before rows were split by study
+            if change["seq"] > state["acked_seq"]:
+                yield change, f.tell()
+
+
+def export_pending(workbook_path, out, export_format='jsonl'):
+    """Write the pending changes to a file object and return (count, last seq, end offset)"""
+    changes = []
+    end_offset = None
+    for change, end_offset in iter_pending(workbook_path):
+        changes.append(change)
+
+    if export_format == 'jsonl':
+        for change in changes:
+            out.write(json.dumps(change, default=str) + "\n")
+    else:
+        data_fields = []
+        for change in changes:
+            data_fields.extend(key for key in change["data"] if key not in data_fields)
+        writer = csv.DictWriter(out, fieldnames=FEED_FIELDS + data_fields)
+        writer.writeheader()
+        for change in changes:
+            writer.writerow({**{field: change[field] for field in FEED_FIELDS}, **change["data"]})
+
+    last_seq = changes[-1]["seq"] if changes else None
+    return len(changes), last_seq, end_offset
+
+
+def acknowledge(workbook_path, seq, end_offset=None):
+    """Move the checkpoint past change seq once the receiving system has it"""
+    state = load_state(workbook_path)
+    if end_offset is None:
+        for change, offset in iter_pending(workbook_path, state):
+            if change["seq"] <= seq:
+                end_offset = offset
+            if change["seq"] >= seq:
+                break
+    if end_offset is None:
+        return False
+    state["acked_seq"] = seq
+    state["acked_offset"] = end_offset
+    save_state(workbook_path, state)
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export log changes since the last acknowledged checkpoint.")
+    parser.add_argument('--log', default=DEFAULT_LOG_PATH)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    export_parser = subparsers.add_parser('export')
+    export_parser.add_argument('--format', dest='export_format', choices=['jsonl', 'csv'], default='jsonl')
+    export_parser.add_argument('--out', help="Output file (default: standard output)")
+    export_parser.add_argument('--ack', action='store_true', help="Acknowledge the exported changes right away")
+
+    ack_parser = subparsers.add_parser('ack')
+    ack_parser.add_argument('seq', type=int)
+    args = parser.parse_args()
+
+    if args.command == 'ack':
+        if not acknowledge(args.log, args.seq):
+            print(f"Change {args.seq} is not pending.")
+            sys.exit(1)
+        print(f"Checkpoint moved to {args.seq}.")
+        return
+
+    if args.out:
+        with open(args.out, 'w', newline='') as out:
+            count, last_seq, end_offset = export_pending(args.log, out, args.export_format)
+    else:
+        count, last_seq, end_offset = export_pending(args.log, sys.stdout, args.export_format)
+
+    print(f"{count} changes exported" + (f" (up to {last_seq})" if last_seq else ""), file=sys.stderr)
+    if args.ack and last_seq:
+        acknowledge(args.log, last_seq, end_offset)
+
+
+if __name__ == '__main__':
+    main()
@@ -5,8 +5,17 @@ import pyperclip
 import dateutil.parser
 from datetime import datetime
 from openpyxl import Workbook, load_workbook
-from openpyxl.styles import Font, PatternFill
-from openpyxl.utils import get_column_letter
+from openpyxl.styles import Font
+from library_names import seed_index_counter
+from schema import HEADERS, PREVIEW_COLUMNS
+from protocols import get_protocols, input_groups, needs_cdna, DEFAULT_PROTOCOL
+from reactions import build_submission
+from donors import DONORS_PATH, donor_names, find_donor
+from journal import apply_pending, make_entry, next_row, submit
+from logstore import active_shard_path, iter_rows, save_workbook, sheet_for_study, sheet_headers, sheet_next_row
+from loglock import LockTimeout
+from elab_links import find_elab_link
+from index_registry import registry_warning
 
 # --- Environment Setup ---
 if getattr(sys, 'frozen', False):
@@ -17,6 +26,21 @@ else:
 COUNTER_FILE = os.path.join(script_dir, 'sample_name_counter.json')
 workbook_path = os.path.join(script_dir, 'datalog.xlsx')
 
+# Finish any submission journaled by a run that crashed or could not save the workbook
+read_only = False
+try:
+    if not apply_pending(workbook_path, COUNTER_FILE):
+        print(f"Warning: earlier submissions are still waiting to be written to {workbook_path}. Is it open in Excel?")
+except LockTimeout as e:
+    print(f"Warning: {e}")
+except (OSError, ValueError) as e:
+    # e.g. a journaled undo whose rows were edited by hand since; saving would replay it again
+    read_only = True
+    print(f"Warning: the journal of {workbook_path} could not be replayed: {e}\n"
+          f"Rows can be generated and checked, but nothing is saved until the journal is sorted out.")
+
+shard_path = active_shard_path(workbook_path)  # Shard of the log new rows are appended to
+
 # Load or initialize counter data
 if os.path.exists(COUNTER_FILE):
     with open(COUNTER_FILE, 'r') as f:
@@ -35,24 +59,13 @@ counter_data.setdefault("amp_counter", {})   # Tracks cDNA amplification batches
 
 # --- Excel File Setup ---
 def initialize_excel():
-    if os.path.exists(workbook_path):
-        wb = load_workbook(workbook_path)
+    if os.path.exists(shard_path):
+        wb = load_workbook(shard_path)
     else:
         wb = Workbook()
         ws = wb.active
         ws.title = "HMBA"
-        headers = ['krienen_lab_identifier', 'seq_portal', 'elab_link', 'experiment_start_date',
-        'mit_name', 'donor_name', 'tissue_name', 'tissue_name_old',
-        'dissociated_cell_sample_name', 'facs_population_plan', 'cell_prep_type',
-        'study', 'enriched_cell_sample_container_name', 'expc_cell_capture',
-        'port_well', 'enriched_cell_sample_name', 'enriched_cell_sample_quantity_count',
-        'barcoded_cell_sample_name', 'library_method', 'cDNA_amplification_method',
-        'cDNA_amplification_date', 'amplified_cdna_name', 'cDNA_pcr_cycles',
-        'rna_amplification_pass_fail', 'percent_cdna_longer_than_400bp',
-        'cdna_amplified_quantity_ng', 'cDNA_library_input_ng', 'library_creation_date',
-        'library_prep_set', 'library_name', 'tapestation_avg_size_bp',
-        'library_num_cycles', 'lib_quantification_ng', 'library_prep_pass_fail',
-        'r1_index', 'r2_index', 'ATAC_index', 'library_pool_name']
+        headers = HEADERS
 
         ws.append(headers)
 
@@ -69,19 +82,17 @@ def initialize_excel():
                 cell.font = default_font
 
     ws = wb.active
-    wb.save(workbook_path)
+    save_workbook(wb, shard_path)
     return wb, ws
 
 # Initialize workbook and worksheet
 workbook, worksheet = initialize_excel()
-current_row = worksheet.max_row
-if current_row == 1 and not any(cell.value for cell in worksheet[1]):
-    current_row = 1  # Empty sheet
-else:
-    current_row += 1  # Append after last row
+
+# Seed the library name index from the existing log the first time it is used
+if "index_counter" not in counter_data:
+    counter_data["index_counter"] = seed_index_counter(iter_rows(workbook_path))
 
 # --- Style Definitions ---
-black_fill = PatternFill(start_color='000000', fill_type='solid')
 bold_font = Font(bold=True)
 
 # --- Date Conversion Function ---
@@ -101,14 +112,6 @@ def convert(exp_date):
         return None
 
 # --- Name Mapping Dictionaries ---
-name_to_code = {
-    "Croissant": "CJ23.56.002",
-    "Nutmeg": "CJ23.56.003",
-    "Jellybean": "CJ24.56.001",
-    "Rambo": "CJ24.56.004",
-    "Morel": "CJ24.56.015"
-}
-
 tile_location_map = {
     "BRAINSTEM": "BS",
     "BS": "BS",
@@ -121,6 +124,25 @@ tile_location_map = {
 # --- User Input Collection ---
 print("If multiple reactions are run, separate input values using commas.")
 
+# Protocol
+protocols = get_protocols()
+protocol_names = list(protocols)
+while True:
+    if len(protocol_names) == 1:
+        protocol_name = protocol_names[0]
+        break
+    choices = ", ".join(f"{i}) {name}" for i, name in enumerate(protocol_names, start=1))
+    protocol_input = input(f"Select the protocol ({choices}) [{DEFAULT_PROTOCOL}]: ").strip()
+    if not protocol_input:
+        protocol_name = DEFAULT_PROTOCOL
+        break
+    if protocol_input.isdigit() and 1 <= int(protocol_input) <= len(protocol_names):
+        protocol_name = protocol_names[int(protocol_input) - 1]
+        break
+    print("Invalid choice. Please enter the number of a protocol.")
+protocol = protocols[protocol_name]
+groups = input_groups(protocol)
+
 # Date input
 while True:
     date_input = input('Input the date of the experiment: ')
@@ -143,13 +165,16 @@ existing_total = date_entry["total_reactions"]
 
 # Marmoset name input
 while True:
-    mit_name_input = input("Input the name of the marmoset: ").strip().title()
-    if mit_name_input in name_to_code:
-        mit_name = "cj" + mit_name_input
-        donor_name = name_to_code[mit_name_input]
+    mit_name_input = input("Input the name of the marmoset: ").strip()
+    donor = find_donor(mit_name_input)
+    if donor:
+        mit_name = "cj" + donor["name"]
+        donor_name = donor["code"]
         break
+    elif not donor_names():
+        print(f"No marmosets are registered. Add them to {DONORS_PATH} and try again.")
     else:
-        print("Invalid name. Please enter one of: Croissant, Nutmeg, Jellybean, Rambo, Morel.")
+        print(f"Invalid name. Please enter one of: {', '.join(donor_names())} (or add the marmoset to donors.json).")
 
 # Slab number input
 while True:
@@ -256,9 +281,10 @@ counter_data.update({
 
 # Initialize common values
 seq_portal = "no"
-elab_link = pyperclip.paste()
+elab_link = find_elab_link(pyperclip.paste())
+if not elab_link:
+    elab_link = input("No eLab link is on the clipboard. Paste it here (or press Enter to leave it empty): ").strip()
 tissue_name = f"{donor_name}.{tile_location_abbr}.{slab}.{tile}"
-dissociated_cell_sample_name = f'{current_date}_{tissue_name}.Multiome'
 cell_prep_type = "nuclei"
 
 # Sorter initials
@@ -339,56 +365,62 @@ while True:
 
 enriched_cell_sample_quantity_count = round(concentration * volume)
 
+# Inputs for libraries the protocol does not make stay empty
+cdna_amplification_date = atac_library_prep_date = rna_library_prep_date = None
+cdna_pcr_cycles_list = percent_cdna_long_400bp_list = cdna_concentration_list = [None] * rxn_number
+atac_indices = atac_sizes = library_num_cycles_atac = lib_quant_atac = [None] * rxn_number
+rna_indices = rna_sizes = library_num_cycles_rna = lib_quant_rna = [None] * rxn_number
+
 # Library date handling
-while True:
-    cdna_amplification_date_input = input('Input the cDNA amplification date: ')
-    cdna_amplification_date = convert(cdna_amplification_date_input)
-    if cdna_amplification_date:
-        break
+if needs_cdna(protocol):
+    while True:
+        cdna_amplification_date_input = input('Input the cDNA amplification date: ')
+        cdna_amplification_date = convert(cdna_amplification_date_input)
+        if cdna_amplification_date:
+            break
 
-while True:
-    atac_library_prep_date_input = input("Enter the ATAC library preparation date: ")
-    atac_library_prep_date = convert(atac_library_prep_date_input)
-    if atac_library_prep_date:
-        break
+if "ATAC" in groups:
+    while True:
+        atac_library_prep_date_input = input("Enter the ATAC library preparation date: ")
+        atac_library_prep_date = convert(atac_library_prep_date_input)
+        if atac_library_prep_date:
+            break
 
-while True:
-    rna_library_prep_date_input = input("Enter the cDNA library preparation date: ")
-    rna_library_prep_date = convert(rna_library_prep_date_input)
-    if rna_library_prep_date:
-        break
+if "RNA" in groups:
+    while True:
+        rna_library_prep_date_input = input("Enter the cDNA library preparation date: ")
+        rna_library_prep_date = convert(rna_library_prep_date_input)
+        if rna_library_prep_date:
+            break
 
 # cDNA data collection
-rna_amplification_pass_fail = "Pass"
-
-while True:
-    cdna_pcr_cycles_list = input("Enter the number of cDNA amp cycles for each reaction: ").split(',')
-    if len(cdna_pcr_cycles_list) == rxn_number:
-        break
-    print(f"Please enter {rxn_number} values.")
-
-while True:
-    cdna_input = input("Enter the percent of cDNA > 400bp for each reaction: ")
-    percent_cdna_long_400bp_list = cdna_input.split(',')
-    try:
-        percent_cdna_long_400bp_list = [round(float(x.strip())) for x in percent_cdna_long_400bp_list]
-        if len(percent_cdna_long_400bp_list) == rxn_number:
+if needs_cdna(protocol):
+    while True:
+        cdna_pcr_cycles_list = input("Enter the number of cDNA amp cycles for each reaction: ").split(',')
+        if len(cdna_pcr_cycles_list) == rxn_number:
             break
-    except ValueError:
-        pass
-    print(f"Please enter {rxn_number} numeric values.")
+        print(f"Please enter {rxn_number} values.")
 
-while True:
-    cdna_concentration_list = input("Enter the concentration of amplified cDNA (ng/uL) for each reaction: ").split(',')
-    try:
-        cdna_concentration_list = [float(x.strip()) for x in cdna_concentration_list]
-        if len(cdna_concentration_list) == rxn_number:
-            break
-    except ValueError:
-        pass
-    print(f"Please enter {rxn_number} numeric values.")
+    while True:
+        cdna_input = input("Enter the percent of cDNA > 400bp for each reaction: ")
+        percent_cdna_long_400bp_list = cdna_input.split(',')
+        try:
+            percent_cdna_long_400bp_list = [round(float(x.strip())) for x in percent_cdna_long_400bp_list]
+            if len(percent_cdna_long_400bp_list) == rxn_number:
+                break
+        except ValueError:
+            pass
+        print(f"Please enter {rxn_number} numeric values.")
 
-cdna_amplified_quantity_ng_list = [conc * 40 for conc in cdna_concentration_list]
+    while True:
+        cdna_concentration_list = input("Enter the concentration of amplified cDNA (ng/uL) for each reaction: ").split(',')
+        try:
+            cdna_concentration_list = [float(x.strip()) for x in cdna_concentration_list]
+            if len(cdna_concentration_list) == rxn_number:
+                break
+        except ValueError:
+            pass
+        print(f"Please enter {rxn_number} numeric values.")
 
 # Index handling functions
 def convert_index(index):
@@ -411,205 +443,167 @@ def pad_index(index):
     return index
 
 # ATAC indices
-while True:
-    atac_indices_input = input("Enter the ATAC library indices: ").strip().upper()
-    atac_indices = [convert_index(index) for index in atac_indices_input.split(",")]
-    if all(atac_indices) and len(atac_indices) == rxn_number:
-        atac_indices = [pad_index(index) for index in atac_indices]
-        break
-    print(f"Please enter {rxn_number} valid ATAC indices (e.g., A1, 2B, C3).")
+if "ATAC" in groups:
+    while True:
+        atac_indices_input = input("Enter the ATAC library indices: ").strip().upper()
+        atac_indices = [convert_index(index) for index in atac_indices_input.split(",")]
+        if all(atac_indices) and len(atac_indices) == rxn_number:
+            atac_indices = [pad_index(index) for index in atac_indices]
+            break
+        print(f"Please enter {rxn_number} valid ATAC indices (e.g., A1, 2B, C3).")
 
 # RNA indices
-while True:
-    rna_indices_input = input("Enter the cDNA library indices: ").strip().upper()
-    rna_indices = [convert_index(index) for index in rna_indices_input.split(",")]
-    if all(rna_indices) and len(rna_indices) == rxn_number:
-        rna_indices = [pad_index(index) for index in rna_indices]
-        break
-    print(f"Please enter {rxn_number} valid cDNA indices (e.g., D4, 5E, F6).")
+if "RNA" in groups:
+    while True:
+        rna_indices_input = input("Enter the cDNA library indices: ").strip().upper()
+        rna_indices = [convert_index(index) for index in rna_indices_input.split(",")]
+        if all(rna_indices) and len(rna_indices) == rxn_number:
+            rna_indices = [pad_index(index) for index in rna_indices]
+            break
+        print(f"Please enter {rxn_number} valid cDNA indices (e.g., D4, 5E, F6).")
 
 # Tapestation sizes
-while True:
-    rna_sizes_input = input(f"Enter the Tapestation average size (bp) for cDNA libraries: ").strip()
-    rna_sizes = rna_sizes_input.split(',')
-    try:
-        rna_sizes = [int(size.strip()) for size in rna_sizes]
-        if len(rna_sizes) == rxn_number:
-            break
-    except ValueError:
-        pass
-    print(f"Please enter {rxn_number} integer values separated by commas.")
+if "RNA" in groups:
+    while True:
+        rna_sizes_input = input(f"Enter the Tapestation average size (bp) for cDNA libraries: ").strip()
+        rna_sizes = rna_sizes_input.split(',')
+        try:
+            rna_sizes = [int(size.strip()) for size in rna_sizes]
+            if len(rna_sizes) == rxn_number:
+                break
+        except ValueError:
+            pass
+        print(f"Please enter {rxn_number} integer values separated by commas.")
 
-while True:
-    atac_sizes_input = input(f"Enter the Tapestation average size (bp) for ATAC libraries: ").strip()
-    atac_sizes = atac_sizes_input.split(',')
-    try:
-        atac_sizes = [int(size.strip()) for size in atac_sizes]
-        if len(atac_sizes) == rxn_number:
-            break
-    except ValueError:
-        pass
-    print(f"Please enter {rxn_number} integer values separated by commas.")
+if "ATAC" in groups:
+    while True:
+        atac_sizes_input = input(f"Enter the Tapestation average size (bp) for ATAC libraries: ").strip()
+        atac_sizes = atac_sizes_input.split(',')
+        try:
+            atac_sizes = [int(size.strip()) for size in atac_sizes]
+            if len(atac_sizes) == rxn_number:
+                break
+        except ValueError:
+            pass
+        print(f"Please enter {rxn_number} integer values separated by commas.")
 
 # Library cycles
-while True:
-    library_num_cycles_rna_input = input(f"Enter the number of SI PCR cycles used for cDNA libraries: ").strip()
-    try:
-        library_num_cycles_rna = [int(x.strip()) for x in library_num_cycles_rna_input.split(',')]
-        if len(library_num_cycles_rna) == rxn_number:
-            break
-    except ValueError:
-        pass
-    print(f"Please enter {rxn_number} integer values separated by commas.")
+if "RNA" in groups:
+    while True:
+        library_num_cycles_rna_input = input(f"Enter the number of SI PCR cycles used for cDNA libraries: ").strip()
+        try:
+            library_num_cycles_rna = [int(x.strip()) for x in library_num_cycles_rna_input.split(',')]
+            if len(library_num_cycles_rna) == rxn_number:
+                break
+        except ValueError:
+            pass
+        print(f"Please enter {rxn_number} integer values separated by commas.")
 
-while True:
-    library_num_cycles_atac_input = input(f"Enter the number of SI PCR cycles used for ATAC libraries: ").strip()
-    try:
-        library_num_cycles_atac = [int(x.strip()) for x in library_num_cycles_atac_input.split(',')]
-        if len(library_num_cycles_atac) == rxn_number:
-            break
-    except ValueError:
-        pass
-    print(f"Please enter {rxn_number} integer values separated by commas.")
+if "ATAC" in groups:
+    while True:
+        library_num_cycles_atac_input = input(f"Enter the number of SI PCR cycles used for ATAC libraries: ").strip()
+        try:
+            library_num_cycles_atac = [int(x.strip()) for x in library_num_cycles_atac_input.split(',')]
+            if len(library_num_cycles_atac) == rxn_number:
+                break
+        except ValueError:
+            pass
+        print(f"Please enter {rxn_number} integer values separated by commas.")
 
 # Library quantification
-while True:
-    lib_quant_rna_input = input(f"Enter the cDNA library concentrations (ng/uL): ").strip()
-    try:
-        lib_quant_rna = [round(float(x.strip())) for x in lib_quant_rna_input.split(',')]
-        if len(lib_quant_rna) == rxn_number:
-            break
-    except ValueError:
-        pass
-    print(f"Please enter {rxn_number} numeric values separated by commas.")
-
-while True:
-    lib_quant_atac_input = input(f"Enter the ATAC library concentrations (ng/uL): ").strip()
-    try:
-        lib_quant_atac = [round(float(x.strip())) for x in lib_quant_atac_input.split(',')]
-        if len(lib_quant_atac) == rxn_number:
-            break
-    except ValueError:
-        pass
-    print(f"Please enter {rxn_number} numeric values separated by commas.")
-
-# --- Excel Writing ---
-dup_index_counter = {}
-headers = [cell.value for cell in worksheet[1]]
+if "RNA" in groups:
+    while True:
+        lib_quant_rna_input = input(f"Enter the cDNA library concentrations (ng/uL): ").strip()
+        try:
+            lib_quant_rna = [round(float(x.strip())) for x in lib_quant_rna_input.split(',')]
+            if len(lib_quant_rna) == rxn_number:
+                break
+        except ValueError:
+            pass
+        print(f"Please enter {rxn_number} numeric values separated by commas.")
 
-for x in range(rxn_number):
-    p_number, port_well = port_wells[x]
-    barcoded_cell_sample_name = f'P{str(p_number).zfill(4)}_{port_well}'
-
-    for modality in ["RNA", "ATAC"]:
-        krienen_lab_identifier = f'{current_date}_HMBA_{mit_name}_Slab{int(slab)}_Tile{int(tile)}_{sort_method}_{modality}{x + 1}'
-        enriched_cell_sample_name = f'MPXM_{current_date}_{sorting_status}_{sorter_initials}_{port_well}'
-        library_prep_date = rna_library_prep_date if modality == "RNA" else atac_library_prep_date
-
-        if modality == "RNA":
-            library_method = "10xMultiome-RSeq"
-            library_type = "LPLCXR"
-            library_index = rna_indices[x]
-        else:
-            library_method = "10xMultiome-ASeq"
-            library_type = "LPLCXA"
-            library_index = atac_indices[x]
-
-        # Update library prep set counter
-        key = (library_type, library_prep_date, library_index)
-
-        # Initialize or increment the counter for the key
-        dup_index_counter[key] = dup_index_counter.get(key, 0) + 1
-        library_prep_set = f"{library_type}_{library_prep_date}_{dup_index_counter[key]}"
-        library_name = f"{library_prep_set}_{library_index}"
-
-        # Prepare data row
-        row_data = [
-            krienen_lab_identifier,  # Column 1
-            seq_portal,
-            elab_link,
-            current_date,
-            mit_name,
-            donor_name,
-            tissue_name,
-            None,  # tissue_name_old (will be filled black)
-            dissociated_cell_sample_name,
-            facs_population,
-            cell_prep_type,
-            study,
-            enriched_cell_sample_container_name,
-            expected_cell_capture,
-            port_well,
-            enriched_cell_sample_name,
-            enriched_cell_sample_quantity_count,
-            barcoded_cell_sample_name,
-            library_method,
-            "10xMultiome-RSeq" if modality == "RNA" else None,
-            cdna_amplification_date if modality == "RNA" else None,
-            None,  # amplified_cdna_name (filled conditionally)
-            cdna_pcr_cycles_list[x] if modality == "RNA" else None,
-            rna_amplification_pass_fail if modality == "RNA" else None,
-            percent_cdna_long_400bp_list[x] if modality == "RNA" else None,
-            cdna_amplified_quantity_ng_list[x] if modality == "RNA" else None,
-            (cdna_amplified_quantity_ng_list[x] * 0.25) if modality == "RNA" else None,
-            library_prep_date,
-            library_prep_set,
-            library_name,
-            rna_sizes[x] if modality == "RNA" else atac_sizes[x],
-            library_num_cycles_rna[x] if modality == "RNA" else library_num_cycles_atac[x],
-            (lib_quant_rna[x] * 35) if modality == "RNA" else (lib_quant_atac[x] * 20),
-            "Pass",
-            f"SI-TT-{rna_indices[x]}_i7" if modality == "RNA" else None,
-            f"SI-TT-{rna_indices[x]}_b(i5)" if modality == "RNA" else None,
-            f"SI-NA-{atac_indices[x]}" if modality == "ATAC" else None,
-            None  # library_pool_name
-        ]
-
-        # Handle amplified_cdna_name for RNA
-        if modality == "RNA":
-            if current_date not in counter_data["amp_counter"]:
-                counter_data["amp_counter"][current_date] = 0
-            reaction_count = counter_data["amp_counter"][current_date]
-            letter = chr(65 + (reaction_count % 8))
-            batch_num_for_amp = (reaction_count // 8) + 1
-            row_data[21] = f"APLCXR_{cdna_amplification_date}_{batch_num_for_amp}_{letter}"
-            counter_data["amp_counter"][current_date] += 1
-
-        # Write to Excel
-        for col_num, value in enumerate(row_data, 1):
-            cell = worksheet.cell(row=current_row, column=col_num, value=value)
-            # Apply black fill for ATAC empty cells
-            if modality == "ATAC" and value is None:
-                cell.fill = black_fill
-
-        # Apply black fill to tissue_name_old
-        tissue_old_col = headers.index('tissue_name_old') + 1
-        worksheet.cell(row=current_row, column=tissue_old_col).fill = black_fill
-
-        current_row += 1
-
-# Adjust column widths
-for column in worksheet.columns:
-    max_length = 0
-    column_letter = get_column_letter(column[0].column)
-    for cell in column:
+if "ATAC" in groups:
+    while True:
+        lib_quant_atac_input = input(f"Enter the ATAC library concentrations (ng/uL): ").strip()
         try:
-            cell_value = str(cell.value)
-            if len(cell_value) > max_length:
-                max_length = len(cell_value)
-        except:
+            lib_quant_atac = [round(float(x.strip())) for x in lib_quant_atac_input.split(',')]
+            if len(lib_quant_atac) == rxn_number:
+                break
+        except ValueError:
             pass
-    adjusted_width = (max_length + 2)
-    worksheet.column_dimensions[column_letter].width = adjusted_width
+        print(f"Please enter {rxn_number} numeric values separated by commas.")
 
-# Save outputs
-workbook.save(workbook_path)
+# --- Excel Writing ---
+# Rows go to the study's own sheet, after its last row, leaving room for journaled rows not written yet
+sheet_name = sheet_for_study(study)
+headers = sheet_headers(shard_path, sheet_name) or HEADERS
+first_row = next_row(workbook_path, shard_path, sheet_next_row(workbook_path, shard_path, sheet_name), sheet_name)
+
+values = {
+    "current_date": current_date, "mit_name": mit_name, "slab": slab, "tile": tile,
+    "sort_method": sort_method, "seq_portal": seq_portal, "elab_link": elab_link,
+    "donor_name": donor_name, "tissue_name": tissue_name, "facs_population": facs_population,
+    "cell_prep_type": cell_prep_type, "study": study,
+    "enriched_cell_sample_container_name": enriched_cell_sample_container_name,
+    "expected_cell_capture": expected_cell_capture, "sorting_status": sorting_status,
+    "sorter_initials": sorter_initials,
+    "enriched_cell_sample_quantity_count": enriched_cell_sample_quantity_count,
+    "cdna_amplification_date": cdna_amplification_date,
+}
 
-# --- Persist Data ---
-with open(COUNTER_FILE, 'w') as f:
-    json.dump(counter_data, f, indent=4)
+# Per-reaction values common to every modality
+reactions = {
+    "reaction": list(range(1, rxn_number + 1)),
+    "port_well": [port_well for p_number, port_well in port_wells],
+    "barcoded_cell_sample_name": [f'P{str(p_number).zfill(4)}_{port_well}' for p_number, port_well in port_wells],
+    "cdna_pcr_cycles": cdna_pcr_cycles_list,
+    "percent_cdna_400bp": percent_cdna_long_400bp_list,
+    "cdna_concentration": cdna_concentration_list,
+}
 
-if not os.path.exists(workbook_path):
-    print(f"Warning: Workbook file {workbook_path} not found, creating a new one.")
+# Library inputs by form group; a modality's template says which group it takes
+group_inputs = {
+    "RNA": {"library_prep_date": rna_library_prep_date, "index": rna_indices, "size": rna_sizes,
+            "library_cycles": library_num_cycles_rna, "library_concentration": lib_quant_rna},
+    "ATAC": {"library_prep_date": atac_library_prep_date, "index": atac_indices, "size": atac_sizes,
+             "library_cycles": library_num_cycles_atac, "library_concentration": lib_quant_atac},
+}
+
+# Derive every column for all reactions at once
+rows, fills = build_submission(protocol, headers, values, reactions, group_inputs, counter_data)
+
+# --- Preview ---
+# Show the generated names before anything is written; counters so far only changed in memory
+print(f"\n{len(rows)} rows for the {sheet_name} sheet of {os.path.basename(shard_path)}:")
+preview_positions = [headers.index(name) for name in PREVIEW_COLUMNS if name in headers]
+for row in rows:
+    print("  " + "  ".join("" if row[i] is None else str(row[i]) for i in preview_positions))
+missing_indices = registry_warning()
+if missing_indices:
+    print(f"Warning: {missing_indices}")
+if input("Write these rows to the log? (y/n) [y]: ").strip().lower() not in ('', 'y', 'yes'):
+    print("Nothing was saved.")
+    sys.exit(0)
+if read_only:
+    print(f"Nothing was saved: the journal of {workbook_path} could not be replayed (see the warning at start up).")
+    sys.exit(1)
 
-print(f"Data successfully appended to {workbook_path}")
\ No newline at end of file
+# --- Persist Data ---
+# Journal the submission first, then write the workbook, counters and sidecar files from it
+entry = make_entry(shard_path, first_row, headers, rows, fills, counter_data, sheet_name)
+try:
+    written = submit(workbook_path, COUNTER_FILE, entry, on_rename=lambda renamed: print(
+        "Another station used some of these library names meanwhile; they were saved as:\n"
+        + "\n".join(f"  {old} -> {new}" for old, new in renamed.items())))
+except LockTimeout as e:
+    print(f"{e} Nothing was saved.")
+    sys.exit(1)
+if not written:
+    print(f"Could not save {shard_path} (is it open in Excel?). The submission is kept in the journal "
+          f"and will be written the next time the logger runs.")
+    sys.exit(1)
+
+if not os.path.exists(shard_path):
+    print(f"Warning: Workbook file {shard_path} not found, creating a new one.")
+
+print(f"Data successfully appended to {shard_path} (sheet {sheet_name})")
\ No newline at end of file
@@ -1,14 +1,100 @@
 import sys
 import os
 import json
+import copy
+from collections import namedtuple
 from datetime import datetime
 from openpyxl.styles import Font, PatternFill
 from PyQt6.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout,
                              QLabel, QLineEdit, QComboBox, QPushButton, QScrollArea,
                              QMessageBox, QGridLayout, QTabWidget, QFileDialog,
-                             QFrame, QListView)
-from PyQt6.QtCore import Qt, QTimer, QEvent
+                             QFrame, QListView, QDialog, QHBoxLayout, QTableWidget,
+                             QTableWidgetItem, QHeaderView, QInputDialog, QDialogButtonBox)
+from PyQt6.QtCore import Qt, QTimer, QEvent, QFileSystemWatcher, QObject, pyqtSignal
 from PyQt6.QtGui import QPalette, QColor, QCursor
+from library_names import seed_index_counter
+from schema import HEADERS, PREVIEW_COLUMNS
+from protocols import get_protocols, get_protocol, input_groups, index_kit, needs_cdna, DEFAULT_PROTOCOL
+from reactions import build_submission
+from donors import DONORS_PATH, donor_names, find_donor
+from aggregates import load_aggregates, build_aggregates, save_aggregates, summary_tables
+from journal import apply_pending, make_entry, next_row, submit, last_submission, undo_last
+from audit import current_user, utc_now
+from logstore import active_shard_path, iter_rows, sheet_for_study, shard_headers, sheet_next_row
+from loglock import LockTimeout
+from elab_links import find_elab_link
+from index_registry import registry_warning
+from instruments import read_exports, plate_names, select_plate, match_reactions, field_values, format_values
+
+# --- Form schema ---
+# One entry per form field, in tab and Enter-key order. A field without a label
+# goes beside the one above it. items are the choices of a combo (or a function
+# returning them), check is (label, validator) for setup_validation, and group
+# is the protocol input group that needs the field (see on_protocol_change).
+FormField = namedtuple('FormField', ['tab', 'name', 'label', 'widget', 'placeholder', 'items', 'check', 'group'],
+                       defaults=['line', None, None, None, None])
+
+DATE_PLACEHOLDER = "YYMMDD or MM/DD/YY"
+LIST_PLACEHOLDER = "Comma-separated values"
+
+FORM_TABS = ["Tissue", "FACS", "cDNA", "Libraries"]
+FORM_FIELDS = [
+    FormField("Tissue", "project_input", "Project:", "combo", items=["HMBA_CjAtlas_Subcortex", "Other"]),
+    FormField("Tissue", "project_name_input", None),
+    FormField("Tissue", "date_input", "Experiment Date:", placeholder=DATE_PLACEHOLDER,
+              check=("Experiment date", "date")),
+    FormField("Tissue", "marmoset_input", "Marmoset Name:", "combo", items=donor_names),
+    FormField("Tissue", "hemisphere_input", "Hemisphere:", "combo", items=["Left (LH)", "Right (RH)", "Both"]),
+    FormField("Tissue", "tile_location_input", "Tile Location:", "combo", items=["BS", "CX", "CB"]),
+    FormField("Tissue", "slab_input", "Slab Number:", placeholder="Enter numeric value", check=("Slab number", "int")),
+    FormField("Tissue", "tile_input", "Tile Number:", placeholder="Enter numeric value", check=("Tile number", "int")),
+    FormField("Tissue", "protocol_input", "Protocol:", "combo", items=lambda: list(get_protocols())),
+    FormField("Tissue", "elab_link_input", "eLab Link:", placeholder="Copy the eLab experiment URL"),
+
+    FormField("FACS", "sorter_initials_input", "Sorter Initials:", placeholder="Enter sorter's initials"),
+    FormField("FACS", "sort_method_input", "Sort Method:", "combo", items=["pooled", "unsorted", "DAPI"]),
+    FormField("FACS", "facs_population_input", "FACS Population:", placeholder="Format: XX/XX/XX (e.g., 70/20/10)",
+              check=("FACS proportions", "proportions")),
+    FormField("FACS", "rxn_number_input", "Number of Reactions:", placeholder="Enter number of reactions",
+              check=("Number of reactions", "reaction_count")),
+    FormField("FACS", "expected_recovery_input", "Expected Recovery:", check=("Expected recovery", "int")),
+    FormField("FACS", "nuclei_concentration_input", "Nuclei Concentration:",
+              check=("Nuclei concentration", "concentration")),
+    FormField("FACS", "nuclei_volume_input", "Nuclei Volume (µL):", check=("Nuclei volume", "float")),
+
+    FormField("cDNA", "atac_prep_date_input", "ATAC Library Prep Date:", placeholder=DATE_PLACEHOLDER,
+              check=("ATAC library prep date", "date"), group="ATAC"),
+    FormField("cDNA", "cdna_amp_date_input", "cDNA Amplification Date:", placeholder=DATE_PLACEHOLDER,
+              check=("cDNA amplification date", "date"), group="cdna"),
+    FormField("cDNA", "rna_prep_date_input", "cDNA Library Prep Date:", placeholder=DATE_PLACEHOLDER,
+              check=("cDNA library prep date", "date"), group="RNA"),
+    FormField("cDNA", "cdna_pcr_cycles_input", "cDNA PCR Cycles:", placeholder=LIST_PLACEHOLDER,
+              check=("cDNA PCR cycles", "int_list"), group="cdna"),
+    FormField("cDNA", "cdna_concentration_input", "cDNA Concentration:", placeholder=f"{LIST_PLACEHOLDER} (ng/µL)",
+              check=("cDNA concentration", "float_list"), group="cdna"),
+    FormField("cDNA", "percent_cdna_400bp_input", "Percent cDNA > 400bp:", placeholder=LIST_PLACEHOLDER,
+              check=("Percent cDNA > 400bp", "float_list"), group="cdna"),
+
+    FormField("Libraries", "atac_indices_input", "ATAC Indices:", placeholder=f"{LIST_PLACEHOLDER} (e.g., D4,E5,F6)",
+              check=("ATAC indices", "indices"), group="ATAC"),
+    FormField("Libraries", "library_cycles_atac_input", "ATAC Library Cycles:", placeholder=LIST_PLACEHOLDER,
+              check=("ATAC library cycles", "int_list"), group="ATAC"),
+    FormField("Libraries", "atac_lib_concentration_input", "ATAC Library Concentration:",
+              placeholder=f"{LIST_PLACEHOLDER} (ng/µL)", check=("ATAC library concentration", "float_list"), group="ATAC"),
+    FormField("Libraries", "atac_sizes_input", "ATAC Library Sizes (bp):", placeholder=LIST_PLACEHOLDER,
+              check=("ATAC library sizes", "int_list"), group="ATAC"),
+    FormField("Libraries", "rna_indices_input", "cDNA Indices:", placeholder=f"{LIST_PLACEHOLDER} (e.g., A1,B2,C3)",
+              check=("RNA indices", "indices"), group="RNA"),
+    FormField("Libraries", "library_cycles_rna_input", "cDNA Library Cycles:", placeholder=LIST_PLACEHOLDER,
+              check=("RNA library cycles", "int_list"), group="RNA"),
+    FormField("Libraries", "rna_lib_concentration_input", "cDNA Library Concentration:",
+              placeholder=f"{LIST_PLACEHOLDER} (ng/µL)", check=("RNA library concentration", "float_list"), group="RNA"),
+    FormField("Libraries", "rna_sizes_input", "cDNA Library Sizes (bp):", placeholder=LIST_PLACEHOLDER,
+              check=("RNA library sizes", "int_list"), group="RNA"),
+]
+
+# Validators whose fields take one comma-separated value per reaction
+PER_REACTION_CHECKS = ("int_list", "float_list", "indices")
 
 
 class FocusLineEdit(QLineEdit):
@@ -27,8 +113,22 @@ class FocusLineEdit(QLineEdit):
                 border: 2px solid #0078d7;
                 background-color: #e5f1fb;
             }
+            QLineEdit[invalid="true"] {
+                border: 1px solid #d9534f;
+                background-color: #fdecea;
+            }
+            QLineEdit[invalid="true"]:focus {
+                border: 2px solid #d9534f;
+            }
         """)
 
+    def set_error(self, message):
+        """Mark the field invalid with the reason as its tooltip, or clear the mark with None"""
+        self.setProperty("invalid", message is not None)
+        self.setToolTip(message or "")
+        self.style().unpolish(self)
+        self.style().polish(self)
+
 
 class FocusComboBox(QComboBox):
     """Custom QComboBox with enhanced focus visualization"""
@@ -87,7 +187,108 @@ class FocusComboBox(QComboBox):
         """)
 
 
+class ElabLinkWatcher(QObject):
+    """Keeps the most recent eLab link copied to the clipboard, from Qt's change notifications"""
+    link_copied = pyqtSignal(str)
+
+    def __init__(self, clipboard, parent=None):
+        super().__init__(parent)
+        self.clipboard = clipboard
+        self.latest = None
+        self.consumed = None  # clipboard text whose link was already submitted
+        clipboard.dataChanged.connect(self.check)
+        # macOS only reports clipboard changes made in other apps when this one is activated
+        QApplication.instance().applicationStateChanged.connect(
+            lambda state: state == Qt.ApplicationState.ApplicationActive and self.check())
+        self.check()
+
+    def check(self):
+        text = self.clipboard.text()
+        if text == self.consumed:
+            return
+        self.consumed = None
+        link = find_elab_link(text)
+        if link and link != self.latest:
+            self.latest = link
+            self.link_copied.emit(link)
+
+    def consume(self):
+        """Ignore the link on the clipboard now until something else is copied; then the same link fills again"""
+        self.consumed = self.clipboard.text()
+        self.latest = None
+
+
+class SummaryDialog(QDialog):
+    """Read-only view of the materialized log aggregates, one table per grouping"""
+
+    def __init__(self, aggregates, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Log Summary")
+        self.resize(600, 400)
+
+        layout = QVBoxLayout(self)
+        layout.addWidget(QLabel(f"{aggregates['reactions']} reactions, {aggregates['rows']} rows logged"))
+
+        tabs = QTabWidget()
+        for group, (columns, rows) in summary_tables(aggregates).items():
+            table = QTableWidget(len(rows), len(columns) + 1)
+            table.setHorizontalHeaderLabels([group] + columns)
+            table.setEditTriggers(QTableWidget.EditTrigger.NoEditTriggers)
+            for row_idx, row in enumerate(rows):
+                for col_idx, value in enumerate(row):
+                    table.setItem(row_idx, col_idx, QTableWidgetItem(str(value)))
+            table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.ResizeToContents)
+            tabs.addTab(table, group.replace("_", " ").title())
+        layout.addWidget(tabs)
+
+
+class PreviewDialog(QDialog):
+    """The rows a submission will write, with their generated names first, for the tech to confirm"""
+
+    def __init__(self, submission, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Preview Submission")
+        self.resize(900, 300)
+
+        headers, rows = submission["headers"], submission["rows"]
+        columns = [headers.index(name) for name in PREVIEW_COLUMNS if name in headers]
+        columns += [col for col in range(len(headers)) if col not in columns]
+
+        layout = QVBoxLayout(self)
+        layout.addWidget(QLabel(f"{len(rows)} rows will be written to the {submission['sheet_name']} sheet "
+                                f"of {os.path.basename(submission['shard_path'])}. "
+                                f"Next P number afterwards: P{str(submission['counters']['next_counter']).zfill(4)}"))
+        missing_indices = registry_warning()
+        if missing_indices:
+            warning = QLabel(missing_indices)
+            warning.setStyleSheet("color: red;")
+            warning.setWordWrap(True)
+            layout.addWidget(warning)
+
+        table = QTableWidget(len(rows), len(columns))
+        table.setHorizontalHeaderLabels([headers[col] for col in columns])
+        table.setEditTriggers(QTableWidget.EditTrigger.NoEditTriggers)
+        for row_idx, (row_data, fill_columns) in enumerate(zip(rows, submission["fills"])):
+            for table_col, col in enumerate(columns):
+                item = QTableWidgetItem("" if row_data[col] is None else str(row_data[col]))
+                if col + 1 in fill_columns:
+                    item.setBackground(QColor("lightgray"))  # black-filled in the log; light here so values stay readable
+                table.setItem(row_idx, table_col, item)
+        table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.ResizeToContents)
+        layout.addWidget(table)
+
+        buttons = QDialogButtonBox()
+        buttons.addButton("Write to Log", QDialogButtonBox.ButtonRole.AcceptRole)
+        buttons.addButton("Back to Form", QDialogButtonBox.ButtonRole.RejectRole)
+        buttons.accepted.connect(self.accept)
+        buttons.rejected.connect(self.reject)
+        layout.addWidget(buttons)
+
+
 class DataLogGUI(QMainWindow):
+    # Pause after the last keystroke before a field is checked
+    VALIDATION_DELAY_MS = 300
+
     def __init__(self):
         super().__init__()
         self.config_dir = os.path.join(os.path.expanduser('~'), 'Library', 'Application Support', 'DataLogApp')
@@ -95,17 +296,11 @@ class DataLogGUI(QMainWindow):
         self.config_file = os.path.join(self.config_dir, 'config.json')
         self.file_location = None
         self.workbook_path = None  # Will be set when user chooses location
+        self.shard_path = None  # shard of the log new rows go to, resolved when the log is chosen
+        self.header_cache = {}  # sheet of that shard -> header row
         self.setWindowTitle("Krienen Data Logger")
 
         # Initialize these values early as they're lightweight
-        self.name_to_code = {
-            "Croissant": "CJ23.56.002",
-            "Nutmeg": "CJ23.56.003",
-            "Jellybean": "CJ24.56.001",
-            "Rambo": "CJ24.56.004",
-            "Morel": "CJ24.56.015"
-        }
-
         self.tile_location_map = {
             "BRAINSTEM": "BS",
             "BS": "BS",
@@ -137,11 +332,37 @@ class DataLogGUI(QMainWindow):
         self.default_font = Font(name="Arial", size=10)
         self.bold_font = Font(name="Arial", size=10, bold=True)
 
+        # Finish any submission journaled before a crash or while the log was open in Excel
+        self.replay_journal()
+
         # Load counter data in the background
         self.load_counter_data()
 
-        # Setup enter key navigation after UI is completely initialized
-        self.setup_enter_key_navigation()
+        # Read what previews need from the log now rather than on the first submit
+        if os.path.exists(self.config_file):
+            with open(self.config_file, 'r') as f:
+                self.workbook_path = json.load(f).get('file_location')
+            if self.workbook_path:
+                self.load_log_state()
+
+    def replay_journal(self):
+        if not os.path.exists(self.config_file):
+            return
+        with open(self.config_file, 'r') as f:
+            file_location = json.load(f).get('file_location')
+        try:
+            written = not file_location or apply_pending(file_location, self.COUNTER_FILE)
+        except LockTimeout:
+            return  # another station is writing the log; pending entries go with the next submission
+        except (OSError, ValueError) as e:
+            # e.g. a journaled undo whose rows were edited by hand since; submissions fail until it is sorted out
+            QMessageBox.warning(self, "Warning", f"The journal of {file_location} could not be replayed:\n{e}\n"
+                                                 f"Nothing can be saved until it is sorted out.")
+            return
+        if not written:
+            QMessageBox.warning(self, "Warning",
+                                f"Earlier submissions are still waiting to be written to {file_location}.\n"
+                                f"Close it in Excel; they will be written with the next submission.")
 
     def get_save_location(self):
         if os.path.exists(self.config_file):
@@ -186,8 +407,8 @@ class DataLogGUI(QMainWindow):
                 'krienen_lab_identifier': [self.krienen_lab_identifier],
                 'seq_portal': [self.seq_portal],
                 # ... add all your other fields here ...
-                'Current Date and Time (UTC)': ["2025-03-24 15:02:44"],
-                'Current User Login': ["lakmecaceres"]
+                'Current Date and Time (UTC)': [self.get_current_time()],
+                'Current User Login': [self.get_current_user()]
             }
             df = pd.DataFrame(data)
             df.to_excel(file_location, index=False)
@@ -196,12 +417,10 @@ class DataLogGUI(QMainWindow):
             QMessageBox.critical(self, "Error", f"Failed to save file: {str(e)}")
 
     def get_current_time(self):
-        # Return fixed time as provided
-        return "2025-03-24 15:02:44"
+        return utc_now()
 
     def get_current_user(self):
-        # Return fixed user as provided
-        return "lakmecaceres"
+        return current_user()
 
     def init_ui(self):
         self.setGeometry(100, 100, 800, 600)
@@ -225,23 +444,15 @@ class DataLogGUI(QMainWindow):
         self.tab_widget = QTabWidget()
         main_layout.addWidget(self.tab_widget)
 
-        # Create tabs
-        tissue_tab = QWidget()
-        facs_tab = QWidget()
-        library_tab = QWidget()
-        indices_tab = QWidget()
+        # Create the tabs and their fields from the form schema
+        self.build_form()
+        self.setup_form_behavior()
 
-        # Setup layouts for each tab
-        self.setup_basic_tab(tissue_tab)
-        self.setup_facs_tab(facs_tab)
-        self.setup_library_tab(library_tab)
-        self.setup_indices_tab(indices_tab)
+        # Enable only the fields the selected protocol uses
+        self.on_protocol_change(self.protocol_input.currentText())
 
-        # Add tabs to widget with new names
-        self.tab_widget.addTab(tissue_tab, "Tissue")
-        self.tab_widget.addTab(facs_tab, "FACS")
-        self.tab_widget.addTab(library_tab, "cDNA")
-        self.tab_widget.addTab(indices_tab, "Libraries")
+        # Check fields as they are typed
+        self.setup_validation()
 
         # Add submit button
         self.submit_btn = QPushButton('Submit')
@@ -262,28 +473,108 @@ class DataLogGUI(QMainWindow):
                 background-color: #004e8c;
             }
         """)
-        main_layout.addWidget(self.submit_btn, alignment=Qt.AlignmentFlag.AlignCenter)
-
-    def setup_enter_key_navigation(self):
-        """Set up navigation to next field when Enter key is pressed"""
-        # Create a list of all input widgets
-        self.input_widgets = []
-
-        # Add widgets from all tabs
-        for tab_index in range(self.tab_widget.count()):
-            tab = self.tab_widget.widget(tab_index)
-            for child in tab.findChildren(QWidget):
-                if isinstance(child, QLineEdit):
-                    self.input_widgets.append(child)
-                    child.returnPressed.connect(self.on_return_pressed)
-                elif isinstance(child, QComboBox):
-                    self.input_widgets.append(child)
-                    child.installEventFilter(self)
+
+        # Summary and undo buttons next to submit
+        self.summary_btn = QPushButton('Summary')
+        self.summary_btn.clicked.connect(self.on_summary)
+        self.undo_btn = QPushButton('Undo Last')
+        self.undo_btn.clicked.connect(self.on_undo)
+        self.validation_label = QLabel()
+        self.validation_label.setStyleSheet("color: #d9534f;")
+        main_layout.addWidget(self.validation_label)
+
+        button_layout = QHBoxLayout()
+        button_layout.addStretch()
+        button_layout.addWidget(self.summary_btn)
+        button_layout.addWidget(self.undo_btn)
+        button_layout.addWidget(self.submit_btn)
+        button_layout.addStretch()
+        main_layout.addLayout(button_layout)
+
+    # --- Form ---
+    def build_form(self):
+        """Create the tabs and fields of FORM_FIELDS, and the lookups Enter-key navigation and validation use"""
+        self.focus_chain = []     # fields in Enter-key order
+        self.focus_position = {}  # field -> its position in focus_chain
+        self.field_tabs = {}      # field -> index of its tab
+        self.field_cells = {}     # field -> (grid layout, row)
+        self.field_groups = {}    # protocol input group -> fields that only it needs
+
+        layouts = {}
+        next_rows = {}
+        for tab_name in FORM_TABS:
+            tab = QWidget()
+            layouts[tab_name] = QGridLayout(tab)
+            next_rows[tab_name] = 0
+            self.tab_widget.addTab(tab, tab_name)
+
+        for spec in FORM_FIELDS:
+            if spec.widget == "combo":
+                field = FocusComboBox()
+                field.addItems(spec.items() if callable(spec.items) else spec.items)
+                field.installEventFilter(self)
+            else:
+                field = FocusLineEdit()
+                if spec.placeholder:
+                    field.setPlaceholderText(spec.placeholder)
+                field.returnPressed.connect(self.on_return_pressed)
+
+            layout = layouts[spec.tab]
+            if spec.label is None:
+                row = next_rows[spec.tab] - 1
+                layout.addWidget(field, row, 2)
+            else:
+                row = next_rows[spec.tab]
+                next_rows[spec.tab] += 1
+                layout.addWidget(QLabel(spec.label), row, 0)
+                layout.addWidget(field, row, 1)
+
+            setattr(self, spec.name, field)
+            self.focus_position[field] = len(self.focus_chain)
+            self.focus_chain.append(field)
+            self.field_tabs[field] = FORM_TABS.index(spec.tab)
+            self.field_cells[field] = (layout, row)
+            if spec.group:
+                self.field_groups.setdefault(spec.group, []).append(field)
+
+    def add_beside(self, field, widget):
+        layout, row = self.field_cells[field]
+        layout.addWidget(widget, row, 2)
+
+    def setup_form_behavior(self):
+        """Connect the fields that change other fields, and add the widgets beside them"""
+        self.project_input.currentTextChanged.connect(self.on_project_change)
+        self.project_name_input.setVisible(False)
+
+        # Pick up donors added to donors.json while the app is open
+        self.donors_watcher = QFileSystemWatcher([DONORS_PATH], self)
+        self.donors_watcher.fileChanged.connect(self.on_donors_changed)
+
+        # Protocol templates from protocols.json
+        self.protocol_input.setCurrentText(DEFAULT_PROTOCOL)
+        self.protocol_input.currentTextChanged.connect(self.on_protocol_change)
+
+        # eLab link, filled in whenever one is copied
+        self.elab_watcher = ElabLinkWatcher(QApplication.clipboard(), self)
+        self.elab_watcher.link_copied.connect(self.elab_link_input.setText)
+        self.elab_link_input.setText(self.elab_watcher.latest or "")
+
+        self.sort_method_input.currentTextChanged.connect(self.on_sort_method_change)
+
+        # Fill sizes and concentrations from instrument exports
+        self.import_buttons = {}
+        for group, field in (("cdna", self.percent_cdna_400bp_input), ("ATAC", self.atac_sizes_input),
+                             ("RNA", self.rna_sizes_input)):
+            button = QPushButton("Import Export...")
+            button.clicked.connect(lambda checked, group=group: self.import_instrument_export(group))
+            self.add_beside(field, button)
+            self.field_groups[group].append(button)
+            self.import_buttons[group] = button
 
     def on_return_pressed(self):
         """Handle Return key press for any input widget"""
         sender = self.sender()
-        if sender in self.input_widgets:
+        if sender in self.focus_position:
             self.move_to_next_widget(sender)
 
     def eventFilter(self, obj, event):
@@ -297,178 +588,16 @@ class DataLogGUI(QMainWindow):
         return super().eventFilter(obj, event)
 
     def move_to_next_widget(self, current_widget):
-        """Move focus to the next widget in the input widgets list"""
-        try:
-            current_index = self.input_widgets.index(current_widget)
-            next_index = (current_index + 1) % len(self.input_widgets)
-            next_widget = self.input_widgets[next_index]
-
-            # If we're moving to a widget on a different tab, switch to that tab
-            for tab_index in range(self.tab_widget.count()):
-                tab = self.tab_widget.widget(tab_index)
-                if self.widget_is_in_tab(next_widget, tab):
-                    if tab_index != self.tab_widget.currentIndex():
-                        self.tab_widget.setCurrentIndex(tab_index)
-                    break
-
-            next_widget.setFocus()
-        except (ValueError, IndexError) as e:
-            print(f"Navigation error: {e}")
-            # If widget is not in list or there's an error, do nothing
-            pass
-
-    def widget_is_in_tab(self, widget, tab):
-        """Check if a widget is contained within a tab"""
-        if widget is tab:
-            return True
-
-        # Check if widget is directly in tab's children
-        if widget in tab.findChildren(widget.__class__):
-            return True
-
-        # Check parent chain
-        parent = widget.parent()
-        while parent:
-            if parent is tab:
-                return True
-            parent = parent.parent()
-
-        return False
-
-    def setup_basic_tab(self, tab):
-        layout = QGridLayout()
-
-        # Project selection (at top)
-        self.project_input = FocusComboBox()
-        self.project_input.addItems(["HMBA_CjAtlas_Subcortex", "Other"])
-        self.project_input.currentTextChanged.connect(self.on_project_change)
-        layout.addWidget(QLabel("Project:"), 0, 0)
-        layout.addWidget(self.project_input, 0, 1)
-        self.project_name_input = FocusLineEdit()
-        self.project_name_input.setVisible(False)
-        layout.addWidget(self.project_name_input, 0, 2)
-
-        # Date input with validation
-        self.date_input = FocusLineEdit()
-        self.date_input.setPlaceholderText("YYMMDD or MM/DD/YY")
-        layout.addWidget(QLabel("Experiment Date:"), 1, 0)
-        layout.addWidget(self.date_input, 1, 1)
-
-        # Marmoset name with dropdown
-        self.marmoset_input = FocusComboBox()
-        self.marmoset_input.addItems(self.name_to_code.keys())
-        layout.addWidget(QLabel("Marmoset Name:"), 2, 0)
-        layout.addWidget(self.marmoset_input, 2, 1)
-
-        # Hemisphere selection
-        self.hemisphere_input = FocusComboBox()
-        self.hemisphere_input.addItems(["Left (LH)", "Right (RH)", "Both"])
-        layout.addWidget(QLabel("Hemisphere:"), 3, 0)
-        layout.addWidget(self.hemisphere_input, 3, 1)
-
-        # Tile location as a simple dropdown (NOT editable)
-        self.tile_location_input = FocusComboBox()
-        self.tile_location_input.addItems(["BS", "CX", "CB"])
-        # No longer editable - making it a pure dropdown
-        layout.addWidget(QLabel("Tile Location:"), 4, 0)
-        layout.addWidget(self.tile_location_input, 4, 1)
-
-        # Slab and tile numbers
-        self.slab_input = FocusLineEdit()
-        self.slab_input.setPlaceholderText("Enter numeric value")
-        layout.addWidget(QLabel("Slab Number:"), 5, 0)
-        layout.addWidget(self.slab_input, 5, 1)
-
-        self.tile_input = FocusLineEdit()
-        self.tile_input.setPlaceholderText("Enter numeric value")
-        layout.addWidget(QLabel("Tile Number:"), 6, 0)
-        layout.addWidget(self.tile_input, 6, 1)
-
-        # Set layout for this tab
-        tab.setLayout(layout)
-
-    def setup_facs_tab(self, tab):
-        layout = QGridLayout()
-
-        # Sorter Initials
-        self.sorter_initials_input = FocusLineEdit()
-        self.sorter_initials_input.setPlaceholderText("Enter sorter's initials")
-        layout.addWidget(QLabel("Sorter Initials:"), 0, 0)
-        layout.addWidget(self.sorter_initials_input, 0, 1)
-
-        # Sort method
-        self.sort_method_input = FocusComboBox()
-        self.sort_method_input.addItems(["pooled", "unsorted", "DAPI"])
-        self.sort_method_input.currentTextChanged.connect(self.on_sort_method_change)
-        layout.addWidget(QLabel("Sort Method:"), 1, 0)
-        layout.addWidget(self.sort_method_input, 1, 1)
-
-        # FACS population (moved before number of reactions)
-        self.facs_population_input = FocusLineEdit()
-        self.facs_population_input.setPlaceholderText("Format: XX/XX/XX (e.g., 70/20/10)")
-        layout.addWidget(QLabel("FACS Population:"), 2, 0)
-        layout.addWidget(self.facs_population_input, 2, 1)
-
-        # Number of Reactions
-        self.rxn_number_input = FocusLineEdit()
-        self.rxn_number_input.setPlaceholderText("Enter number of reactions")
-        layout.addWidget(QLabel("Number of Reactions:"), 3, 0)
-        layout.addWidget(self.rxn_number_input, 3, 1)
-
-        # Expected Recovery
-        self.expected_recovery_input = FocusLineEdit()
-        layout.addWidget(QLabel("Expected Recovery:"), 4, 0)
-        layout.addWidget(self.expected_recovery_input, 4, 1)
-
-        # Nuclei Concentration
-        self.nuclei_concentration_input = FocusLineEdit()
-        layout.addWidget(QLabel("Nuclei Concentration:"), 5, 0)
-        layout.addWidget(self.nuclei_concentration_input, 5, 1)
-
-        # Nuclei Volume
-        self.nuclei_volume_input = FocusLineEdit()
-        layout.addWidget(QLabel("Nuclei Volume (µL):"), 6, 0)
-        layout.addWidget(self.nuclei_volume_input, 6, 1)
-
-        tab.setLayout(layout)
-
-    def setup_library_tab(self, tab):
-        layout = QGridLayout()
-
-        # Library dates - reordered with ATAC first, then cDNA Amplification
-        self.atac_prep_date_input = FocusLineEdit()
-        self.atac_prep_date_input.setPlaceholderText("YYMMDD or MM/DD/YY")
-        layout.addWidget(QLabel("ATAC Library Prep Date:"), 0, 0)
-        layout.addWidget(self.atac_prep_date_input, 0, 1)
-
-        self.cdna_amp_date_input = FocusLineEdit()
-        self.cdna_amp_date_input.setPlaceholderText("YYMMDD or MM/DD/YY")
-        layout.addWidget(QLabel("cDNA Amplification Date:"), 1, 0)
-        layout.addWidget(self.cdna_amp_date_input, 1, 1)
-
-        self.rna_prep_date_input = FocusLineEdit()
-        self.rna_prep_date_input.setPlaceholderText("YYMMDD or MM/DD/YY")
-        layout.addWidget(QLabel("cDNA Library Prep Date:"), 2, 0)
-        layout.addWidget(self.rna_prep_date_input, 2, 1)
-
-        # PCR cycles
-        self.cdna_pcr_cycles_input = FocusLineEdit()
-        self.cdna_pcr_cycles_input.setPlaceholderText("Comma-separated values")
-        layout.addWidget(QLabel("cDNA PCR Cycles:"), 3, 0)
-        layout.addWidget(self.cdna_pcr_cycles_input, 3, 1)
-
-        # cDNA metrics
-        self.cdna_concentration_input = FocusLineEdit()
-        self.cdna_concentration_input.setPlaceholderText("Comma-separated values (ng/µL)")
-        layout.addWidget(QLabel("cDNA Concentration:"), 4, 0)
-        layout.addWidget(self.cdna_concentration_input, 4, 1)
-
-        self.percent_cdna_400bp_input = FocusLineEdit()
-        self.percent_cdna_400bp_input.setPlaceholderText("Comma-separated values")
-        layout.addWidget(QLabel("Percent cDNA > 400bp:"), 5, 0)
-        layout.addWidget(self.percent_cdna_400bp_input, 5, 1)
-
-        tab.setLayout(layout)
+        """Move focus to the next field in the focus chain, skipping fields that are not in use"""
+        position = self.focus_position.get(current_widget)
+        if position is None:
+            return
+        count = len(self.focus_chain)
+        for step in range(1, count):
+            next_widget = self.focus_chain[(position + step) % count]
+            if next_widget.isEnabled() and not next_widget.isHidden():
+                self.focus_field(next_widget)
+                return
 
     def on_sort_method_change(self, value):
         # Update FACS population field based on sort method
@@ -485,6 +614,31 @@ class DataLogGUI(QMainWindow):
     def on_project_change(self, value):
         self.project_name_input.setVisible(value == "Other")
 
+    def on_donors_changed(self, path):
+        # Editors that save by replacing the file drop it from the watcher
+        if path not in self.donors_watcher.files() and os.path.exists(path):
+            self.donors_watcher.addPath(path)
+        try:
+            names = donor_names()
+        except (OSError, ValueError) as e:
+            print(f"Could not reload {path}: {e}")
+            return
+
+        current = self.marmoset_input.currentText()
+        self.marmoset_input.blockSignals(True)
+        self.marmoset_input.clear()
+        self.marmoset_input.addItems(names)
+        if current in names:
+            self.marmoset_input.setCurrentText(current)
+        self.marmoset_input.blockSignals(False)
+
+    def on_protocol_change(self, value):
+        protocol = get_protocol(value)
+        used = input_groups(protocol) | ({"cdna"} if needs_cdna(protocol) else set())
+        for group, fields in self.field_groups.items():
+            for field in fields:
+                field.setEnabled(group in used)
+
     def load_counter_data(self):
         if os.path.exists(self.COUNTER_FILE):
             with open(self.COUNTER_FILE, 'r') as f:
@@ -498,53 +652,19 @@ class DataLogGUI(QMainWindow):
         self.counter_data.setdefault("next_counter", 90)
         self.counter_data.setdefault("date_info", {})
         self.counter_data.setdefault("amp_counter", {})
+        if self.workbook_path:
+            self.seed_library_index()
 
-    def setup_indices_tab(self, tab):
-        layout = QGridLayout()
-
-        # ATAC fields - reordered to put indices first
-        self.atac_indices_input = FocusLineEdit()
-        self.atac_indices_input.setPlaceholderText("Comma-separated values (e.g., D4,E5,F6)")
-        layout.addWidget(QLabel("ATAC Indices:"), 0, 0)
-        layout.addWidget(self.atac_indices_input, 0, 1)
-
-        self.library_cycles_atac_input = FocusLineEdit()
-        self.library_cycles_atac_input.setPlaceholderText("Comma-separated values")
-        layout.addWidget(QLabel("ATAC Library Cycles:"), 1, 0)
-        layout.addWidget(self.library_cycles_atac_input, 1, 1)
-
-        self.atac_lib_concentration_input = FocusLineEdit()
-        self.atac_lib_concentration_input.setPlaceholderText("Comma-separated values (ng/µL)")
-        layout.addWidget(QLabel("ATAC Library Concentration:"), 2, 0)
-        layout.addWidget(self.atac_lib_concentration_input, 2, 1)
-
-        self.atac_sizes_input = FocusLineEdit()
-        self.atac_sizes_input.setPlaceholderText("Comma-separated values")
-        layout.addWidget(QLabel("ATAC Library Sizes (bp):"), 3, 0)
-        layout.addWidget(self.atac_sizes_input, 3, 1)
-
-        # cDNA fields - reordered to put indices first
-        self.rna_indices_input = FocusLineEdit()
-        self.rna_indices_input.setPlaceholderText("Comma-separated values (e.g., A1,B2,C3)")
-        layout.addWidget(QLabel("cDNA Indices:"), 4, 0)
-        layout.addWidget(self.rna_indices_input, 4, 1)
-
-        self.library_cycles_rna_input = FocusLineEdit()
-        self.library_cycles_rna_input.setPlaceholderText("Comma-separated values")
-        layout.addWidget(QLabel("cDNA Library Cycles:"), 5, 0)
-        layout.addWidget(self.library_cycles_rna_input, 5, 1)
-
-        self.rna_lib_concentration_input = FocusLineEdit()
-        self.rna_lib_concentration_input.setPlaceholderText("Comma-separated values (ng/µL)")
-        layout.addWidget(QLabel("cDNA Library Concentration:"), 6, 0)
-        layout.addWidget(self.rna_lib_concentration_input, 6, 1)
-
-        self.rna_sizes_input = FocusLineEdit()
-        self.rna_sizes_input.setPlaceholderText("Comma-separated values")
-        layout.addWidget(QLabel("cDNA Library Sizes (bp):"), 7, 0)
-        layout.addWidget(self.rna_sizes_input, 7, 1)
-
-        tab.setLayout(layout)
+    def seed_library_index(self):
+        """Seed the library name index from the existing log the first time it is used"""
+        if "index_counter" not in self.counter_data:
+            self.counter_data["index_counter"] = seed_index_counter(iter_rows(self.workbook_path))
+
+    def load_log_state(self):
+        """Read the shard new rows go to, its header rows and the library name index once, so previews only compute"""
+        self.shard_path = active_shard_path(self.workbook_path)
+        self.header_cache = shard_headers(self.shard_path)
+        self.seed_library_index()
 
     def convert_index(self, index):
         index = index.strip().upper()
@@ -583,173 +703,260 @@ class DataLogGUI(QMainWindow):
         except ValueError:
             return None
 
-    def validate_inputs(self):
-        # Basic validation
-        current_date = self.convert_date(self.date_input.text())
-        if not current_date:
-            QMessageBox.warning(self, "Validation Error", "Please enter a valid date.")
-            return False
+    # --- Instrument exports ---
+    def instrument_targets(self):
+        """For each input group, the field its reactions are matched by and the fields an export fills"""
+        return {
+            "cdna": (None, {"concentration": self.cdna_concentration_input,
+                            "percent_over_400bp": self.percent_cdna_400bp_input}),
+            "RNA": (self.rna_indices_input, {"size": self.rna_sizes_input,
+                                             "concentration": self.rna_lib_concentration_input}),
+            "ATAC": (self.atac_indices_input, {"size": self.atac_sizes_input,
+                                               "concentration": self.atac_lib_concentration_input}),
+        }
+
+    def import_instrument_export(self, group):
+        """Fill a group's sizes and concentrations from TapeStation or plate reader CSV exports"""
+        match_field, targets = self.instrument_targets()[group]
+        key_field = match_field or self.rxn_number_input
+        error = self.field_error(key_field)
+        if error:
+            QMessageBox.warning(self, "Import Export", f"{error} to match the export to the reactions.")
+            self.focus_field(key_field)
+            return
+
+        paths, _ = QFileDialog.getOpenFileNames(self, "Import Instrument Export", "", "CSV Files (*.csv);;All Files (*)")
+        if not paths:
+            return
+
+        try:
+            plates = read_exports(paths)
+            plate = None
+            if len(plate_names(plates)) > 1:
+                plate, ok = QInputDialog.getItem(self, "Import Export", "Plate:", plate_names(plates), 0, False)
+                if not ok:
+                    return
+            if match_field:
+                kit = index_kit(get_protocol(self.protocol_input.currentText()), group)
+                records = match_reactions(select_plate(plates, plate), indices=self.parsed(match_field), kit=kit)
+            else:
+                records = match_reactions(select_plate(plates, plate), count=self.parsed(self.rxn_number_input))
+        except (OSError, ValueError) as e:
+            QMessageBox.warning(self, "Import Export", str(e))
+            return
+
+        filled = 0
+        for name, field in targets.items():
+            try:
+                values = field_values(records, name)
+            except ValueError:
+                continue  # e.g. a plate reader export has no sizes
+            field.setText(format_values(values, name))
+            filled += 1
+        if not filled:
+            QMessageBox.warning(self, "Import Export", "The export has none of these values for every reaction.")
+
+    # --- Validation ---
+    def setup_validation(self):
+        """Parse each field shortly after it is edited and mark it in place if it is invalid"""
+        def number(convert):
+            def parse(text):
+                try:
+                    return convert(text)
+                except ValueError:
+                    raise ValueError("must be a number")
+            return parse
+
+        def number_list(convert):
+            def parse(text):
+                try:
+                    return [convert(value.strip()) for value in text.split(',')]
+                except ValueError:
+                    raise ValueError("values must be numbers")
+            return parse
+
+        validators = {
+            "date": self.parse_date,
+            "int": number(int),
+            "float": number(float),
+            "concentration": number(lambda text: float(text.replace(",", ""))),
+            "proportions": self.parse_proportions,
+            "reaction_count": self.parse_reaction_count,
+            "indices": self.parse_indices,
+            "int_list": number_list(int),
+            "float_list": number_list(float),
+        }
 
+        # Field -> (label, parser); a parser raises ValueError on invalid text
+        self.field_parsers = {}
+        # Fields with one comma-separated value per reaction
+        self.reaction_fields = {}
+        for spec in FORM_FIELDS:
+            if spec.check:
+                label, validator = spec.check
+                field = getattr(self, spec.name)
+                self.field_parsers[field] = (label, validators[validator])
+                if validator in PER_REACTION_CHECKS:
+                    self.reaction_fields[field] = self.field_parsers[field]
+
+        # Field -> (text, value, error) of its last parse
+        self.parse_cache = {}
+        self.pending_validation = set()
+        self.validation_timer = QTimer(self)
+        self.validation_timer.setSingleShot(True)
+        self.validation_timer.setInterval(self.VALIDATION_DELAY_MS)
+        self.validation_timer.timeout.connect(self.run_pending_validation)
+
+        for field in self.field_parsers:
+            field.textChanged.connect(lambda text, field=field: self.schedule_validation(field))
+
+    def parse_date(self, text):
+        try:
+            date = self.convert_date(text)
+        except OverflowError:
+            date = None
+        if not date:
+            raise ValueError("not a valid date")
+        return date
+
+    def parse_reaction_count(self, text):
         try:
-            rxn_number = int(self.rxn_number_input.text())
-            if rxn_number <= 0:
-                raise ValueError
+            count = int(text)
         except ValueError:
-            QMessageBox.warning(self, "Validation Error", "Please enter a valid number of reactions.")
-            return False
+            raise ValueError("must be a whole number")
+        if count <= 0:
+            raise ValueError("must be at least 1")
+        return count
 
-        # Validate numerical inputs
+    def parse_proportions(self, text):
         try:
-            slab_int = int(self.slab_input.text())
-            tile_int = int(self.tile_input.text())
+            proportions = [int(p) for p in text.split("/")]
         except ValueError:
-            QMessageBox.warning(self, "Validation Error", "Slab and tile numbers must be numeric values.")
-            return False
+            raise ValueError("must be in format XX/XX/XX")
+        if len(proportions) != 3 or sum(proportions) != 100:
+            raise ValueError("must be three numbers that sum to 100")
+        return text
+
+    def parse_indices(self, text):
+        indices = []
+        for index in text.split(","):
+            converted = self.convert_index(index)
+            if not converted:
+                raise ValueError(f"{index.strip()} is not a valid index (e.g., A1, 2B, C3)")
+            indices.append(self.pad_index(converted))
+        return indices
+
+    def parse_field(self, field):
+        """Return (value, error) for a field, parsing its text only if it changed since the last call"""
+        text = field.text().strip()
+        cached = self.parse_cache.get(field)
+        if cached and cached[0] == text:
+            return cached[1], cached[2]
+
+        label, parser = self.field_parsers[field]
+        try:
+            value, error = parser(text), None
+        except ValueError as e:
+            value, error = None, f"{label} {e}"
+        self.parse_cache[field] = (text, value, error)
+        return value, error
+
+    def parsed(self, field):
+        """The typed value of a validated field"""
+        return self.parse_field(field)[0]
+
+    def field_error(self, field, live=False):
+        """Why a field is invalid, or None; while typing, empty fields are not reported"""
+        if not field.isEnabled():
+            return None
+        if not field.text().strip():
+            return None if live else f"{self.field_parsers[field][0]} is required"
 
-        # Validate FACS population for pooled samples
-        if self.sort_method_input.currentText().lower() == "pooled":
-            proportions = self.facs_population_input.text().strip()
-            if "/" not in proportions:
-                QMessageBox.warning(self, "Validation Error",
-                                    "Please enter FACS population proportions in format XX/XX/XX")
-                return False
-            try:
-                proportions_list = [int(p) for p in proportions.split("/")]
-                if len(proportions_list) != 3 or sum(proportions_list) != 100:
-                    raise ValueError
-            except ValueError:
-                QMessageBox.warning(self, "Validation Error", "FACS proportions must be three numbers that sum to 100")
-                return False
-
-        for field, field_name in [
-            (self.percent_cdna_400bp_input, "Percent cDNA > 400bp"),
-            (self.cdna_concentration_input, "cDNA concentration"),
-            (self.rna_lib_concentration_input, "RNA library concentration"),
-            (self.atac_lib_concentration_input, "ATAC library concentration")
-        ]:
-            values = field.text().strip().split(',')
-            try:
-                values = [float(x.strip()) for x in values]
-                if len(values) != rxn_number:
-                    QMessageBox.warning(self, "Validation Error",
-                                        f"{field_name} must have {rxn_number} comma-separated values")
-                    return False
-            except ValueError:
-                QMessageBox.warning(self, "Validation Error",
-                                    f"{field_name} values must be numbers")
-                return False
-
-        # Validate comma-separated inputs match reaction number
-        fields_to_validate = [
-            (self.cdna_pcr_cycles_input, "cDNA PCR cycles"),
-            (self.rna_indices_input, "RNA indices"),
-            (self.atac_indices_input, "ATAC indices"),
-            (self.rna_sizes_input, "RNA library sizes"),
-            (self.atac_sizes_input, "ATAC library sizes"),
-            (self.library_cycles_rna_input, "RNA library cycles"),
-            (self.library_cycles_atac_input, "ATAC library cycles")
-        ]
-
-        for field, field_name in fields_to_validate:
-            values = field.text().strip().split(',')
-            if len(values) != rxn_number:
-                QMessageBox.warning(self, "Validation Error",
-                                    f"{field_name} must have {rxn_number} comma-separated values")
-                return False
+        value, error = self.parse_field(field)
+        if error or field not in self.reaction_fields:
+            return error
 
-        return True
+        rxn_number, count_error = self.parse_field(self.rxn_number_input)
+        if not count_error and len(value) != rxn_number:
+            return f"{self.reaction_fields[field][0]} must have {rxn_number} comma-separated values"
+        return None
 
-    def initialize_excel(self):
-        # Import openpyxl only when needed
-        from openpyxl import Workbook
-        from openpyxl.styles import Font, PatternFill, NamedStyle
-
-        wb = Workbook()
-        ws = wb.active
-        ws.title = "HMBA"
-
-        # Create default style (Arial 10)
-        default_style = NamedStyle(name="default_style")
-        default_style.font = Font(name="Arial", size=10)
-        wb.add_named_style(default_style)
-
-        # Create bold style (Arial 10 bold)
-        bold_style = NamedStyle(name="bold_style")
-        bold_style.font = Font(name="Arial", size=10, bold=True)
-        wb.add_named_style(bold_style)
-
-        # Apply default style to entire worksheet
-        for row in ws.iter_rows():
-            for cell in row:
-                cell.style = "default_style"
-
-        headers = ['krienen_lab_identifier', 'seq_portal', 'elab_link', 'experiment_start_date',
-                   'mit_name', 'donor_name', 'tissue_name', 'tissue_name_old',
-                   'dissociated_cell_sample_name', 'facs_population_plan', 'cell_prep_type',
-                   'study', 'enriched_cell_sample_container_name', 'expc_cell_capture',
-                   'port_well', 'enriched_cell_sample_name', 'enriched_cell_sample_quantity_count',
-                   'barcoded_cell_sample_name', 'library_method', 'cDNA_amplification_method',
-                   'cDNA_amplification_date', 'amplified_cdna_name', 'cDNA_pcr_cycles',
-                   'rna_amplification_pass_fail', 'percent_cdna_longer_than_400bp',
-                   'cdna_amplified_quantity_ng', 'cDNA_library_input_ng', 'library_creation_date',
-                   'library_prep_set', 'library_name', 'tapestation_avg_size_bp',
-                   'library_num_cycles', 'lib_quantification_ng', 'library_prep_pass_fail',
-                   'r1_index', 'r2_index', 'ATAC_index']
-
-        ws.append(headers)
-
-        # Apply bold style to headers
-        for col_num, header in enumerate(headers, start=1):
-            ws.cell(row=1, column=col_num).style = "bold_style"
-
-        return wb
-
-    def process_form_data(self):
-        # Import heavy modules only when needed
-        from openpyxl import load_workbook
-        from openpyxl.utils import get_column_letter
-        import pyperclip
+    def schedule_validation(self, field):
+        self.pending_validation.add(field)
+        # A new reaction count changes which lists have the right length
+        if field is self.rxn_number_input:
+            self.pending_validation.update(self.reaction_fields)
+        self.validation_timer.start()
 
-        # Load or create workbook
-        if self.workbook_path and os.path.exists(self.workbook_path):
-            workbook = load_workbook(self.workbook_path)
-        else:
-            workbook = self.initialize_excel()
-
-        worksheet = workbook.active
-
-        # Fix: Properly detect the actual last row with content
-        # This is more reliable than using max_row which can be misleading after manual deletion
-        last_row_with_content = 1  # Assume at least headers exist
-        for row_idx in range(1, worksheet.max_row + 1):
-            row_has_content = False
-            for cell in worksheet[row_idx]:
-                if cell.value is not None:
-                    row_has_content = True
-                    break
-            if row_has_content:
-                last_row_with_content = row_idx
-
-        # Start at row 2 if only headers exist (row 1), otherwise start after the last content row
-        current_row = last_row_with_content + 1
-
-        # Get form values
-        current_date = self.convert_date(self.date_input.text())
-        mit_name_input = self.marmoset_input.currentText()
-        mit_name = "cj" + mit_name_input
-        donor_name = self.name_to_code[mit_name_input]  # Define donor_name here
+    def run_pending_validation(self):
+        for field in self.pending_validation:
+            field.set_error(self.field_error(field, live=True))
+        self.pending_validation.clear()
+
+        errors = [field.toolTip() for field in self.field_parsers if field.property("invalid")]
+        self.validation_label.setText(errors[0] + (f" (and {len(errors) - 1} more)" if len(errors) > 1 else "")
+                                      if errors else "")
+
+    def validate_inputs(self):
+        """Check every field, reusing the parses made while typing, and report all problems at once"""
+        self.validation_timer.stop()
+        self.pending_validation.clear()
+
+        errors = []
+        first_invalid = None
+        for field in self.field_parsers:
+            error = self.field_error(field)
+            field.set_error(error)
+            if error:
+                errors.append(error)
+                first_invalid = first_invalid or field
+        self.run_pending_validation()
+
+        # The marmoset list is empty when there is no donors.json
+        if find_donor(self.marmoset_input.currentText()) is None:
+            errors.append(f"Marmoset {self.marmoset_input.currentText() or '(none)'} is not in {DONORS_PATH}")
+            first_invalid = first_invalid or self.marmoset_input
+
+        if errors:
+            QMessageBox.warning(self, "Validation Error", "\n".join(errors))
+            self.focus_field(first_invalid)
+            return False
+        return True
+
+    def focus_field(self, field):
+        tab_index = self.field_tabs[field]
+        if tab_index != self.tab_widget.currentIndex():
+            self.tab_widget.setCurrentIndex(tab_index)
+        field.setFocus()
+
+    def prepare_submission(self):
+        """Generate the rows of the form against a copy of the counters, without reading or writing files
+
+        Works from the state load_log_state cached (read here only if the log
+        was set without it). Returns the submission (sheet, headers, rows,
+        fills and the counters after it) for commit_submission.
+        """
+        if self.shard_path is None or "index_counter" not in self.counter_data:
+            self.load_log_state()
+        counters = copy.deepcopy(self.counter_data)
+
+        # Get form values, typed by the validation parses
+        current_date = self.parsed(self.date_input)
+        donor = find_donor(self.marmoset_input.currentText())
+        mit_name = "cj" + donor["name"]
+        donor_name = donor["code"]
 
         # Process slab and hemisphere
-        slab = self.slab_input.text().strip()
+        slab = self.parsed(self.slab_input)
         hemisphere = self.hemisphere_input.currentText().split()[0].upper()
         if hemisphere == "RIGHT":
-            slab = str(int(slab) + 40).zfill(2)
+            slab = str(slab + 40).zfill(2)
         elif hemisphere == "BOTH":
-            slab = str(int(slab) + 90).zfill(2)
+            slab = str(slab + 90).zfill(2)
         else:
-            slab = slab.zfill(2)
+            slab = str(slab).zfill(2)
 
-        tile = str(int(self.tile_input.text())).zfill(2)
+        tile = str(self.parsed(self.tile_input)).zfill(2)
 
         # Process tile location
         tile_location_abbr = self.tile_location_input.currentText()
@@ -766,16 +973,16 @@ class DataLogGUI(QMainWindow):
             facs_population = "DAPI"
 
         # Get reaction number and update counters
-        rxn_number = int(self.rxn_number_input.text())
+        rxn_number = self.parsed(self.rxn_number_input)
 
         # Update date_info
-        if current_date not in self.counter_data["date_info"]:
-            self.counter_data["date_info"][current_date] = {
+        if current_date not in counters["date_info"]:
+            counters["date_info"][current_date] = {
                 "total_reactions": 0,
                 "batches": []
             }
 
-        date_info = self.counter_data["date_info"]
+        date_info = counters["date_info"]
         date_entry = date_info[current_date]
         existing_total = date_entry["total_reactions"]
 
@@ -785,8 +992,8 @@ class DataLogGUI(QMainWindow):
         batches_after = (total_reactions_after + 7) // 8
         new_batches_needed = batches_after - batches_before
 
-        new_p_numbers = [self.counter_data["next_counter"] + i for i in range(new_batches_needed)]
-        self.counter_data["next_counter"] += new_batches_needed
+        new_p_numbers = [counters["next_counter"] + i for i in range(new_batches_needed)]
+        counters["next_counter"] += new_batches_needed
 
         all_batches = date_entry["batches"].copy()
         all_batches.extend({"p_number": p, "count": 0} for p in new_p_numbers)
@@ -804,179 +1011,99 @@ class DataLogGUI(QMainWindow):
         date_entry["total_reactions"] = total_reactions_after
         date_entry["batches"] = all_batches
 
-        # Process indices
-        atac_indices = [self.convert_index(index) for index in self.atac_indices_input.text().split(",")]
-        atac_indices = [self.pad_index(index) for index in atac_indices]
-
-        rna_indices = [self.convert_index(index) for index in self.rna_indices_input.text().split(",")]
-        rna_indices = [self.pad_index(index) for index in rna_indices]
+        protocol = get_protocol(self.protocol_input.currentText())
+        groups = input_groups(protocol)
 
         # Initialize common values
         seq_portal = "no"
-        elab_link = pyperclip.paste()
+        elab_link = self.elab_link_input.text().strip()
         tissue_name = f"{donor_name}.{tile_location_abbr}.{slab}.{tile}"
-        dissociated_cell_sample_name = f'{current_date}_{tissue_name}.Multiome'
         cell_prep_type = "nuclei"
 
         sorting_status = "PS" if sort_method.lower() in ["pooled", "dapi"] else "PN"
         sorter_initials = self.sorter_initials_input.text().strip().upper()
         enriched_cell_sample_container_name = f"MPXM_{current_date}_{sorting_status}_{sorter_initials}"
 
-        # Get study name
+        # Get study name; its rows go to the study's own sheet
         study = "HMBA_CjAtlas_Subcortex" if self.project_input.currentText() == "HMBA_CjAtlas_Subcortex" else self.project_name_input.text()
+        sheet_name = sheet_for_study(study)
+
+        # Values shared by every row of the submission
+        cdna_amplification_date = self.parsed(self.cdna_amp_date_input) if needs_cdna(protocol) else None
+        values = {
+            "current_date": current_date, "mit_name": mit_name, "slab": slab, "tile": tile,
+            "sort_method": sort_method, "seq_portal": seq_portal, "elab_link": elab_link,
+            "donor_name": donor_name, "tissue_name": tissue_name, "facs_population": facs_population,
+            "cell_prep_type": cell_prep_type, "study": study,
+            "enriched_cell_sample_container_name": enriched_cell_sample_container_name,
+            "expected_cell_capture": self.parsed(self.expected_recovery_input),
+            "sorting_status": sorting_status, "sorter_initials": sorter_initials,
+            "enriched_cell_sample_quantity_count": round(
+                self.parsed(self.nuclei_concentration_input) * self.parsed(self.nuclei_volume_input)),
+            "cdna_amplification_date": cdna_amplification_date,
+        }
 
-        # Process the data for each reaction and modality
-        dup_index_counter = {}
-        headers = [cell.value for cell in worksheet[1]]
+        def per_reaction(field):
+            # Fields the protocol does not use are disabled and left empty
+            return self.parsed(field) if field.isEnabled() else [None] * rxn_number
+
+        # Per-reaction values common to every modality
+        reactions = {
+            "reaction": list(range(1, rxn_number + 1)),
+            "port_well": [port_well for p_number, port_well in port_wells],
+            "barcoded_cell_sample_name": [f'P{str(p_number).zfill(4)}_{port_well}' for p_number, port_well in port_wells],
+            "cdna_pcr_cycles": per_reaction(self.cdna_pcr_cycles_input),
+            "percent_cdna_400bp": per_reaction(self.percent_cdna_400bp_input),
+            "cdna_concentration": per_reaction(self.cdna_concentration_input),
+        }
 
-        for x in range(rxn_number):
-            p_number, port_well = port_wells[x]
-            barcoded_cell_sample_name = f'P{str(p_number).zfill(4)}_{port_well}'
-
-            for modality in ["RNA", "ATAC"]:
-                self.write_modality_data(
-                    worksheet, current_row, modality, x,
-                    current_date, mit_name, slab, tile, sort_method,
-                    port_well, barcoded_cell_sample_name,
-                    sorting_status, sorter_initials,
-                    tissue_name, dissociated_cell_sample_name,
-                    enriched_cell_sample_container_name,
-                    study, seq_portal, elab_link,
-                    facs_population, cell_prep_type,
-                    rna_indices, atac_indices,
-                    headers, dup_index_counter,
-                    donor_name  # Add donor_name here
-                )
-                current_row += 1
-
-        # Save workbook and counter data
-        workbook.save(self.workbook_path)
-        with open(self.COUNTER_FILE, 'w') as f:
-            json.dump(self.counter_data, f, indent=4)
-
-    def write_modality_data(self, worksheet, current_row, modality, x, *args):
-        (current_date, mit_name, slab, tile, sort_method,
-         port_well, barcoded_cell_sample_name,
-         sorting_status, sorter_initials,
-         tissue_name, dissociated_cell_sample_name,
-         enriched_cell_sample_container_name,
-         study, seq_portal, elab_link,
-         facs_population, cell_prep_type,
-         rna_indices, atac_indices,
-         headers, dup_index_counter, donor_name) = args
-
-        krienen_lab_identifier = f'{current_date}_HMBA_{mit_name}_Slab{int(slab)}_Tile{int(tile)}_{sort_method}_{modality}{x + 1}'
-        enriched_cell_sample_name = f'MPXM_{current_date}_{sorting_status}_{sorter_initials}_{port_well}'
-
-        library_prep_date = (self.convert_date(self.rna_prep_date_input.text()) if modality == "RNA"
-                             else self.convert_date(self.atac_prep_date_input.text()))
-
-        if modality == "RNA":
-            library_method = "10xMultiome-RSeq"
-            library_type = "LPLCXR"
-            library_index = rna_indices[x]
-
-            # Calculate RNA-specific metrics
-            cdna_concentration = float(self.cdna_concentration_input.text().split(',')[x])
-            cdna_amplified_quantity = cdna_concentration * 40  # 40µL volume for cDNA
-            cdna_library_input = cdna_amplified_quantity * 0.25  # 25% of amplified quantity
-            percent_cdna_400bp = float(self.percent_cdna_400bp_input.text().split(',')[x])
-            rna_concentration = float(self.rna_lib_concentration_input.text().split(',')[x])
-            lib_quant = rna_concentration * 35  # Fixed 35µL volume for RNA library
-
-            cdna_pcr_cycles = int(self.cdna_pcr_cycles_input.text().split(',')[x])
-            rna_size = int(self.rna_sizes_input.text().split(',')[x])
-            library_cycles = int(self.library_cycles_rna_input.text().split(',')[x])
-        else:  # ATAC
-            library_method = "10xMultiome-ASeq"
-            library_type = "LPLCXA"
-            library_index = atac_indices[x]
-
-            # Calculate ATAC-specific metrics
-            atac_concentration = float(self.atac_lib_concentration_input.text().split(',')[x])
-            lib_quant = atac_concentration * 20  # Fixed 20µL volume for ATAC library
-
-            atac_size = int(self.atac_sizes_input.text().split(',')[x])
-            library_cycles = int(self.library_cycles_atac_input.text().split(',')[x])
-
-        # Update library prep set counter
-        key = (library_type, library_prep_date, library_index)
-        dup_index_counter[key] = dup_index_counter.get(key, 0) + 1
-        library_prep_set = f"{library_type}_{library_prep_date}_{dup_index_counter[key]}"
-        library_name = f"{library_prep_set}_{library_index}"
-
-        # Calculate common metrics
-        expected_cell_capture = int(self.expected_recovery_input.text())
-        concentration = float(self.nuclei_concentration_input.text().replace(",", ""))
-        volume = float(self.nuclei_volume_input.text())
-        enriched_cell_sample_quantity_count = round(concentration * volume)
-
-        # Prepare row data
-        row_data = [
-            krienen_lab_identifier,  # Column 1
-            seq_portal,
-            elab_link,
-            current_date,
-            mit_name,
-            donor_name,
-            tissue_name,
-            None,  # tissue_name_old (will be filled black)
-            dissociated_cell_sample_name,
-            facs_population,
-            cell_prep_type,
-            study,
-            enriched_cell_sample_container_name,
-            expected_cell_capture,
-            port_well,
-            enriched_cell_sample_name,
-            enriched_cell_sample_quantity_count,
-            barcoded_cell_sample_name,
-            library_method,
-            "10xMultiome-RSeq" if modality == "RNA" else None,
-            self.convert_date(self.cdna_amp_date_input.text()) if modality == "RNA" else None,
-            None,  # amplified_cdna_name (filled conditionally)
-            cdna_pcr_cycles if modality == "RNA" else None,
-            "Pass" if modality == "RNA" else None,
-            percent_cdna_400bp if modality == "RNA" else None,
-            cdna_amplified_quantity if modality == "RNA" else None,
-            cdna_library_input if modality == "RNA" else None,
-            library_prep_date,
-            library_prep_set,
-            library_name,
-            rna_size if modality == "RNA" else atac_size,
-            library_cycles,
-            lib_quant,
-            "Pass",
-            f"SI-TT-{rna_indices[x]}_i7" if modality == "RNA" else None,
-            f"SI-TT-{rna_indices[x]}_b(i5)" if modality == "RNA" else None,
-            f"SI-NA-{atac_indices[x]}" if modality == "ATAC" else None
-        ]
-
-        # Handle amplified_cdna_name for RNA
-        if modality == "RNA":
-            if current_date not in self.counter_data["amp_counter"]:
-                self.counter_data["amp_counter"][current_date] = 0
-            reaction_count = self.counter_data["amp_counter"][current_date]
-            letter = chr(65 + (reaction_count % 8))  # A-H (65 is ASCII for 'A')
-            batch_num_for_amp = (reaction_count // 8) + 1  # Increment batch number every 8 reactions
-            cdna_amp_date = self.convert_date(self.cdna_amp_date_input.text())
-            row_data[21] = f"APLCXR_{cdna_amp_date}_{batch_num_for_amp}_{letter}"
-            self.counter_data["amp_counter"][current_date] += 1
-
-        # Write to Excel
-        for col_num, value in enumerate(row_data, start=1):
-            cell = worksheet.cell(row=current_row, column=col_num, value=value)
-            # Apply default Arial 10 font to all cells
-            cell.font = Font(name="Arial", size=10)
-
-            # Apply black fill for ATAC empty cells or RNA's ATAC_index cell
-            if (modality == "ATAC" and value is None) or (
-                    modality == "RNA" and col_num == headers.index('ATAC_index') + 1):
-                cell.fill = self.black_fill
-
-        # Apply black fill to tissue_name_old
-        tissue_old_col = headers.index('tissue_name_old') + 1
-        worksheet.cell(row=current_row, column=tissue_old_col).fill = self.black_fill
+        # Library inputs by form group; a modality's template says which group it takes
+        group_inputs = {
+            "RNA": {"library_prep_date": self.parsed(self.rna_prep_date_input) if "RNA" in groups else None,
+                    "index": per_reaction(self.rna_indices_input),
+                    "size": per_reaction(self.rna_sizes_input),
+                    "library_cycles": per_reaction(self.library_cycles_rna_input),
+                    "library_concentration": per_reaction(self.rna_lib_concentration_input)},
+            "ATAC": {"library_prep_date": self.parsed(self.atac_prep_date_input) if "ATAC" in groups else None,
+                     "index": per_reaction(self.atac_indices_input),
+                     "size": per_reaction(self.atac_sizes_input),
+                     "library_cycles": per_reaction(self.library_cycles_atac_input),
+                     "library_concentration": per_reaction(self.atac_lib_concentration_input)},
+        }
+
+        # Derive every column for all reactions at once; a sheet not in the shard yet gets the shared header
+        headers = self.header_cache.get(sheet_name) or list(HEADERS)
+        rows, fills = build_submission(protocol, headers, values, reactions, group_inputs, counters)
+        return {"shard_path": self.shard_path, "sheet_name": sheet_name, "headers": headers,
+                "rows": rows, "fills": fills, "counters": counters}
+
+    def commit_submission(self, submission):
+        """Write a previewed submission as it was generated and take on its counters
+
+        The shard is resolved again here, as the log may have rolled over to a
+        new one since it was read; a sheet the submission creates there gets
+        the header the preview used. Library names another station used in
+        the meantime are renamed in the rows and listed in submission["renamed"].
+        Returns (shard path, written).
+        """
+        sheet_name = submission["sheet_name"]
+        shard_path = active_shard_path(self.workbook_path)
+        if shard_path != self.shard_path:
+            self.load_log_state()  # later previews go to the new shard
+
+        # Append after the sheet's last row, leaving room for journaled rows not written yet
+        first_row = next_row(self.workbook_path, shard_path,
+                             sheet_next_row(self.workbook_path, shard_path, sheet_name), sheet_name)
+
+        # Journal the submission, then write the workbook, counters and sidecar files from it
+        entry = make_entry(shard_path, first_row, submission["headers"], submission["rows"], submission["fills"],
+                           submission["counters"], sheet_name)
+        submission["renamed"] = {}
+        written = submit(self.workbook_path, self.COUNTER_FILE, entry, on_rename=submission["renamed"].update)
+        self.counter_data = submission["counters"]
+        if sheet_name not in self.header_cache:
+            self.header_cache[sheet_name] = submission["headers"]  # the sheet exists now
+        return shard_path, written
 
     def on_submit(self):
         try:
@@ -997,46 +1124,53 @@ class DataLogGUI(QMainWindow):
                 QApplication.setOverrideCursor(QCursor(Qt.CursorShape.WaitCursor))  # Set wait cursor again
 
             # Use file_location instead of workbook_path
-            self.workbook_path = self.file_location
-
-            # Process the form data and update Excel
-            self.process_form_data()
-
-            # These imports are now inside methods that use them
-            from openpyxl import load_workbook
-            from openpyxl.utils import get_column_letter
-
-            # Adjust column widths
-            workbook = load_workbook(self.workbook_path)
-            worksheet = workbook.active
-
-            for column in worksheet.columns:
-                max_length = 0
-                column_letter = get_column_letter(column[0].column)
-                for cell in column:
-                    try:
-                        cell_value = str(cell.value)
-                        if len(cell_value) > max_length:
-                            max_length = len(cell_value)
-                    except:
-                        pass
-                adjusted_width = (max_length + 2)
-                worksheet.column_dimensions[column_letter].width = adjusted_width
-
-            workbook.save(self.workbook_path)
+            if self.workbook_path != self.file_location:
+                self.workbook_path = self.file_location
+                self.load_log_state()
+
+            # Generate the rows and let the tech check them before anything is written
+            submission = self.prepare_submission()
+            QApplication.restoreOverrideCursor()
+            if PreviewDialog(submission, self).exec() != QDialog.DialogCode.Accepted:
+                return
+
+            QApplication.setOverrideCursor(QCursor(Qt.CursorShape.WaitCursor))
+            shard_path, written = self.commit_submission(submission)
 
             # Restore cursor before showing message
             QApplication.restoreOverrideCursor()
 
-            QMessageBox.information(
-                self,
-                "Success",
-                f"Data successfully appended to {self.workbook_path}"
-            )
+            if submission["renamed"]:
+                QMessageBox.information(
+                    self,
+                    "Library names changed",
+                    "Another station used some of these library names meanwhile; they were saved as:\n"
+                    + "\n".join(f"{old} -> {new}" for old, new in submission["renamed"].items())
+                )
+
+            if written:
+                QMessageBox.information(
+                    self,
+                    "Success",
+                    f"Data successfully appended to {shard_path}"
+                )
+            else:
+                QMessageBox.warning(
+                    self,
+                    "Saved to journal",
+                    f"Could not save {shard_path} (is it open in Excel?).\n"
+                    f"The submission is kept in the journal and will be written with the next one."
+                )
 
             # Clear form fields after successful submission
             self.clear_form_fields()
 
+        except LockTimeout as e:
+            QApplication.restoreOverrideCursor()
+            # Nothing was saved: keep the form for a retry, with the counters other stations advanced
+            self.load_counter_data()
+            QMessageBox.warning(self, "Log busy", f"{e}\nNothing was saved.")
+
         except Exception as e:
             QApplication.restoreOverrideCursor()  # Make sure cursor is restored on error
             QMessageBox.critical(
@@ -1045,6 +1179,50 @@ class DataLogGUI(QMainWindow):
                 f"An error occurred while processing the data:\n{str(e)}"
             )
 
+    def on_summary(self):
+        """Show the per-donor/date/study/tile summary from the stored aggregates"""
+        if not self.file_location:
+            self.file_location = self.get_save_location()
+        if not self.file_location or not os.path.exists(self.file_location):
+            QMessageBox.information(self, "Summary", "Nothing has been logged yet.")
+            return
+
+        aggregates = load_aggregates(self.file_location)
+        if aggregates is None:
+            # First use with an existing log: build once, later submits keep it up to date
+            aggregates = build_aggregates(self.file_location)
+            save_aggregates(self.file_location, aggregates)
+
+        SummaryDialog(aggregates, self).exec()
+
+    def on_undo(self):
+        """Remove the rows of the last submission and roll the counters back"""
+        if not self.file_location:
+            self.file_location = self.get_save_location()
+        submission = last_submission(self.file_location) if self.file_location else None
+        if submission is None:
+            QMessageBox.information(self, "Undo", "There is no submission to undo.")
+            return
+
+        identifiers = "\n".join(str(row_data[0]) for row_data in submission["rows"])
+        answer = QMessageBox.question(
+            self,
+            "Undo Last Submission",
+            f"Remove these {len(submission['rows'])} rows from {submission['shard']}?\n\n{identifiers}"
+        )
+        if answer != QMessageBox.StandardButton.Yes:
+            return
+
+        try:
+            undo_last(self.file_location, self.COUNTER_FILE)
+        except (OSError, ValueError) as e:
+            QMessageBox.critical(self, "Error", f"Nothing was undone:\n{str(e)}")
+            return
+
+        # Counters were rolled back on disk
+        self.load_counter_data()
+        QMessageBox.information(self, "Undo", "The last submission was undone.")
+
     def clear_form_fields(self):
         """Clear all form fields after successful submission"""
         # Clear basic info
@@ -1053,6 +1231,8 @@ class DataLogGUI(QMainWindow):
         self.slab_input.clear()
         self.tile_input.clear()
         self.hemisphere_input.setCurrentIndex(0)
+        self.elab_link_input.clear()
+        self.elab_watcher.consume()  # the submitted link is not filled in again for the next one
 
         # Clear sample info
         self.tile_location_input.setCurrentIndex(0)
@@ -5,8 +5,8 @@ block_cipher = None
 a = Analysis(['dataloggerGUI.py'],
              pathex=[],
              binaries=[],
-             datas=[('icon.icns', '.')],
-             hiddenimports=['pandas', 'PyQt6', 'openpyxl'],
+             datas=[('icon.icns', '.'), ('indices', 'indices'), ('protocols.json', '.'), ('donors.json', '.')],
+             hiddenimports=['pandas', 'numpy', 'PyQt6', 'openpyxl'],
              hookspath=[],
              hooksconfig={},
              runtime_hooks=[],
@@ -0,0 +1,94 @@
+"""Registry of the donors (marmosets) the logger knows.
+
+``donors.json`` (bundled with the app; a copy next to the app overrides it)
+lists each donor's name, donor code and any
+other names it goes by:
+
+    {"donors": [{"name": "Jellybean", "code": "CJ24.56.001", "aliases": ["JB"]}]}
+
+The file is read into an index by name, code and alias (case-insensitive)
+the first time a donor is looked up, and read again only when it has
+changed on disk, so a donor can be added without restarting the app.
+Lookups also accept a close misspelling of a name or alias when only one
+donor matches it. Without a donors file the registry is empty, so no name
+is accepted until one is added.
+"""
+import os
+import json
+import difflib
+
+from logstore import data_path
+
+DONORS_PATH = data_path('donors.json')
+
+# How close a misspelling must be to a known name to be accepted
+FUZZY_CUTOFF = 0.8
+
+_registry = None
+
+
+def file_version(path):
+    """Modification time and size of path, or None if it does not exist"""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def index_key(value):
+    return str(value).strip().casefold()
+
+
+def load_registry(path=DONORS_PATH):
+    """Read the registry file and index its donors by name, code and alias (empty if there is no file)"""
+    try:
+        with open(path, 'r') as f:
+            donors = json.load(f)["donors"]
+    except FileNotFoundError:
+        donors = []
+
+    index = {}
+    names = []
+    for donor in donors:
+        for key in [donor["name"], donor["code"], *donor.get("aliases", [])]:
+            other = index.setdefault(index_key(key), donor)
+            if other is not donor:
+                raise ValueError(f"{key} is used by both {other['name']} and {donor['name']} in {path}")
+        names.extend(index_key(key) for key in [donor["name"], *donor.get("aliases", [])])
+    return {"path": path, "version": file_version(path), "donors": donors, "index": index, "names": names}
+
+
+def get_registry(path=DONORS_PATH):
+    """The donor registry, read again only if the file changed since it was last read"""
+    global _registry
+    if _registry is None or _registry["path"] != path or file_version(path) != _registry["version"]:
+        _registry = load_registry(path)
+    return _registry
+
+
+def donor_names(path=DONORS_PATH):
+    return [donor["name"] for donor in get_registry(path)["donors"]]
+
+
+def suggestions(query, path=DONORS_PATH):
+    """Known names and aliases close to query (donor codes only match exactly)"""
+    names = get_registry(path)["names"]
+    return difflib.get_close_matches(index_key(query), names, n=3, cutoff=FUZZY_CUTOFF)
+
+
+def find_donor(query, path=DONORS_PATH):
+    """Return the donor a name, code or alias refers to, or None
+
+    An exact (case-insensitive) match wins; otherwise a misspelled name or
+    alias is accepted when all close matches are the same donor.
+    """
+    index = get_registry(path)["index"]
+    donor = index.get(index_key(query))
+    if donor is not None:
+        return donor
+
+    matches = {id(index[key]): index[key] for key in suggestions(query, path)}
+    if len(matches) == 1:
+        return next(iter(matches.values()))
+    return None
@@ -0,0 +1,11 @@
+"""Recognizing eLab experiment links among whatever is on the clipboard"""
+import re
+
+# eLabJournal / eLabFTW experiment URLs
+ELAB_LINK_PATTERN = re.compile(r'https?://\S*elab\S*', re.IGNORECASE)
+
+
+def find_elab_link(text):
+    """The first eLab link in text, or None"""
+    match = ELAB_LINK_PATTERN.search(text or "")
+    return match.group(0) if match else None
@@ -0,0 +1,208 @@
+"""Typed columnar export of the log for analysis notebooks.
+
+The HMBA columns are written with real dtypes (dates, integer counts, float
+ng quantities) to a dataset directory of part files next to the log. Each run
+only converts the rows added since the previous export, tracked per shard and
+study sheet in ``export_state.json`` inside the directory, and writes them as a
+new part. If rows of a shard were removed (undo) or changed in place (QC
+flags, pool names) since, as counted by the shard's ``edits`` in the
+manifest, the parts are stale and the export is written again from scratch. With ``--study`` only that study's sheet is read, into its own
+directory (e.g. ``datalog.HMBA.arrow``).
+
+The default Arrow IPC format is uncompressed so parts can be memory-mapped and
+read without copying:
+
+    from export_columnar import open_export
+    table = open_export('datalog.arrow')   # pyarrow.Table
+    df = table.to_pandas()
+
+    python export_columnar.py [--log datalog.xlsx] [--format arrow|parquet] [--study NAME] [--full]
+"""
+import os
+import re
+import sys
+import json
+import importlib.util
+import argparse
+from datetime import datetime
+
+from logstore import (load_manifest, iter_shard_rows, sheet_for_study, sidecar_path, LEGACY_SHEET,
+                      DEFAULT_LOG_PATH)
+from schema import COLUMNS
+
+# Column -> kind, in log order
+COLUMN_TYPES = {c.name: c.kind for c in COLUMNS}
+
+FILE_EXTENSIONS = {'arrow': '.arrow', 'parquet': '.parquet'}
+
+STATE_FILE = 'export_state.json'
+PART_PATTERN = re.compile(r'^part-\d{5}\.(arrow|parquet)$')
+
+
+def to_date(value):
+    if value is None or value == '':
+        return None
+    try:
+        return datetime.strptime(str(value).strip(), '%y%m%d').date()
+    except ValueError:
+        return None
+
+
+def to_int(value):
+    try:
+        return int(round(float(str(value).replace(',', ''))))
+    except (TypeError, ValueError):
+        return None
+
+
+def to_float(value):
+    try:
+        return float(str(value).replace(',', ''))
+    except (TypeError, ValueError):
+        return None
+
+
+def to_string(value):
+    return None if value is None else str(value)
+
+
+CONVERTERS = {'date': to_date, 'int': to_int, 'float': to_float, 'string': to_string}
+
+
+def arrow_schema():
+    import pyarrow as pa
+
+    arrow_types = {'date': pa.date32(), 'int': pa.int64(), 'float': pa.float64(), 'string': pa.string()}
+    return pa.schema([pa.field(name, arrow_types[kind]) for name, kind in COLUMN_TYPES.items()])
+
+
+def rows_to_table(rows):
+    """Convert row dicts to a typed pyarrow Table, column by column"""
+    import pyarrow as pa
+
+    columns = {name: [] for name in COLUMN_TYPES}
+    for row in rows:
+        for name, values in columns.items():
+            values.append(row.get(name))
+
+    schema = arrow_schema()
+    arrays = [pa.array([CONVERTERS[COLUMN_TYPES[name]](value) for value in values], type=schema.field(name).type)
+              for name, values in columns.items()]
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+
+def export_dir_for(workbook_path, export_format, sheet_name=None):
+    suffix = FILE_EXTENSIONS[export_format]
+    return sidecar_path(workbook_path, f".{sheet_name}{suffix}" if sheet_name else suffix)
+
+
+def load_state(export_dir):
+    path = os.path.join(export_dir, STATE_FILE)
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            return json.load(f)
+    return {"parts": 0, "shards": {}}
+
+
+def remove_export(export_dir):
+    """Delete the part files and state this tool wrote, leaving anything else in the directory"""
+    if not os.path.isdir(export_dir):
+        return
+    for file_name in os.listdir(export_dir):
+        if PART_PATTERN.match(file_name) or file_name == STATE_FILE:
+            os.remove(os.path.join(export_dir, file_name))
+
+
+def export_new_rows(workbook_path, export_format='arrow', export_dir=None, full=False, sheet_name=None):
+    """Append the rows added since the last export (of one sheet, or all) as a new part
+
+    Returns how many rows were written.
+    """
+    export_dir = export_dir or export_dir_for(workbook_path, export_format, sheet_name)
+    if full:
+        remove_export(export_dir)
+    os.makedirs(export_dir, exist_ok=True)
+    state = load_state(export_dir)
+    shards = load_manifest(workbook_path)["shards"]
+
+    edits = {shard["path"]: shard.get("edits", 0) for shard in shards}
+    if any(state.get("edits", {}).get(shard_name, 0) != count for shard_name, count in edits.items()):
+        remove_export(export_dir)  # rows exported earlier were removed or changed since
+        state = load_state(export_dir)
+    state["edits"] = edits
+
+    new_rows = []
+    exported = state["shards"]
+    for shard in shards:
+        shard_name = shard["path"]
+        already = exported.setdefault(shard_name, {})
+        if isinstance(already, int):
+            already = exported[shard_name] = {LEGACY_SHEET: already}  # exported before rows were split by study
+        if sheet_name is None:
+            known, done = shard["rows"], sum(already.values())
+        else:
+            known, done = (shard.get("sheets", {}).get(sheet_name) or {}).get("rows"), already.get(sheet_name, 0)
+        if known is not None and done >= known:
+            continue  # nothing new in this shard, don't open it
+
+        counts = {}
+        shard_path = os.path.join(os.path.dirname(workbook_path), shard_name)
+        for (sheet, _), row in iter_shard_rows(shard_path, sheet_name, with_locations=True):
+            counts[sheet] = counts.get(sheet, 0) + 1
+            if counts[sheet] > already.get(sheet, 0):
+                new_rows.append(row)
+        for sheet, count in counts.items():
+            already[sheet] = max(count, already.get(sheet, 0))
+
+    if new_rows:
+        table = rows_to_table(new_rows)
+        state["parts"] += 1
+        part_path = os.path.join(export_dir, f"part-{str(state['parts']).zfill(5)}{FILE_EXTENSIONS[export_format]}")
+        if export_format == 'arrow':
+            import pyarrow.feather as feather
+            feather.write_feather(table, part_path, compression='uncompressed')
+        else:
+            import pyarrow.parquet as pq
+            pq.write_table(table, part_path)
+
+    with open(os.path.join(export_dir, STATE_FILE), 'w') as f:
+        json.dump(state, f, indent=4)
+    return len(new_rows)
+
+
+def open_export(export_dir):
+    """Open an export directory as one pyarrow Table (Arrow parts are memory-mapped, not copied)"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    tables = []
+    for file_name in sorted(os.listdir(export_dir)):
+        path = os.path.join(export_dir, file_name)
+        if file_name.endswith('.arrow'):
+            tables.append(pa.ipc.open_file(pa.memory_map(path, 'r')).read_all())
+        elif file_name.endswith('.parquet'):
+            tables.append(pq.read_table(path, memory_map=True))
+    return pa.concat_tables(tables) if tables else arrow_schema().empty_table()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the log to typed Arrow IPC or Parquet files.")
+    parser.add_argument('--log', default=DEFAULT_LOG_PATH)
+    parser.add_argument('--format', dest='export_format', choices=list(FILE_EXTENSIONS), default='arrow')
+    parser.add_argument('--out', help="Export directory (default: next to the log)")
+    parser.add_argument('--study', help="Export only the sheet of this study")
+    parser.add_argument('--full', action='store_true', help="Discard the previous export (only its part files and state) and write every row again")
+    args = parser.parse_args()
+
+    if importlib.util.find_spec('pyarrow') is None:
+        print("The columnar export needs pyarrow: pip install pyarrow")
+        sys.exit(1)
+
+    sheet_name = sheet_for_study(args.study) if args.study else None
+    export_dir = args.out or export_dir_for(args.log, args.export_format, sheet_name)
+    count = export_new_rows(args.log, args.export_format, export_dir, args.full, sheet_name)
+    print(f"{count} new rows exported to {export_dir}")
+
+
+if __name__ == '__main__':
+    main()
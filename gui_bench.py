@@ -0,0 +1,358 @@
+"""Offscreen timing harness for the GUI.
+
+Drives DataLogGUI under the Qt offscreen platform the way a tech would:
+Return from field to field, typing a per-reaction list, and Submit with
+the preview accepted, for each reaction count against logs of each size.
+Logs are generated once from copies of one 48-reaction submission and kept
+in --logs-dir. Every run works on a scratch copy with its own counters and
+settings, so the real log and app settings are never touched.
+
+Recorded per log size and reaction count, in milliseconds:
+
+* ``focus`` -- Return in a field until the next field has focus
+* ``typing`` -- one character typed into a per-reaction list
+* ``prepare`` -- Submit clicked until the preview of the rows is shown
+* ``commit`` -- preview accepted until the success message
+* ``click_to_success`` -- Submit clicked until the success message
+* ``stall`` -- longest time the UI thread did not get back to its event loop during a submission
+
+    python gui_bench.py [--sizes 0,1000,10000] [--reactions 1,8,48] [--repeat 3] [--out gui_bench.json]
+    python gui_bench.py --compare baseline.json [--tolerance 0.25]
+"""
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import socket
+import argparse
+import platform
+import tempfile
+import statistics
+from datetime import datetime, timezone
+
+DEFAULT_SIZES = [0, 1000, 10000]
+DEFAULT_REACTIONS = [1, 8, 48]
+DEFAULT_LOGS_DIR = os.path.join(tempfile.gettempdir(), 'datalog_gui_bench')
+
+LOG_NAME = 'datalog.xlsx'
+COUNTER_NAME = 'sample_name_counter.json'
+
+# Reactions of the submission generated logs are copied from, and rows written per journal entry
+TEMPLATE_REACTIONS = 48
+CHUNK_ROWS = 2000
+
+# Interval of the UI thread heartbeat, and how long the event loop keeps running after a
+# submission to catch deferred work (e.g. live validation)
+HEARTBEAT_MS = 5
+SETTLE_MS = 300
+
+# A regression is a median this much slower than the baseline (and by at least MIN_REGRESSION_MS)
+DEFAULT_TOLERANCE = 0.25
+MIN_REGRESSION_MS = 5
+
+WELL_ROWS = "ABCDEFGH"
+
+
+# --- Form ---
+def reaction_wells(count):
+    return [f"{WELL_ROWS[i % len(WELL_ROWS)]}{i // len(WELL_ROWS) + 1}" for i in range(count)]
+
+
+def field_text(validator, count):
+    """Valid text for a field checked by validator, for count reactions"""
+    per_reaction = {
+        "indices": reaction_wells(count),
+        "int_list": [str(10 + i % 5) for i in range(count)],
+        "float_list": [str(2.5 + i % 4) for i in range(count)],
+    }
+    if validator in per_reaction:
+        return ",".join(per_reaction[validator])
+    return {"date": "250301", "int": "3", "float": "10", "concentration": "1,000",
+            "proportions": "70/20/10", "reaction_count": str(count)}[validator]
+
+
+def fill_form(gui, count):
+    from dataloggerGUI import FORM_FIELDS
+
+    for spec in FORM_FIELDS:
+        if spec.check:
+            getattr(gui, spec.name).setText(field_text(spec.check[1], count))
+    gui.sorter_initials_input.setText("LC")
+    gui.elab_link_input.setText("https://elab.example.org/experiment/1")
+
+
+# --- GUI session ---
+def start_gui(app, directory, protocol=None):
+    """A DataLogGUI working on the log and counters in directory, with dialogs answered automatically
+
+    Returns (gui, messages, previews): the message boxes shown as
+    (kind, text, time) and the times previews were shown.
+    """
+    import dataloggerGUI
+    from PyQt6.QtWidgets import QMessageBox, QDialog
+
+    messages, previews = [], []
+    for kind in ("information", "warning", "critical"):
+        setattr(QMessageBox, kind, staticmethod(
+            lambda parent, title, text, *args, kind=kind: messages.append((kind, text, time.perf_counter()))))
+    dataloggerGUI.PreviewDialog.exec = (
+        lambda dialog: previews.append(time.perf_counter()) or QDialog.DialogCode.Accepted)
+
+    gui = dataloggerGUI.DataLogGUI()
+    app.processEvents()  # runs delayed_init
+    gui.COUNTER_FILE = os.path.join(directory, COUNTER_NAME)
+    gui.load_counter_data()
+    gui.file_location = gui.workbook_path = os.path.join(directory, LOG_NAME)
+    gui.load_log_state()  # as when the log is chosen: shard, headers and library name index
+    if protocol:
+        gui.protocol_input.setCurrentText(protocol)
+    gui.show()
+    gui.activateWindow()
+    app.processEvents()
+    return gui, messages, previews
+
+
+def close_gui(app, gui):
+    gui.close()
+    gui.deleteLater()
+    app.processEvents()
+
+
+# --- Logs ---
+def log_dir(logs_dir, rows, protocol):
+    return os.path.join(logs_dir, f"{re.sub(r'[^A-Za-z0-9]+', '_', protocol or 'default')}_{rows}_rows")
+
+
+def generate_log(app, directory, rows, protocol=None):
+    """Write a log of rows rows, with its sidecar files and counters, into directory"""
+    from journal import make_entry, next_row, submit, save_undo_stack
+    from logstore import active_shard_path, sheet_next_row
+
+    os.makedirs(directory, exist_ok=True)
+    if not rows:
+        return
+    gui, _, _ = start_gui(app, directory, protocol)
+    fill_form(gui, TEMPLATE_REACTIONS)
+    template = gui.prepare_submission()
+    close_gui(app, gui)
+
+    log_path = os.path.join(directory, LOG_NAME)
+    counter_file = os.path.join(directory, COUNTER_NAME)
+    sheet_name = template["sheet_name"]
+    template_rows = len(template["rows"])
+    written = 0
+    while written < rows:
+        positions = [(written + i) % template_rows for i in range(min(CHUNK_ROWS, rows - written))]
+        shard_path = active_shard_path(log_path)
+        first_row = next_row(log_path, shard_path, sheet_next_row(log_path, shard_path, sheet_name), sheet_name)
+        entry = make_entry(shard_path, first_row, template["headers"],
+                           [list(template["rows"][i]) for i in positions], [template["fills"][i] for i in positions],
+                           template["counters"], sheet_name)
+        if not submit(log_path, counter_file, entry):
+            raise OSError(f"Could not write {shard_path}")
+        written += len(positions)
+    save_undo_stack(log_path, [])  # the generated rows are history, not something to undo
+
+
+def ensure_log(app, logs_dir, rows, protocol=None, regenerate=False):
+    directory = log_dir(logs_dir, rows, protocol)
+    if regenerate or not os.path.exists(os.path.join(directory, '.complete')):
+        shutil.rmtree(directory, ignore_errors=True)
+        started = time.perf_counter()
+        generate_log(app, directory, rows, protocol)
+        open(os.path.join(directory, '.complete'), 'w').close()
+        print(f"Generated a log of {rows} rows in {time.perf_counter() - started:.1f} s")
+    return directory
+
+
+# --- Measurements ---
+def key_press(key, text=""):
+    from PyQt6.QtCore import QEvent, Qt
+    from PyQt6.QtGui import QKeyEvent
+
+    return QKeyEvent(QEvent.Type.KeyPress, key, Qt.KeyboardModifier.NoModifier, text)
+
+
+def measure_focus(app, gui):
+    """Times from Return in each field in use until the next one has focus"""
+    from PyQt6.QtCore import Qt
+
+    samples = []
+    for widget in gui.focus_chain:
+        if not widget.isEnabled() or widget.isHidden():
+            continue
+        gui.focus_field(widget)
+        app.processEvents()
+        started = time.perf_counter()
+        app.sendEvent(widget, key_press(Qt.Key.Key_Return))
+        app.processEvents()
+        samples.append(time.perf_counter() - started)
+        if app.focusWidget() is widget:
+            raise RuntimeError(f"Return in {widget.objectName() or type(widget).__name__} did not move the focus")
+    return samples
+
+
+def measure_typing(app, gui, count):
+    """Times of each character typed into the per-reaction list of library sizes"""
+    from PyQt6.QtCore import Qt
+
+    field = gui.rna_sizes_input
+    text = field.text()
+    field.clear()
+    gui.focus_field(field)
+    app.processEvents()
+    samples = []
+    for char in text:
+        started = time.perf_counter()
+        app.sendEvent(field, key_press(Qt.Key(ord(char)), char))
+        app.processEvents()
+        samples.append(time.perf_counter() - started)
+    if field.text() != text:
+        raise RuntimeError(f"Typed {text!r} but the field holds {field.text()!r}")
+    return samples
+
+
+def measure_submission(app, gui, messages, previews):
+    """Click Submit inside a running event loop; returns {metric: seconds}
+
+    A heartbeat timer on the UI thread shows how long the event loop was
+    blocked, i.e. how long the window could not repaint or take input.
+    """
+    from PyQt6.QtCore import Qt, QTimer, QEventLoop
+
+    ticks = []
+    heartbeat = QTimer()
+    heartbeat.setTimerType(Qt.TimerType.PreciseTimer)
+    heartbeat.setInterval(HEARTBEAT_MS)
+    heartbeat.timeout.connect(lambda: ticks.append(time.perf_counter()))
+    loop = QEventLoop()
+    clicked = []
+
+    def click():
+        del messages[:], previews[:]
+        clicked.append(time.perf_counter())
+        gui.submit_btn.click()
+        QTimer.singleShot(SETTLE_MS, loop.quit)
+
+    heartbeat.start()
+    QTimer.singleShot(HEARTBEAT_MS * 4, click)
+    loop.exec()
+    heartbeat.stop()
+
+    successes = [moment for kind, text, moment in messages if kind == "information"]
+    if not successes or not previews or len(messages) != len(successes):
+        raise RuntimeError(f"The submission failed: {[text for _, text, _ in messages] or 'no message shown'}")
+    started = clicked[0]
+    return {"prepare": previews[0] - started, "commit": successes[0] - previews[0],
+            "click_to_success": successes[0] - started,
+            "stall": max(later - earlier for earlier, later in zip(ticks, ticks[1:]))}
+
+
+def summarize(samples):
+    """Median, 95th percentile and max of samples in seconds, as milliseconds"""
+    ordered = sorted(samples)
+    return {"count": len(ordered), "median_ms": round(statistics.median(ordered) * 1000, 3),
+            "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 3),
+            "max_ms": round(ordered[-1] * 1000, 3)}
+
+
+def run_case(app, source, rows, reactions, repeat, protocol=None):
+    """Measurements of one log size and reaction count, on a scratch copy of the log"""
+    samples = {}
+    with tempfile.TemporaryDirectory() as scratch:
+        directory = os.path.join(scratch, 'log')
+        shutil.copytree(source, directory)
+        gui, messages, previews = start_gui(app, directory, protocol)
+        try:
+            for _ in range(repeat):
+                fill_form(gui, reactions)
+                samples.setdefault("focus", []).extend(measure_focus(app, gui))
+                samples.setdefault("typing", []).extend(measure_typing(app, gui, reactions))
+                for metric, seconds in measure_submission(app, gui, messages, previews).items():
+                    samples.setdefault(metric, []).append(seconds)
+        finally:
+            close_gui(app, gui)
+    return [{"log_rows": rows, "reactions": reactions, "metric": metric, **summarize(values)}
+            for metric, values in samples.items()]
+
+
+# --- Results ---
+def case_key(result):
+    return result["log_rows"], result["reactions"], result["metric"]
+
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """Results whose median is slower than the baseline's by more than tolerance, as (result, baseline result)"""
+    before = {case_key(result): result for result in baseline}
+    regressions = []
+    for result in results:
+        old = before.get(case_key(result))
+        if old and (result["median_ms"] > old["median_ms"] * (1 + tolerance)
+                    and result["median_ms"] - old["median_ms"] >= MIN_REGRESSION_MS):
+            regressions.append((result, old))
+    return regressions
+
+
+def parse_numbers(text):
+    return [int(value) for value in text.split(',') if value.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the GUI under the Qt offscreen platform.")
+    parser.add_argument('--sizes', type=parse_numbers, default=DEFAULT_SIZES, help="Log sizes in rows, e.g. 0,1000,10000")
+    parser.add_argument('--reactions', type=parse_numbers, default=DEFAULT_REACTIONS,
+                        help="Reaction counts (1 to 48), e.g. 1,8,48")
+    parser.add_argument('--repeat', type=int, default=3, help="Submissions per log size and reaction count")
+    parser.add_argument('--protocol', help="Protocol to submit (default: the app's default)")
+    parser.add_argument('--logs-dir', default=DEFAULT_LOGS_DIR, help="Where generated logs are kept between runs")
+    parser.add_argument('--regenerate', action='store_true', help="Generate the logs again")
+    parser.add_argument('--out', default='gui_bench.json', help="Results file")
+    parser.add_argument('--compare', help="Earlier results file; exits with 1 on a regression")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help="Slowdown of a median that counts as a regression (0.25 = 25%%)")
+    args = parser.parse_args()
+    if any(not 1 <= reactions <= TEMPLATE_REACTIONS for reactions in args.reactions):
+        parser.error(f"--reactions must be between 1 and {TEMPLATE_REACTIONS}")
+
+    # The app keeps its settings under the home directory; give it an empty one
+    home = tempfile.mkdtemp(prefix='datalog_gui_bench_home')
+    os.environ['HOME'] = os.environ['USERPROFILE'] = home
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    from PyQt6.QtCore import QT_VERSION_STR
+    from PyQt6.QtWidgets import QApplication
+
+    app = QApplication.instance() or QApplication([])
+    results = []
+    try:
+        for rows in args.sizes:
+            source = ensure_log(app, args.logs_dir, rows, args.protocol, args.regenerate)
+            for reactions in args.reactions:
+                case = run_case(app, source, rows, reactions, args.repeat, args.protocol)
+                results.extend(case)
+                medians = ", ".join(f"{result['metric']} {result['median_ms']:.1f}" for result in case)
+                print(f"{rows} rows, {reactions} reactions: {medians} ms")
+    finally:
+        shutil.rmtree(home, ignore_errors=True)
+
+    with open(args.out, 'w') as f:
+        json.dump({"created": datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'),
+                   "host": socket.gethostname(), "python": platform.python_version(), "qt": QT_VERSION_STR,
+                   "platform": os.environ['QT_QPA_PLATFORM'], "protocol": args.protocol, "repeat": args.repeat,
+                   "results": results}, f, indent=2)
+    print(f"Results written to {args.out}")
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            regressions = compare(results, json.load(f)["results"], args.tolerance)
+        for result, old in regressions:
+            print(f"Slower: {result['log_rows']} rows, {result['reactions']} reactions, {result['metric']}: "
+                  f"{old['median_ms']:.1f} -> {result['median_ms']:.1f} ms")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions against {args.compare}.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""Registry of 10x sample index sequences behind the well names in the log.
+
+The registry is loaded from the index kit CSVs that 10x publishes, placed in
+the ``indices`` directory (bundled with the app; an ``indices`` directory
+next to the app takes precedence):
+
+* ``Dual_Index_Kit_TT_Set_A.csv`` -- ``SI-TT-A1,<i7>,<i5 workflow a>,<i5 workflow b>``
+* ``Single_Index_Kit_N_Set_A.csv`` -- ``SI-NA-A1,<oligo 1>,<oligo 2>,<oligo 3>,<oligo 4>``
+
+Any CSV in that directory whose rows start with an ``SI-`` index name is
+read, so further kits can be dropped in the same way.
+"""
+import os
+import re
+import csv
+
+from logstore import data_path
+
+INDEX_DIR = data_path('indices')
+
+# Matches SI-TT-A1, SI-TT-A01_i7, SI-TT-A01_b(i5), SI-NA-C03, ...
+INDEX_ID_PATTERN = re.compile(r'^(SI-[A-Z]{2})-([A-H])0?(\d{1,2})(?:_.*)?$')
+
+
+def well_key(row_letter, column_number):
+    return f"{row_letter}{str(int(column_number)).zfill(2)}"
+
+
+def parse_index_id(index_id):
+    """Split an index name from the log or a kit file into (kit, well), or None"""
+    if not isinstance(index_id, str):
+        return None
+    match = INDEX_ID_PATTERN.match(index_id.strip().upper())
+    if not match:
+        return None
+    kit, row_letter, column_number = match.groups()
+    return kit, well_key(row_letter, column_number)
+
+
+def short_index_name(index_id):
+    """Return the 10x name for an index, e.g. SI-TT-A01_i7 -> SI-TT-A1"""
+    parsed = parse_index_id(index_id)
+    if not parsed:
+        return None
+    kit, well = parsed
+    return f"{kit}-{well[0]}{int(well[1:])}"
+
+
+class IndexRegistry:
+    """In-memory map of kit -> well -> index sequences"""
+
+    def __init__(self):
+        self.kits = {}
+
+    def load_csv(self, path):
+        with open(path, newline='') as f:
+            for row in csv.reader(f):
+                if not row:
+                    continue
+                parsed = parse_index_id(row[0])
+                if not parsed:
+                    continue  # header or comment line
+                kit, well = parsed
+                sequences = tuple(seq.strip().upper() for seq in row[1:] if seq.strip())
+                self.kits.setdefault(kit, {})[well] = sequences
+
+    def load_directory(self, directory=INDEX_DIR):
+        if os.path.isdir(directory):
+            for file_name in sorted(os.listdir(directory)):
+                if file_name.lower().endswith('.csv'):
+                    self.load_csv(os.path.join(directory, file_name))
+        return self
+
+    def sequences(self, index_id):
+        """Look up the sequences behind an index name, or None if it is not in the registry"""
+        parsed = parse_index_id(index_id)
+        if not parsed:
+            return None
+        kit, well = parsed
+        return self.kits.get(kit, {}).get(well)
+
+    def index_reads(self, index_id, i5_workflow='b'):
+        """Return the (i7, i5) read pairs a library with this index can produce
+
+        Dual-index (SI-TT) wells produce a single pair; single-index (SI-NA) wells are a
+        mix of four i7 oligos and no i5 read.
+        """
+        sequences = self.sequences(index_id)
+        if not sequences:
+            return None
+        kit, _ = parse_index_id(index_id)
+        if kit == 'SI-TT':
+            i5 = sequences[2] if i5_workflow == 'b' and len(sequences) > 2 else sequences[1]
+            return [(sequences[0], i5)]
+        return [(oligo, '') for oligo in sequences]
+
+
+_registry = None
+
+
+def get_registry():
+    """Load the bundled registry once and reuse it"""
+    global _registry
+    if _registry is None:
+        _registry = IndexRegistry().load_directory()
+    return _registry
+
+
+def registry_warning():
+    """The warning shown at submission when no index kit CSVs are installed, or None"""
+    if get_registry().kits:
+        return None
+    return (f"No index sequences are installed in {INDEX_DIR}: index collisions cannot be checked "
+            f"until the 10x index kit CSVs are placed there (see README.txt).")
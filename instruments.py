@@ -0,0 +1,283 @@
+"""Reading TapeStation and fluorometer (plate reader) CSV exports.
+
+Exports are read in one pass with the csv module. Preamble lines before
+the header are skipped, and columns are recognized by name, whatever
+order the instrument software writes them in. Per well the export gives
+some of:
+
+* ``size`` -- average size (bp) of the main region
+* ``concentration`` -- ng/µL (TapeStation pg/µL values are converted)
+* ``percent_over_400bp`` -- % of total in regions starting at 400 bp or more
+
+Wells of multi-plate exports are kept per plate (the ``FileName``/``Plate``
+column); values from exports without a plate column, such as a fluorometer
+run of the same libraries, are added to whichever plate is chosen. A library is matched to its well by its index,
+found in the sample description (e.g. ``SI-TT-A01``) or else as the well
+itself; reactions without an index (amplified cDNA) are matched in well order.
+Ladder wells (a sample description such as ``Ladder``) are never matched.
+Descriptions are matched on kit and well, so ``SI-TT-A01`` and ``SI-NA-A01``
+on the same plate are told apart when the kit is given, and an index more
+than one sample names is an error rather than a guess.
+
+    plates = read_exports(['tapestation.csv', 'qubit.csv'])
+    records = match_reactions(select_plate(plates), indices=['A01', 'B02'], kit='SI-TT')
+    sizes = field_values(records, 'size')
+
+    python instruments.py EXPORT.csv [...] --field size --indices A1,B2 [--kit SI-TT] [--plate NAME]
+"""
+import re
+import csv
+import sys
+import argparse
+
+FIELDS = ("size", "concentration", "percent_over_400bp")
+
+# Normalized header -> (field, factor to the log's unit)
+COLUMN_ALIASES = {
+    "well": ("well", None), "wellid": ("well", None), "well id": ("well", None), "well position": ("well", None),
+    "sample": ("sample", None), "sample description": ("sample", None), "sample name": ("sample", None),
+    "sample id": ("sample", None), "name": ("sample", None),
+    "filename": ("plate", None), "file name": ("plate", None), "plate": ("plate", None),
+    "plate name": ("plate", None), "plate id": ("plate", None),
+    "average size [bp]": ("size", 1), "avg. size [bp]": ("size", 1), "average size (bp)": ("size", 1),
+    "size [bp]": ("size", 1), "size (bp)": ("size", 1),
+    "conc. [ng/ul]": ("concentration", 1), "conc. [pg/ul]": ("concentration", 0.001),
+    "concentration [ng/ul]": ("concentration", 1), "concentration (ng/ul)": ("concentration", 1),
+    "conc (ng/ul)": ("concentration", 1), "ng/ul": ("concentration", 1), "calc. conc. (ng/ul)": ("concentration", 1),
+    "concentration [pg/ul]": ("concentration", 0.001),
+    "from [bp]": ("from_bp", 1), "from (bp)": ("from_bp", 1),
+    "% of total": ("percent", 1), "% integrated area": ("percent", 1),
+}
+
+WELL_PATTERN = re.compile(r'^([A-P])0*([1-9]|1[0-9]|2[0-4])$')
+# Index style with the number first, e.g. 2B
+NUMBER_FIRST_PATTERN = re.compile(r'^0*([1-9]|1[0-9]|2[0-4])([A-P])$')
+# Well-like tokens in a sample description with the kit before them if any, e.g. SI-TT and A01 in "SI-TT-A01"
+WELL_TOKEN = re.compile(r'(?<![A-Z0-9])(?:(SI-[A-Z]{2})-)?([A-P])0*([1-9]|1[0-9]|2[0-4])(?![0-9])')
+
+# Sample description of a ladder well, e.g. "Ladder" or "D1000 ladder"
+LADDER_PATTERN = re.compile(r'\bladder\b', re.IGNORECASE)
+
+# Regions starting at this size or above count towards percent_over_400bp
+LONG_CDNA_BP = 400
+
+
+def normalize_header(header):
+    header = header.strip().lower().replace('µ', 'u').replace('μ', 'u')
+    return re.sub(r'\s+', ' ', header)
+
+
+def normalize_well(value):
+    """A1, a01, 2B -> A01, A01, B02; None for anything that is not a well"""
+    value = str(value).strip().upper()
+    match = WELL_PATTERN.match(value)
+    if match:
+        return f"{match.group(1)}{int(match.group(2)):02d}"
+    match = NUMBER_FIRST_PATTERN.match(value)
+    return f"{match.group(2)}{int(match.group(1)):02d}" if match else None
+
+
+def to_number(value):
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return float(value.replace(',', ''))  # thousands separators
+    except ValueError:
+        return None
+
+
+def _header_map(row):
+    columns = {}
+    for position, header in enumerate(row):
+        alias = COLUMN_ALIASES.get(normalize_header(header))
+        if alias and alias[0] not in columns:
+            columns[alias[0]] = (position, alias[1])
+    return columns if "well" in columns else None
+
+
+def _finish_well(regions):
+    """One record from the region rows of a well"""
+    main = max(regions, key=lambda region: region.get("percent") or 0)
+    record = {key: main[key] for key in ("sample", "size", "concentration") if main.get(key) is not None}
+    if any(region.get("from_bp") is not None and region.get("percent") is not None for region in regions):
+        record["percent_over_400bp"] = sum(region["percent"] for region in regions
+                                           if (region.get("from_bp") or 0) >= LONG_CDNA_BP and region.get("percent"))
+    return record
+
+
+def read_export(path):
+    """Read one export into {plate: {well: record}}, wells in file order
+
+    Wells of an export without a plate column are under the plate None.
+    """
+    regions = {}
+    wells_seen = {}  # well cell -> normalized well, as the same few wells repeat on every plate
+    with open(path, 'r', newline='', encoding='utf-8-sig', errors='replace') as f:
+        reader = csv.reader(f)
+        columns = None
+        for row in reader:
+            columns = _header_map(row)
+            if columns is not None:
+                break
+        if columns is None:
+            raise ValueError(f"{path} has no Well column; is it a TapeStation or plate reader export?")
+
+        well_position = columns.pop("well")[0]
+        plate_position = columns.pop("plate", (None,))[0]
+        text_columns = [(field, position) for field, (position, factor) in columns.items() if factor is None]
+        number_columns = [(field, position, factor) for field, (position, factor) in columns.items()
+                          if factor is not None]
+        width = max([well_position, plate_position or 0, *(position for position, _ in columns.values())]) + 1
+
+        for row in reader:
+            if len(row) < width:
+                continue  # blank or summary line
+            cell = row[well_position]
+            well = wells_seen.get(cell)
+            if well is None:
+                well = wells_seen[cell] = normalize_well(cell) or ""
+            if not well:
+                continue  # a line that is not a well (ladders in a well are left out when matching)
+
+            region = {field: row[position].strip() for field, position in text_columns}
+            for field, position, factor in number_columns:
+                number = to_number(row[position])
+                region[field] = None if number is None else number * factor
+            plate = (row[plate_position].strip() or None) if plate_position is not None else None
+            regions.setdefault(plate, {}).setdefault(well, []).append(region)
+
+    if not regions:
+        raise ValueError(f"{path} has no wells")
+    return {plate: {well: _finish_well(well_regions) for well, well_regions in wells.items()}
+            for plate, wells in regions.items()}
+
+
+def read_exports(paths):
+    """Read several exports (e.g. TapeStation sizes and fluorometer concentrations) and merge them per well
+
+    Values from later files take precedence within a plate.
+    """
+    plates = {}
+    for path in paths:
+        for plate, wells in read_export(path).items():
+            merged = plates.setdefault(plate, {})
+            for well, record in wells.items():
+                merged.setdefault(well, {}).update(record)
+    return plates
+
+
+def plate_names(plates):
+    return [plate for plate in plates if plate is not None]
+
+
+def select_plate(plates, plate=None):
+    """The wells of one plate, with the values of plate-less exports added
+
+    Raises ValueError if there are several plates and none was chosen.
+    """
+    names = plate_names(plates)
+    if plate is None:
+        if len(names) > 1:
+            raise ValueError(f"The export has several plates: {', '.join(names)}")
+        plate = names[0] if names else None
+    elif plate not in plates:
+        raise ValueError(f"No plate {plate} in the export (found: {', '.join(names)})")
+
+    wells = {well: dict(record) for well, record in plates.get(plate, {}).items()}
+    if plate is not None:
+        for well, record in plates.get(None, {}).items():
+            wells.setdefault(well, {}).update(record)
+    return wells
+
+
+def _index_key(index, kit):
+    """(kit, well) of an index given as A1, 2B or SI-TT-A01; kit is the default kit"""
+    match = WELL_TOKEN.fullmatch(str(index).strip().upper())
+    if not match:
+        return kit, normalize_well(index) or str(index).strip()
+    return match.group(1) or kit, f"{match.group(2)}{int(match.group(3)):02d}"
+
+
+def is_ladder(record):
+    return bool(LADDER_PATTERN.search(record.get("sample", "")))
+
+
+def match_reactions(wells, indices=None, count=None, kit=None):
+    """The record of each reaction, by index or, without indices, the first count wells in order
+
+    Samples are matched on the index kit too when the index or kit names it;
+    raises ValueError if an index is missing or named by several samples.
+    """
+    wells = {well: record for well, record in wells.items() if not is_ladder(record)}
+    if not indices:
+        records = list(wells.values())
+        if count is None or len(records) < count:
+            raise ValueError(f"The export has {len(records)} wells, not {count}")
+        return records[:count]
+
+    by_sample = {}  # (kit or None, well) -> wells whose sample names it
+    for well, record in wells.items():
+        for sample_kit, letter, number in WELL_TOKEN.findall(record.get("sample", "").upper()):
+            by_sample.setdefault((sample_kit or None, f"{letter}{int(number):02d}"), {})[well] = record
+
+    records = []
+    missing = []
+    for index in indices:
+        index_kit, index_well = _index_key(index, kit)
+        label = f"{index_kit}-{index_well}" if index_kit else index_well
+        if index_kit:
+            # Samples naming this kit, or only the well
+            matches = {**by_sample.get((None, index_well), {}), **by_sample.get((index_kit, index_well), {})}
+        else:
+            matches = {well: record for (_, sample_well), named in by_sample.items() if sample_well == index_well
+                       for well, record in named.items()}
+        if len(matches) > 1:
+            raise ValueError(f"Index {label} is named by the samples of several wells ({', '.join(matches)})")
+        record = next(iter(matches.values()), None) or wells.get(index_well)
+        if record is None:
+            missing.append(label)
+        records.append(record)
+    if missing:
+        raise ValueError(f"No well or sample in the export for index {', '.join(missing)}")
+    return records
+
+
+def field_values(records, field):
+    """One field of every matched record; raises ValueError if any record lacks it"""
+    values = [record.get(field) for record in records]
+    if any(value is None for value in values):
+        raise ValueError(f"The export has no {field} for every reaction")
+    return values
+
+
+def format_values(values, field):
+    """Values as comma-separated text for the form (sizes as whole bp)"""
+    if field == "size":
+        return ",".join(str(round(value)) for value in values)
+    return ",".join(f"{round(value, 3):g}" for value in values)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Print per-reaction values from TapeStation or plate reader exports.")
+    parser.add_argument('exports', nargs='+')
+    parser.add_argument('--field', choices=FIELDS, required=True)
+    parser.add_argument('--indices', help="Library indices in reaction order, e.g. A1,B2 (match wells by index)")
+    parser.add_argument('--kit', help="Index kit of the libraries, e.g. SI-TT (for samples named by kit and well)")
+    parser.add_argument('--count', type=int, help="Number of reactions, matched in well order (without --indices)")
+    parser.add_argument('--plate', help="Plate to use in a multi-plate export")
+    args = parser.parse_args()
+
+    try:
+        wells = select_plate(read_exports(args.exports), args.plate)
+        indices = args.indices.split(',') if args.indices else None
+        values = field_values(match_reactions(wells, indices, args.count, args.kit and args.kit.upper()), args.field)
+    except (OSError, ValueError) as e:
+        print(e)
+        sys.exit(1)
+    print(format_values(values, args.field))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,629 @@
+"""Write-ahead journal for submissions, and undo of the last ones.
+
+A validated submission is appended to ``<log>.journal.jsonl`` (and fsynced)
+before anything else is written. The counters, the workbook and the sidecar
+files (manifest, aggregates, change feed, audit trail) are then applied from the journal
+entry, and a marker line records each stage that completed:
+
+    {"id": 4, "op": "append", "shard": "datalog.xlsx", "sheet": "HMBA", "first_row": 12,
+     "headers": [...], "rows": [[...], ...], "fills": [[8], ...], "counter_changes": [...],
+     "user": "lcaceres", "host": "bench-2", "time": "2025-03-24T15:02:44Z"}
+    {"id": 4, "stage": "saved"}      # counters and workbook written
+    {"id": 4, "stage": "manifest"}   # then one marker per sidecar file updated
+    {"id": 4, "stage": "applied"}    # everything done
+
+Entries without an ``applied`` marker are replayed by the next submission or
+at start up, so a crash or a workbook that is open in Excel never loses a
+submission. Rows are written to fixed row numbers and counter changes hold
+absolute values, so replaying an entry is idempotent. Pending entries are
+applied together with one load and save per shard, whatever study sheets they
+go to, and the journal is emptied once every entry in it is applied. Entries
+journaled before rows were split by study have no ``sheet`` and go to ``HMBA``.
+
+When several stations share the log, journaling and applying happen under
+``<log>.lock`` (see loglock.py). If another station appended rows where an
+entry was going to go, the entry is moved to the end of its sheet (recorded
+with a ``{"id": 4, "stage": "moved", "first_row": 30}`` marker before the
+save), and a shard that changed on disk between loading and saving is
+re-read and written again. Library names are checked against the log's
+manifest as an entry is journaled, and any that another station took since
+the rows were generated are moved to the next free set, so names stay unique
+wherever the entry's rows end up.
+
+Columns set later for rows already in the log (QC flags, pool names) are
+written by ``update_columns`` under the same lock, after pending entries, so
+they never race a submission.
+
+The last ``UNDO_DEPTH`` applied submissions are kept in ``<log>.undo.json``.
+Undoing one journals an ``undo`` entry that deletes exactly the rows it
+appended, sets the counters it changed back to their old values and hands its
+library sets back in the manifest, so the corrected batch gets the same names.
+
+    python journal.py undo [--log datalog.xlsx] [--yes]
+    python journal.py replay [--log datalog.xlsx]
+"""
+import os
+import sys
+import json
+import argparse
+from itertools import chain
+
+from aggregates import update_aggregates, remove_from_aggregates, update_pass_flags, settle_aggregates
+from audit import record_entry, submitted_by
+from change_feed import record_appends, record_deletes, record_updates
+from library_names import seed_index_counter, reserve_library_names, release_library_names, parse_library_name
+from logstore import (record_append, record_removal, record_widths, settle_counts, sheet_widths, get_sheet, save_workbook,
+                      save_json, read_frame, write_column, iter_rows, load_manifest, save_manifest,
+                      sidecar_path, script_dir, LEGACY_SHEET, DEFAULT_LOG_PATH)
+from loglock import log_lock, renew
+
+COUNTER_FILE = os.path.join(script_dir, 'sample_name_counter.json')
+
+# Number of submissions that can be undone, most recent first
+UNDO_DEPTH = 20
+
+# Times a shard is re-read and written again when it changes on disk while being written
+WRITE_ATTEMPTS = 5
+
+
+def journal_path(workbook_path):
+    return sidecar_path(workbook_path, '.journal.jsonl')
+
+
+def undo_path(workbook_path):
+    return sidecar_path(workbook_path, '.undo.json')
+
+
+def _append_line(workbook_path, record):
+    with open(journal_path(workbook_path), 'a') as f:
+        f.write(json.dumps(record, default=str) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def read_journal(workbook_path):
+    """Return (entries in order, {entry id: set of completed stages})
+
+    Entries moved to other rows by a ``moved`` marker carry their new first row.
+    """
+    entries, stages, moved = [], {}, {}
+    path = journal_path(workbook_path)
+    if not os.path.exists(path):
+        return entries, stages
+    with open(path, 'r') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # torn last line from a crash mid-write; that entry never happened
+            if "stage" in record:
+                stages.setdefault(record["id"], set()).add(record["stage"])
+                if record["stage"] == "moved":
+                    moved[record["id"]] = record["first_row"]
+            else:
+                entries.append(record)
+    for entry in entries:
+        if entry["id"] in moved:
+            entry["first_row"] = moved[entry["id"]]
+    return entries, stages
+
+
+def pending_entries(workbook_path):
+    entries, stages = read_journal(workbook_path)
+    return [(entry, stages.get(entry["id"], set())) for entry in entries
+            if not stages.get(entry["id"], set()) & {"applied", "cancelled"}]
+
+
+def entry_sheet(entry):
+    return entry.get("sheet") or LEGACY_SHEET
+
+
+def next_row(workbook_path, shard_path, row, sheet_name=LEGACY_SHEET):
+    """First free row of a sheet, allowing for pending entries not written to it yet"""
+    shard_name = os.path.basename(shard_path)
+    for entry, _ in pending_entries(workbook_path):
+        if (entry["shard"] == shard_name and entry_sheet(entry) == sheet_name
+                and entry.get("op", "append") == "append"):
+            row = max(row, entry["first_row"] + len(entry["rows"]))
+    return row
+
+
+# --- Counters ---
+def load_counters(counter_file):
+    if os.path.exists(counter_file):
+        with open(counter_file, 'r') as f:
+            try:
+                return json.load(f)
+            except json.JSONDecodeError:
+                pass
+    return {}
+
+
+def counter_changes(before, after, path=()):
+    """List the counter values a submission changed, down to one level inside date_info etc.
+
+    Each change is {"path": [...], "before": old, "after": new}, leaving out
+    "before" or "after" when the key did not exist.
+    """
+    changes = []
+    for key in sorted(set(before) | set(after)):
+        if key in before and key in after and before[key] == after[key]:
+            continue
+        if not path and isinstance(before.get(key), dict) and isinstance(after.get(key), dict):
+            changes.extend(counter_changes(before[key], after[key], (key,)))
+            continue
+        change = {"path": [*path, key]}
+        if key in before:
+            change["before"] = before[key]
+        if key in after:
+            change["after"] = after[key]
+        changes.append(change)
+    return changes
+
+
+def reverse_changes(changes):
+    reversed_changes = []
+    for change in changes:
+        reverse = {"path": change["path"]}
+        if "after" in change:
+            reverse["before"] = change["after"]
+        if "before" in change:
+            reverse["after"] = change["before"]
+        reversed_changes.append(reverse)
+    return reversed_changes
+
+
+def apply_counter_changes(counters, changes):
+    for change in changes:
+        *parents, key = change["path"]
+        target = counters
+        for parent in parents:
+            target = target.setdefault(parent, {})
+        if "after" in change:
+            target[key] = change["after"]
+        else:
+            target.pop(key, None)
+    return counters
+
+
+def _write_counters(counter_file, entries):
+    counters = load_counters(counter_file)
+    for entry in entries:
+        apply_counter_changes(counters, entry["counter_changes"])
+    save_json(counter_file, counters)  # a crash mid-write never leaves a truncated counter file
+
+
+# --- Workbook ---
+def make_entry(shard_path, first_row, headers, rows, fills, counter_data, sheet_name=LEGACY_SHEET):
+    """Build a journal entry for rows (lists in header order) to be written to a sheet from first_row
+
+    fills lists, per row, the column numbers to fill black. counter_data is the
+    counter state after the submission.
+    """
+    return {"shard": os.path.basename(shard_path), "sheet": sheet_name, "first_row": first_row,
+            "headers": list(headers), "rows": rows, "fills": fills, "counters": counter_data}
+
+
+def fit_column_widths(worksheet, rows, widths=None):
+    """Widen columns to fit rows just written and return the widths ({column letter: width})
+
+    widths are the cached widths of the sheet; without them every row of the
+    sheet is measured once.
+    """
+    from openpyxl.utils import get_column_letter
+
+    if widths is None:
+        widths = {}
+        rows = list(worksheet.iter_rows(values_only=True))
+    for row_data in rows:
+        for col_num, value in enumerate(row_data, start=1):
+            column_letter = get_column_letter(col_num)
+            widths[column_letter] = max(widths.get(column_letter, 0), len(str(value)) + 2)
+    for column_letter, width in widths.items():
+        worksheet.column_dimensions[column_letter].width = width
+    return widths
+
+
+def shard_stamp(shard_path):
+    """(mtime, size) of a shard, to tell whether it was saved by someone else since it was read"""
+    try:
+        stat = os.stat(shard_path)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _last_row(worksheet):
+    row_idx = worksheet.max_row
+    while row_idx > 1 and all(cell.value is None for cell in worksheet[row_idx]):
+        row_idx -= 1
+    return row_idx
+
+
+def _rows_at(worksheet, first_row, rows):
+    """Whether rows are already in the worksheet starting at first_row"""
+    for offset, row_data in enumerate(rows):
+        found = [cell.value for cell in worksheet[first_row + offset]][:len(row_data)]
+        if found + [None] * (len(row_data) - len(found)) != list(row_data):
+            return False
+    return True
+
+
+def _place_entries(worksheet, entries, on_move):
+    """Keep entries clear of rows another station appended since they were planned
+
+    An entry whose rows are taken by other data is moved after the last row
+    (or to where it was already written before a crash), one planned past the
+    end (a stale cursor, e.g. after rows were deleted by hand) is moved up to
+    it, and on_move(entry) is called with its new first_row before anything
+    is saved.
+    """
+    last_row = _last_row(worksheet)
+    for entry in entries:
+        first_row, rows = entry["first_row"], entry["rows"]
+        if first_row > last_row + 1:
+            entry["first_row"] = first_row = last_row + 1
+            on_move(entry)
+        if first_row > last_row or _rows_at(worksheet, first_row, rows):
+            last_row = max(last_row, first_row + len(rows) - 1)
+            continue
+
+        new_first_row = next((row_idx for row_idx in range(first_row, last_row + 1)
+                              if worksheet.cell(row=row_idx, column=1).value == rows[0][0]
+                              and _rows_at(worksheet, row_idx, rows)), last_row + 1)
+        entry["first_row"] = new_first_row
+        on_move(entry)
+        last_row = max(last_row, new_first_row + len(rows) - 1)
+
+
+def _write_shard(workbook_path, shard_path, entries, on_move=lambda entry: None):
+    """Write the rows of entries to the study sheets of one shard with a single load and save
+
+    If the shard is saved by someone else while it is being written, it is
+    read again and the rows re-placed after whatever was added.
+    """
+    from openpyxl import Workbook, load_workbook
+    from openpyxl.styles import Font, PatternFill
+
+    default_font = Font(name="Arial", size=10)
+    black_fill = PatternFill(start_color='000000', fill_type='solid')
+
+    by_sheet = {}
+    for entry in entries:
+        by_sheet.setdefault(entry_sheet(entry), []).append(entry)
+
+    for _ in range(WRITE_ATTEMPTS):
+        stamp = shard_stamp(shard_path)
+        if stamp is not None:
+            workbook = load_workbook(shard_path)
+        else:
+            workbook = Workbook()
+            workbook.remove(workbook.active)  # sheets are created as studies are written
+
+        widths = {}
+        for sheet_name, sheet_entries in by_sheet.items():
+            worksheet = get_sheet(workbook, sheet_name, sheet_entries[0]["headers"])
+            _place_entries(worksheet, sheet_entries, on_move)
+            for entry in sheet_entries:
+                for offset, (row_data, fill_columns) in enumerate(zip(entry["rows"], entry["fills"])):
+                    row_idx = entry["first_row"] + offset
+                    for col_num, value in enumerate(row_data, start=1):
+                        worksheet.cell(row=row_idx, column=col_num, value=value).font = default_font
+                    for col_num in fill_columns:
+                        worksheet.cell(row=row_idx, column=col_num).fill = black_fill
+
+            cached = sheet_widths(workbook_path, shard_path, sheet_name) if stamp is not None else None
+            widths[sheet_name] = fit_column_widths(
+                worksheet, [row_data for entry in sheet_entries for row_data in entry["rows"]], cached)
+
+        if shard_stamp(shard_path) != stamp:
+            continue  # saved elsewhere in the meantime; start over from what is on disk now
+        save_workbook(workbook, shard_path)
+        for sheet_name, sheet_width in widths.items():
+            record_widths(workbook_path, shard_path, sheet_name, sheet_width)
+        return
+    raise OSError(f"{os.path.basename(shard_path)} kept changing while it was being written.")
+
+
+def _remove_rows(shard_path, entry):
+    """Delete the rows of an undone submission, which must still be the last rows of its sheet"""
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(shard_path)
+    worksheet = workbook[entry_sheet(entry)]
+    first_row, count = entry["first_row"], len(entry["rows"])
+    found = [worksheet.cell(row=first_row + offset, column=1).value for offset in range(count)]
+    if all(value is None for value in found):
+        return  # already removed before a crash
+    if found != [row_data[0] for row_data in entry["rows"]] or any(
+            cell.value is not None for cell in worksheet[first_row + count]):
+        raise ValueError(f"The rows of the last submission in {os.path.basename(shard_path)} "
+                         f"were changed or are no longer the last rows.")
+    worksheet.delete_rows(first_row, count)
+    save_workbook(workbook, shard_path)
+
+
+# --- Undo stack ---
+def load_undo_stack(workbook_path):
+    path = undo_path(workbook_path)
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            try:
+                return json.load(f)
+            except json.JSONDecodeError:
+                pass
+    return []
+
+
+def save_undo_stack(workbook_path, stack):
+    with open(undo_path(workbook_path), 'w') as f:
+        json.dump(stack[-UNDO_DEPTH:], f)
+
+
+def _push_undo(workbook_path, entry):
+    stack = load_undo_stack(workbook_path)
+    stack.append({"sheet": entry_sheet(entry), "library_sets_before": entry.get("library_sets_before"),
+                  **{key: entry[key] for key in ("shard", "first_row", "headers", "rows", "counter_changes")}})
+    save_undo_stack(workbook_path, stack)
+
+
+def _pop_undo(workbook_path, entry):
+    stack = load_undo_stack(workbook_path)
+    if (stack and stack[-1]["shard"] == entry["shard"] and entry_sheet(stack[-1]) == entry_sheet(entry)
+            and stack[-1]["first_row"] == entry["first_row"]):
+        stack.pop()
+        save_undo_stack(workbook_path, stack)
+
+
+def last_submission(workbook_path):
+    """The submission undo_last would remove, or None"""
+    stack = load_undo_stack(workbook_path)
+    return stack[-1] if stack else None
+
+
+# --- Applying entries ---
+def _sidecar_steps(workbook_path, entry):
+    shard_path = os.path.join(os.path.dirname(workbook_path), entry["shard"])
+    sheet_name = entry_sheet(entry)
+    rows = [dict(zip(entry["headers"], row_data)) for row_data in entry["rows"]]
+    if entry.get("op", "append") == "undo":
+        return [("manifest", lambda: record_removal(workbook_path, shard_path, len(rows), sheet_name)),
+                ("aggregates", lambda: remove_from_aggregates(workbook_path, rows)),
+                ("feed", lambda: record_deletes(workbook_path, shard_path, sheet_name, entry["first_row"], rows)),
+                ("names", lambda: _release_names(workbook_path, entry)),
+                ("undo", lambda: _pop_undo(workbook_path, entry)),
+                ("audit", lambda: record_entry(workbook_path, entry))]
+    return [("manifest", lambda: record_append(workbook_path, shard_path, rows, sheet_name=sheet_name)),
+            ("aggregates", lambda: update_aggregates(workbook_path, rows)),
+            ("feed", lambda: record_appends(workbook_path, shard_path, sheet_name, entry["first_row"], rows)),
+            ("undo", lambda: _push_undo(workbook_path, entry)),
+            ("audit", lambda: record_entry(workbook_path, entry))]
+
+
+def _unrecorded_rows(pending, stage):
+    """Rows (appended, removed) of pending entries whose sidecar stage has not run yet"""
+    appended, removed = [], []
+    for entry, stages in pending:
+        if stage not in stages:
+            rows = removed if entry.get("op", "append") == "undo" else appended
+            rows.extend(dict(zip(entry["headers"], row_data)) for row_data in entry["rows"])
+    return appended, removed
+
+
+def apply_pending(workbook_path, counter_file):
+    """Apply every pending entry and return False if a workbook could not be written yet
+
+    Raises loglock.LockTimeout if another station holds the log for too long.
+    """
+    with log_lock(workbook_path) as lock:
+        return _apply_pending(workbook_path, counter_file, lock)
+
+
+def _apply_pending(workbook_path, counter_file, lock):
+    pending = pending_entries(workbook_path)
+    if not pending:
+        return True
+
+    directory = os.path.dirname(workbook_path)
+    unsaved = [entry for entry, stages in pending if "saved" not in stages]
+    if unsaved and unsaved[0].get("op") == "undo":
+        # undo_last only journals an undo when nothing else is pending.
+        # Rows first: the counters must not roll back while the rows are still in the log.
+        entry = unsaved[0]
+        try:
+            _remove_rows(os.path.join(directory, entry["shard"]), entry)
+        except OSError:
+            return False
+        _write_counters(counter_file, [entry])
+        _append_line(workbook_path, {"id": entry["id"], "stage": "saved"})
+    elif unsaved:
+        # Counters first: later submissions must not reuse names even while the workbook is locked
+        _write_counters(counter_file, unsaved)
+
+        by_shard = {}
+        for entry in unsaved:
+            by_shard.setdefault(entry["shard"], []).append(entry)
+        for shard_name, entries in by_shard.items():
+            try:
+                _write_shard(workbook_path, os.path.join(directory, shard_name), entries, lambda entry: _append_line(
+                    workbook_path, {"id": entry["id"], "stage": "moved", "first_row": entry["first_row"]}))
+            except OSError:
+                return False  # e.g. the workbook is open in Excel; stays pending
+            for entry in entries:
+                _append_line(workbook_path, {"id": entry["id"], "stage": "saved"})
+            renew(lock)
+
+    # Row counts and aggregates not known yet are read from the log, which now holds every entry of the batch
+    settle_counts(workbook_path, [(os.path.join(directory, entry["shard"]), entry_sheet(entry),
+                                   -len(entry["rows"]) if entry.get("op", "append") == "undo" else len(entry["rows"]))
+                                  for entry, stages in pending if "manifest" not in stages])
+    settle_aggregates(workbook_path, *_unrecorded_rows(pending, "aggregates"))
+    for entry, stages in pending:
+        # Each sidecar update is marked on its own so a replay never applies it twice
+        for stage, apply_step in _sidecar_steps(workbook_path, entry):
+            if stage not in stages:
+                apply_step()
+                _append_line(workbook_path, {"id": entry["id"], "stage": stage})
+        _append_line(workbook_path, {"id": entry["id"], "stage": "applied"})
+
+    # Everything is applied: start the next journal empty
+    open(journal_path(workbook_path), 'w').close()
+    return True
+
+
+def _journal(workbook_path, entry):
+    entries, _ = read_journal(workbook_path)
+    entry = {"id": (entries[-1]["id"] + 1) if entries else 1, **entry}
+    _append_line(workbook_path, entry)
+    return entry
+
+
+def _reserve_names(workbook_path, entry, index_counter):
+    """Rename the entry's libraries whose names are already used in the log; called under the log lock"""
+    manifest = load_manifest(workbook_path)
+    library_sets = manifest.get("library_sets")
+    if library_sets is None:
+        # First use: every name in the log and in entries not written to it yet
+        pending_rows = (dict(zip(pending["headers"], row_data))
+                        for pending, _ in pending_entries(workbook_path) for row_data in pending["rows"])
+        library_sets = seed_index_counter(chain(iter_rows(workbook_path), pending_rows))
+
+    # What the keys were before, for undo to hand the sets back
+    keys = seed_index_counter(dict(zip(entry["headers"], row_data)) for row_data in entry["rows"])
+    entry["library_sets_before"] = {key: library_sets.get(key, 0) for key in keys}
+    renamed = reserve_library_names(library_sets, entry["headers"], entry["rows"])
+    for library_name in renamed.values():
+        key, set_number = parse_library_name(library_name)
+        index_counter[key] = max(index_counter.get(key, 0), set_number)
+
+    # Saved before the entry is journaled: a set reserved but never written is only a gap
+    manifest["library_sets"] = library_sets
+    save_manifest(workbook_path, manifest)
+    return renamed
+
+
+def _release_names(workbook_path, entry):
+    """Hand the library sets of an undone submission back; called under the log lock"""
+    manifest = load_manifest(workbook_path)
+    if "library_sets" not in manifest or entry.get("library_sets_before") is None:
+        return  # journaled before names were reserved in the manifest
+    release_library_names(manifest["library_sets"], entry["library_sets_before"], entry["headers"], entry["rows"])
+    save_manifest(workbook_path, manifest)
+
+
+def submit(workbook_path, counter_file, entry, on_rename=lambda renamed: None):
+    """Journal a submission, then apply it with anything still pending
+
+    Library names another station used since the rows were generated are
+    changed in the rows (and the submission's counters) first, and
+    on_rename({old name: new name}) is called. Returns True once it is in the
+    workbook, False if it stays journaled for later. Raises
+    loglock.LockTimeout, without journaling it, if another station holds the
+    log for too long.
+    """
+    entry = dict(entry)
+    counters = entry.pop("counters")
+    with log_lock(workbook_path) as lock:
+        renamed = _reserve_names(workbook_path, entry, counters.setdefault("index_counter", {}))
+        if renamed:
+            on_rename(renamed)
+        entry = {"op": "append", **entry, **submitted_by(),
+                 "counter_changes": counter_changes(load_counters(counter_file), counters)}
+        _journal(workbook_path, entry)
+        return _apply_pending(workbook_path, counter_file, lock)
+
+
+def undo_last(workbook_path, counter_file):
+    """Remove the rows of the last submission and roll its counter changes back
+
+    Returns the undone submission, or None if there is nothing to undo. Raises
+    OSError if the workbook cannot be written (e.g. it is open in Excel) and
+    ValueError if its rows were edited since; nothing is changed in either case.
+    """
+    with log_lock(workbook_path) as lock:
+        return _undo_last(workbook_path, counter_file, lock)
+
+
+def _undo_last(workbook_path, counter_file, lock):
+    if not _apply_pending(workbook_path, counter_file, lock):
+        raise OSError(f"Earlier submissions are still waiting to be written to {workbook_path}.")
+    submission = last_submission(workbook_path)
+    if submission is None:
+        return None
+
+    entry = _journal(workbook_path, {"op": "undo", "shard": submission["shard"], "sheet": entry_sheet(submission),
+                                     "first_row": submission["first_row"], "headers": submission["headers"],
+                                     "rows": submission["rows"], **submitted_by(),
+                                     "library_sets_before": submission.get("library_sets_before"),
+                                     "counter_changes": reverse_changes(submission["counter_changes"])})
+    try:
+        applied = _apply_pending(workbook_path, counter_file, lock)
+    except ValueError:
+        _append_line(workbook_path, {"id": entry["id"], "stage": "cancelled"})
+        raise
+    if not applied:
+        _append_line(workbook_path, {"id": entry["id"], "stage": "cancelled"})
+        raise OSError(f"Could not save {submission['shard']}. Is it open in Excel?")
+    return submission
+
+
+# --- Column updates ---
+def update_columns(workbook_path, compute, counter_file=COUNTER_FILE):
+    """Set columns of rows already in the log, serialized with submissions
+
+    Pending entries are applied first; then compute(frame) is called with the
+    log as read under the lock and returns {header: {(shard name, sheet name,
+    row number): value}}. Each column is written and fed to the change feed
+    (and pass flags to the aggregates) before the lock is released. Returns the updates. Raises loglock.LockTimeout,
+    or OSError if the log cannot be written (nothing is changed then).
+    """
+    with log_lock(workbook_path) as lock:
+        if not _apply_pending(workbook_path, counter_file, lock):
+            raise OSError(f"Earlier submissions are still waiting to be written to {workbook_path}.")
+        frame = read_frame(workbook_path)
+        updates = compute(frame)
+        for header, values_by_location in updates.items():
+            renew(lock)
+            write_column(workbook_path, header, values_by_location)
+            record_updates(workbook_path, header, values_by_location)
+            if header == "library_prep_pass_fail":
+                update_pass_flags(workbook_path, frame, values_by_location)
+    return updates
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Undo the last submission or replay journaled ones.")
+    parser.add_argument('command', choices=['undo', 'replay'])
+    parser.add_argument('--log', default=DEFAULT_LOG_PATH)
+    parser.add_argument('--counters', default=COUNTER_FILE, help="Counter file (sample_name_counter.json)")
+    parser.add_argument('--yes', action='store_true', help="Undo without asking for confirmation")
+    args = parser.parse_args()
+
+    if args.command == 'replay':
+        if not apply_pending(args.log, args.counters):
+            print(f"Could not save {args.log}. Is it open in Excel?")
+            sys.exit(1)
+        print("All journaled submissions are in the log.")
+        return
+
+    submission = last_submission(args.log)
+    if submission is None:
+        print("There is no submission to undo.")
+        sys.exit(1)
+    print(f"The last submission wrote {len(submission['rows'])} rows to {submission['shard']} "
+          f"(sheet {entry_sheet(submission)}):")
+    for row_data in submission["rows"]:
+        print(f"  {row_data[0]}")
+    if not args.yes and input("Undo it? (y/n) ").strip().lower() not in ("y", "yes"):
+        return
+
+    try:
+        undo_last(args.log, args.counters)
+    except (OSError, ValueError) as e:
+        print(f"Nothing was undone: {e}")
+        sys.exit(1)
+    print("Submission undone.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""Persistent index of every library name generated for the log.
+
+Library names look like ``LPLCXR_250304_2_A01``: library type, prep date,
+library_prep_set number and index well. The index maps each
+(library_type, library_prep_date, library_index) tuple to the highest set
+number already used for it and lives in the counter file under
+``"index_counter"``, so collisions are checked in O(1) per row without
+rescanning the workbook.
+
+The counter file belongs to one station, so names are allocated there only
+provisionally. The same index for the whole log is kept in its manifest
+(``"library_sets"``), and ``reserve_library_names`` checks a submission
+against it under the log lock when it is journaled, moving any library whose
+name another station took in the meantime to the next free set. Undoing a
+submission hands its sets back (``release_library_names``), so the corrected
+batch gets the same names again.
+"""
+
+
+def library_key(library_type, library_prep_date, library_index):
+    return f"{library_type}_{library_prep_date}_{library_index}"
+
+
+def parse_library_name(library_name):
+    """Split a library name into its index key and set number, or None"""
+    if not isinstance(library_name, str):
+        return None
+    parts = library_name.strip().split("_")
+    if len(parts) != 4 or not parts[2].isdigit():
+        return None
+    library_type, library_prep_date, set_number, library_index = parts
+    return library_key(library_type, library_prep_date, library_index), int(set_number)
+
+
+def seed_index_counter(rows):
+    """Build the index from the library names of existing log rows (one-time migration)"""
+    index_counter = {}
+    for row in rows:
+        parsed = parse_library_name(row.get('library_name'))
+        if parsed:
+            key, set_number = parsed
+            index_counter[key] = max(index_counter.get(key, 0), set_number)
+    return index_counter
+
+
+def allocate_library_name(index_counter, library_type, library_prep_date, library_index):
+    """Reserve the next free library_prep_set for an index and return (library_prep_set, library_name)"""
+    key = library_key(library_type, library_prep_date, library_index)
+    set_number = index_counter.get(key, 0) + 1
+    index_counter[key] = set_number
+
+    library_prep_set = f"{library_type}_{library_prep_date}_{set_number}"
+    return library_prep_set, f"{library_prep_set}_{library_index}"
+
+
+def reserve_library_names(library_sets, headers, rows):
+    """Move libraries whose names are already in library_sets to the next free set, in place
+
+    The rows' names are added to library_sets. Returns {old name: new name} for the renamed ones.
+    """
+    if 'library_name' not in headers:
+        return {}
+    name_col = headers.index('library_name')
+    set_col = headers.index('library_prep_set') if 'library_prep_set' in headers else None
+
+    renamed = {}
+    for row in rows:
+        parsed = parse_library_name(row[name_col])
+        if not parsed:
+            continue
+        key, set_number = parsed
+        if set_number <= library_sets.get(key, 0):
+            set_number = library_sets[key] + 1
+            library_type, library_prep_date, library_index = key.split("_")
+            library_prep_set = f"{library_type}_{library_prep_date}_{set_number}"
+            renamed[row[name_col]] = row[name_col] = f"{library_prep_set}_{library_index}"
+            if set_col is not None:
+                row[set_col] = library_prep_set
+        library_sets[key] = set_number
+    return renamed
+
+
+def release_library_names(library_sets, before, headers, rows):
+    """Take an undone submission's names back out of library_sets, in place
+
+    before holds the values library_sets had for the submission's keys when
+    it was reserved (0 if none). A key is only lowered while the set the
+    submission used is still its highest.
+    """
+    used = seed_index_counter(dict(zip(headers, row_data)) for row_data in rows)
+    for key, set_number in used.items():
+        if key not in before or library_sets.get(key) != set_number:
+            continue
+        if before[key]:
+            library_sets[key] = before[key]
+        else:
+            del library_sets[key]
+    return library_sets
+
+
+def allocate_amplified_cdna_name(amp_counter, experiment_date, cdna_amplification_date, prefix="APLCXR"):
+    """Name the next amplified cDNA of an experiment date: wells A-H, a new batch every 8 reactions"""
+    reaction_count = amp_counter.get(experiment_date, 0)
+    amp_counter[experiment_date] = reaction_count + 1
+
+    letter = chr(65 + (reaction_count % 8))
+    batch_num_for_amp = (reaction_count // 8) + 1
+    return f"{prefix}_{cdna_amplification_date}_{batch_num_for_amp}_{letter}"
@@ -0,0 +1,123 @@
+"""Lock on a log shared by several stations on a network drive.
+
+Writers hold ``<log>.lock`` only while they append to the journal and write
+the workbook. The lock file is created exclusively and records its owner and
+when its lease runs out:
+
+    {"owner": "bench-2:4312", "token": "...", "expires": 1718040000.0}
+
+A station that finds the lock taken polls until it is released, and takes
+it over once the lease has expired (the holder crashed or lost the mount).
+The holder renews the lease between slow steps. Because a lease can still
+run out under a stalled holder, the workbook itself is also checked
+optimistically before saving; see ``journal._write_shard``.
+
+    with log_lock(workbook_path) as lock:
+        ...
+        renew(lock)
+"""
+import os
+import json
+import time
+import uuid
+import socket
+from contextlib import contextmanager
+
+from logstore import sidecar_path
+
+# Seconds a lock is valid without renewal, and seconds to wait for one
+LEASE_SECONDS = 60
+WAIT_SECONDS = 30
+POLL_SECONDS = 0.2
+
+
+class LockTimeout(OSError):
+    """The log stayed locked by another station for longer than the wait"""
+
+
+def lock_path(workbook_path):
+    return sidecar_path(workbook_path, '.lock')
+
+
+def station_id():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def read_lock(path):
+    """The lock record at path, or None if there is none (or it is being written)"""
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+
+
+def _write_lock(path, lock, exclusive):
+    flags = os.O_WRONLY | os.O_CREAT | (os.O_EXCL if exclusive else os.O_TRUNC)
+    fd = os.open(path, flags)
+    with os.fdopen(fd, 'w') as f:
+        json.dump(lock, f)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _break_stale(path, stale):
+    """Remove an expired lock, unless another station replaced it in the meantime"""
+    moved = f"{path}.{uuid.uuid4().hex}"
+    try:
+        os.rename(path, moved)
+    except OSError:
+        return  # already gone
+    if (read_lock(moved) or {}).get("token") == stale.get("token"):
+        os.remove(moved)
+    else:
+        os.replace(moved, path)  # a fresh lock; put it back
+
+
+def acquire(workbook_path, lease=LEASE_SECONDS, wait=WAIT_SECONDS):
+    """Take the lock, waiting up to wait seconds; raises LockTimeout"""
+    path = lock_path(workbook_path)
+    deadline = time.time() + wait
+    while True:
+        lock = {"owner": station_id(), "token": uuid.uuid4().hex, "expires": time.time() + lease,
+                "lease": lease, "path": path}
+        try:
+            _write_lock(path, lock, exclusive=True)
+            return lock
+        except FileExistsError:
+            pass
+
+        holder = read_lock(path)
+        if holder is not None and holder.get("expires", 0) < time.time():
+            _break_stale(path, holder)
+            continue
+        if time.time() >= deadline:
+            owner = holder["owner"] if holder else "another station"
+            raise LockTimeout(f"The log is being written by {owner}. Try again in a moment.")
+        time.sleep(POLL_SECONDS)
+
+
+def renew(lock):
+    """Extend the lease; returns False if the lock was lost (e.g. it expired and was taken over)"""
+    if (read_lock(lock["path"]) or {}).get("token") != lock["token"]:
+        return False
+    lock["expires"] = time.time() + lock["lease"]
+    _write_lock(lock["path"], lock, exclusive=False)
+    return True
+
+
+def release(lock):
+    if (read_lock(lock["path"]) or {}).get("token") == lock["token"]:
+        try:
+            os.remove(lock["path"])
+        except FileNotFoundError:
+            pass
+
+
+@contextmanager
+def log_lock(workbook_path, lease=LEASE_SECONDS, wait=WAIT_SECONDS):
+    lock = acquire(workbook_path, lease, wait)
+    try:
+        yield lock
+    finally:
+        release(lock)
@@ -0,0 +1,501 @@
+"""Access to the data log for tools that work over the whole log.
+
+The log can be split into shard workbooks so that the workbook new rows are
+appended to stays small. ``<log>.manifest.json`` lists the shards in order with the
+global row range and date ranges each one holds; the configured log file
+itself is always the first shard. A new shard is started when the active one
+reaches ``max_rows`` (``"mode": "rows"``) or when the calendar month changes
+(``"mode": "month"``), as set by the manifest's ``"policy"``.
+
+Within a shard, rows go to one sheet per study (``sheet_for_study``); the
+HMBA study keeps the original ``HMBA`` sheet. Each shard's manifest entry
+caches, per sheet, its number of data rows (the append cursor) and its column
+widths, so appending to a sheet never scans it:
+
+    "sheets": {"HMBA": {"rows": 412, "widths": {"A": 38, ...}}}
+
+A shard's ``edits`` counts the times rows already in it were removed (undo)
+or changed in place (``write_column``), so incremental readers such as the
+columnar export can tell that rows they read before are stale. The manifest's
+``"library_sets"`` holds the highest library set used per index across the
+log (see library_names.py).
+
+Everything here takes the configured log path and works across all shards
+and sheets (or a single study's sheet): rows are streamed from read-only
+workbooks so memory stays bounded, and bulk updates are applied with a single
+load and save per shard touched. Rows are located by (shard name, sheet name,
+row number).
+
+Workbooks are never overwritten in place: ``save_workbook`` writes a
+temporary file next to the shard, fsyncs it and renames it over the shard,
+so a reader (Excel, a notebook, a sync job) opening it mid-save gets the old
+or the new version, never a truncated one. The replaced versions are kept in
+``<shard>.snapshots/`` (``1.xlsx`` newest).
+"""
+import os
+import sys
+import json
+import uuid
+import shutil
+from datetime import datetime
+
+if getattr(sys, 'frozen', False):
+    script_dir = os.path.dirname(sys.executable)
+else:
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+
+# Where PyInstaller unpacks the files bundled with the app (its datas); the source directory otherwise
+bundle_dir = getattr(sys, '_MEIPASS', script_dir)
+
+# Where the command line logger keeps the log; tools default to it
+DEFAULT_LOG_PATH = os.path.join(script_dir, 'datalog.xlsx')
+
+DEFAULT_SHARD_POLICY = {"mode": "rows", "max_rows": 10000}
+
+# Columns whose min/max is tracked per shard so date-filtered queries can skip shards
+DATE_COLUMNS = ('experiment_start_date', 'library_creation_date')
+
+# Previous versions kept of each shard
+SNAPSHOT_DEPTH = 3
+
+# The sheet every row went to before rows were split by study
+LEGACY_SHEET = "HMBA"
+
+# Studies whose sheet is not named after them
+STUDY_SHEETS = {"HMBA_CjAtlas_Subcortex": LEGACY_SHEET}
+
+# Excel's limit on sheet names, and the characters it does not allow in them
+SHEET_NAME_LENGTH = 31
+SHEET_NAME_FORBIDDEN = '[]:*?/\\'
+
+
+def data_path(name):
+    """Path of a file shipped with the app, e.g. protocols.json
+
+    An editable copy next to the app (or the script) takes precedence over the
+    bundled default.
+    """
+    override = os.path.join(script_dir, name)
+    return override if os.path.exists(override) else os.path.join(bundle_dir, name)
+
+
+def sidecar_path(workbook_path, suffix):
+    """Path of a file kept next to the log, e.g. datalog.xlsx -> datalog.aggregates.json"""
+    return os.path.splitext(workbook_path)[0] + suffix
+
+
+# --- Shard manifest ---
+def manifest_path(workbook_path):
+    return sidecar_path(workbook_path, '.manifest.json')
+
+
+def load_manifest(workbook_path):
+    path = manifest_path(workbook_path)
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            try:
+                return json.load(f)
+            except json.JSONDecodeError:
+                pass
+
+    # No manifest yet: the log is a single shard whose size is not known
+    return {
+        "policy": dict(DEFAULT_SHARD_POLICY),
+        "shards": [{"path": os.path.basename(workbook_path), "first_row": 1, "rows": None,
+                    "month": None, "dates": {}}]
+    }
+
+
+def save_manifest(workbook_path, manifest):
+    with open(manifest_path(workbook_path), 'w') as f:
+        json.dump(manifest, f, indent=4)
+
+
+def count_rows(shard_path, sheet_name=None):
+    """Number of data rows in a shard workbook, or in one of its sheets
+
+    Used once for logs created before the manifest (or before it cached the sheet).
+    """
+    from openpyxl import load_workbook
+
+    if not os.path.exists(shard_path):
+        return 0
+    workbook = load_workbook(shard_path, read_only=True)
+    try:
+        if sheet_name is not None:
+            worksheets = [workbook[sheet_name]] if sheet_name in workbook.sheetnames else []
+        else:
+            worksheets = workbook.worksheets
+        return sum(max(worksheet.max_row - 1, 0) for worksheet in worksheets)
+    finally:
+        workbook.close()
+
+
+def shard_paths(workbook_path, date_column=None, since=None, until=None):
+    """Paths of the shards in log order, skipping those outside a date range when it is known"""
+    directory = os.path.dirname(workbook_path)
+    for shard in load_manifest(workbook_path)["shards"]:
+        date_range = (shard.get("dates") or {}).get(date_column) if date_column else None
+        if date_range:
+            first, last = date_range
+            if (since and last < since) or (until and first > until):
+                continue
+        yield os.path.join(directory, shard["path"])
+
+
+def active_shard_path(workbook_path, now=None):
+    """Return the shard new rows should be appended to, starting a new one when the policy says so"""
+    manifest = load_manifest(workbook_path)
+    policy = manifest.get("policy", DEFAULT_SHARD_POLICY)
+    directory = os.path.dirname(workbook_path)
+    shard = manifest["shards"][-1]
+    month = (now or datetime.now()).strftime('%Y-%m')
+
+    if policy.get("mode") == "month":
+        roll_over = shard.get("month") not in (None, month)
+    else:
+        if shard["rows"] is None:
+            shard["rows"] = count_rows(os.path.join(directory, shard["path"]))
+        roll_over = shard["rows"] >= policy.get("max_rows", DEFAULT_SHARD_POLICY["max_rows"])
+
+    if roll_over:
+        if shard["rows"] is None:
+            shard["rows"] = count_rows(os.path.join(directory, shard["path"]))
+        base_name = os.path.splitext(os.path.basename(workbook_path))[0]
+        suffix = month if policy.get("mode") == "month" else str(len(manifest["shards"]) + 1).zfill(3)
+        shard = {"path": f"{base_name}_{suffix}.xlsx", "first_row": shard["first_row"] + shard["rows"],
+                 "rows": 0, "month": month, "dates": {}}
+        manifest["shards"].append(shard)
+        save_manifest(workbook_path, manifest)
+
+    return os.path.join(directory, shard["path"])
+
+
+def _shard_entry(manifest, shard_path):
+    shard_name = os.path.basename(shard_path)
+    return next(s for s in manifest["shards"] if s["path"] == shard_name)
+
+
+def settle_counts(workbook_path, changes):
+    """Fill in unknown row counts of shards and sheets from their files, as of before changes
+
+    changes lists (shard path, sheet name, rows) for journal entries already
+    written to the shard files but not recorded here yet (negative rows for
+    removals), so recording each of them afterwards counts it exactly once.
+    """
+    by_sheet, by_shard = {}, {}
+    for shard_path, sheet_name, rows in changes:
+        by_sheet[(shard_path, sheet_name)] = by_sheet.get((shard_path, sheet_name), 0) + rows
+        by_shard[shard_path] = by_shard.get(shard_path, 0) + rows
+
+    manifest = load_manifest(workbook_path)
+    counted = False
+    for (shard_path, sheet_name), rows in by_sheet.items():
+        sheet = _shard_entry(manifest, shard_path).setdefault("sheets", {}).setdefault(
+            sheet_name, {"rows": None, "widths": None})
+        if sheet["rows"] is None:
+            sheet["rows"] = count_rows(shard_path, sheet_name) - rows
+            counted = True
+    for shard_path, rows in by_shard.items():
+        shard = _shard_entry(manifest, shard_path)
+        if shard["rows"] is None:
+            shard["rows"] = count_rows(shard_path) - rows
+            if shard["rows"]:
+                shard["dates"] = None  # the dates of the older rows are unknown
+            counted = True
+    if counted:
+        save_manifest(workbook_path, manifest)
+
+
+def record_append(workbook_path, shard_path, rows, now=None, sheet_name=LEGACY_SHEET):
+    """Update the manifest after rows (dicts keyed by header) were appended to a sheet of a shard"""
+    manifest = load_manifest(workbook_path)
+    shard = _shard_entry(manifest, shard_path)
+
+    sheet = shard.setdefault("sheets", {}).setdefault(sheet_name, {"rows": None, "widths": None})
+    if sheet["rows"] is None:
+        sheet["rows"] = count_rows(shard_path, sheet_name)  # already holds the new rows
+    else:
+        sheet["rows"] += len(rows)
+
+    if shard["rows"] is None:
+        # First append since the manifest was created: the shard already holds the new rows,
+        # and the dates of any older rows are unknown
+        shard["rows"] = count_rows(shard_path)
+        if shard["rows"] > len(rows):
+            shard["dates"] = None
+    else:
+        shard["rows"] += len(rows)
+
+    if shard["dates"] is not None:
+        for column in DATE_COLUMNS:
+            values = [str(row[column]) for row in rows if row.get(column)]
+            if not values:
+                continue
+            first, last = shard["dates"].get(column, [min(values), max(values)])
+            shard["dates"][column] = [min(first, *values), max(last, *values)]
+    if shard.get("month") is None:
+        shard["month"] = (now or datetime.now()).strftime('%Y-%m')
+
+    save_manifest(workbook_path, manifest)
+
+
+def record_removal(workbook_path, shard_path, count, sheet_name=LEGACY_SHEET):
+    """Update the manifest after the last count rows of a sheet of a shard were removed
+
+    The shard's date ranges and the sheet's column widths are left as they are;
+    they may only be wider than needed.
+    """
+    manifest = load_manifest(workbook_path)
+    shard = _shard_entry(manifest, shard_path)
+    if shard["rows"] is not None:
+        shard["rows"] = max(shard["rows"] - count, 0)
+    sheet = shard.get("sheets", {}).get(sheet_name)
+    if sheet and sheet["rows"] is not None:
+        sheet["rows"] = max(sheet["rows"] - count, 0)
+    shard["edits"] = shard.get("edits", 0) + 1
+    save_manifest(workbook_path, manifest)
+
+
+# --- Study sheets ---
+def sheet_for_study(study):
+    """Name of the sheet a study's rows go to"""
+    study = (study or "").strip()
+    if not study:
+        return LEGACY_SHEET
+    if study in STUDY_SHEETS:
+        return STUDY_SHEETS[study]
+    name = "".join("_" if char in SHEET_NAME_FORBIDDEN else char for char in study).strip("'")
+    return name[:SHEET_NAME_LENGTH] or LEGACY_SHEET
+
+
+def sheet_next_row(workbook_path, shard_path, sheet_name):
+    """Row the next rows of a sheet go to, from the cursor cached in the manifest"""
+    sheet = _shard_entry(load_manifest(workbook_path), shard_path).get("sheets", {}).get(sheet_name)
+    rows = sheet["rows"] if sheet and sheet["rows"] is not None else count_rows(shard_path, sheet_name)
+    return rows + 2  # after the header row
+
+
+def sheet_widths(workbook_path, shard_path, sheet_name):
+    """Cached column widths of a sheet ({column letter: width}), or None if not known yet"""
+    sheet = _shard_entry(load_manifest(workbook_path), shard_path).get("sheets", {}).get(sheet_name)
+    return dict(sheet["widths"]) if sheet and sheet.get("widths") is not None else None
+
+
+def record_widths(workbook_path, shard_path, sheet_name, widths):
+    """Cache the column widths of a sheet after it was written"""
+    manifest = load_manifest(workbook_path)
+    sheet = _shard_entry(manifest, shard_path).setdefault("sheets", {}).setdefault(
+        sheet_name, {"rows": None, "widths": None})
+    sheet["widths"] = widths
+    save_manifest(workbook_path, manifest)
+
+
+def sheet_headers(shard_path, sheet_name):
+    """Header row of a sheet, or None if the shard or sheet does not exist yet"""
+    from openpyxl import load_workbook
+
+    if not os.path.exists(shard_path):
+        return None
+    workbook = load_workbook(shard_path, read_only=True)
+    try:
+        if sheet_name not in workbook.sheetnames:
+            return None
+        return list(next(workbook[sheet_name].iter_rows(max_row=1, values_only=True), ()))
+    finally:
+        workbook.close()
+
+
+def shard_headers(shard_path):
+    """Header row of every sheet of a shard, {sheet name: headers}; empty if the shard does not exist yet"""
+    from openpyxl import load_workbook
+
+    if not os.path.exists(shard_path):
+        return {}
+    workbook = load_workbook(shard_path, read_only=True)
+    try:
+        return {worksheet.title: list(next(worksheet.iter_rows(max_row=1, values_only=True), ()))
+                for worksheet in workbook.worksheets}
+    finally:
+        workbook.close()
+
+
+def get_sheet(workbook, sheet_name, headers):
+    """The worksheet of a study, created with the shared header row on first use"""
+    from openpyxl.styles import Font
+
+    if sheet_name in workbook.sheetnames:
+        return workbook[sheet_name]
+    worksheet = workbook.create_sheet(sheet_name)
+    worksheet.append(list(headers))
+    for cell in worksheet[1]:
+        cell.font = Font(name="Arial", size=10, bold=True)
+    return worksheet
+
+
+# --- Saving ---
+def snapshot_dir(shard_path):
+    return sidecar_path(shard_path, '.snapshots')
+
+
+def snapshot_paths(shard_path):
+    """Kept previous versions of a shard, newest first"""
+    extension = os.path.splitext(shard_path)[1]
+    paths = [os.path.join(snapshot_dir(shard_path), f"{n}{extension}") for n in range(1, SNAPSHOT_DEPTH + 1)]
+    return [path for path in paths if os.path.exists(path)]
+
+
+def _keep_snapshot(shard_path):
+    """Rotate the snapshots and keep the current version of a shard as the newest"""
+    directory = snapshot_dir(shard_path)
+    os.makedirs(directory, exist_ok=True)
+    extension = os.path.splitext(shard_path)[1]
+    for n in range(SNAPSHOT_DEPTH - 1, 0, -1):
+        older = os.path.join(directory, f"{n}{extension}")
+        if os.path.exists(older):
+            os.replace(older, os.path.join(directory, f"{n + 1}{extension}"))
+
+    newest = os.path.join(directory, f"1{extension}")
+    try:
+        os.link(shard_path, newest)  # the old version stays as it is; no copy needed
+    except OSError:
+        shutil.copy2(shard_path, newest)  # file systems without hard links
+
+
+def _fsync_dir(directory):
+    if os.name != 'posix':
+        return
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def save_workbook(workbook, shard_path):
+    """Save a workbook by writing a temporary file and renaming it over the shard
+
+    Raises OSError (e.g. the shard is locked by Excel on Windows) with the shard
+    left as it was.
+    """
+    directory = os.path.dirname(os.path.abspath(shard_path))
+    tmp_path = os.path.join(directory, f".{os.path.basename(shard_path)}.{uuid.uuid4().hex}.tmp")
+    try:
+        with open(tmp_path, 'wb') as f:
+            workbook.save(f)
+            f.flush()
+            os.fsync(f.fileno())
+        if os.path.exists(shard_path):
+            _keep_snapshot(shard_path)
+        os.replace(tmp_path, shard_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    _fsync_dir(directory)
+
+
+def save_json(path, data):
+    """Write a JSON file the way save_workbook writes a shard: temporary file, fsync, rename"""
+    directory = os.path.dirname(os.path.abspath(path))
+    tmp_path = os.path.join(directory, f".{os.path.basename(path)}.{uuid.uuid4().hex}.tmp")
+    try:
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f, indent=4)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    _fsync_dir(directory)
+
+
+# --- Queries across shards ---
+def iter_shard_rows(shard_path, sheet_name=None, with_locations=False):
+    """Yield each non-empty data row of one workbook (or one of its sheets) as a dict keyed by header
+
+    With with_locations, yields ((sheet name, row number), row).
+    """
+    from openpyxl import load_workbook
+
+    if not os.path.exists(shard_path):
+        return
+    workbook = load_workbook(shard_path, read_only=True)
+    try:
+        if sheet_name is not None:
+            worksheets = [workbook[sheet_name]] if sheet_name in workbook.sheetnames else []
+        else:
+            worksheets = workbook.worksheets
+        for worksheet in worksheets:
+            rows = worksheet.iter_rows(values_only=True)
+            headers = next(rows, None)
+            if not headers:
+                continue
+            for row_idx, values in enumerate(rows, start=2):
+                if any(value is not None for value in values):
+                    row = dict(zip(headers, values))
+                    yield ((worksheet.title, row_idx), row) if with_locations else row
+    finally:
+        workbook.close()
+
+
+def iter_rows(workbook_path, sheet_name=None, date_column=None, since=None, until=None):
+    """Yield each non-empty data row of the whole log (or of one study's sheet), shard by shard"""
+    for shard_path in shard_paths(workbook_path, date_column, since, until):
+        yield from iter_shard_rows(shard_path, sheet_name)
+
+
+def read_frame(workbook_path, sheet_name=None):
+    """Read the whole log (or one study's sheet) into a DataFrame in one pass
+
+    The shard file name, sheet name and worksheet row number of each record are
+    kept in the ``_shard``, ``_sheet`` and ``_row`` columns so results can be
+    written back to the right cells.
+    """
+    import pandas as pd
+
+    frames = []
+    for shard_path in shard_paths(workbook_path):
+        records = list(iter_shard_rows(shard_path, sheet_name, with_locations=True))
+        frame = pd.DataFrame.from_records([row for _, row in records])
+        frame.insert(0, '_row', [row_idx for (_, row_idx), _ in records])
+        frame.insert(0, '_sheet', [sheet for (sheet, _), _ in records])
+        frame.insert(0, '_shard', os.path.basename(shard_path))
+        frames.append(frame)
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=['_shard', '_sheet', '_row'])
+
+
+def write_column(workbook_path, header, values_by_location):
+    """Set one column for many rows, given as {(shard name, sheet name, row number): value}
+
+    Each shard touched is loaded and saved once, and its edits count in the
+    manifest goes up.
+    """
+    from openpyxl import load_workbook
+    from openpyxl.styles import Font
+
+    by_shard = {}
+    for (shard_name, sheet_name, row_idx), value in values_by_location.items():
+        by_shard.setdefault(shard_name, {}).setdefault(sheet_name, {})[row_idx] = value
+
+    directory = os.path.dirname(workbook_path)
+    for shard_name, values_by_sheet in by_shard.items():
+        shard_path = os.path.join(directory, shard_name)
+        workbook = load_workbook(shard_path)
+        for sheet_name, values_by_row in values_by_sheet.items():
+            worksheet = workbook[sheet_name]
+            headers = [cell.value for cell in worksheet[1]]
+            if header in headers:
+                col = headers.index(header) + 1
+            else:
+                col = len(headers) + 1
+                worksheet.cell(row=1, column=col, value=header).font = Font(name="Arial", size=10, bold=True)
+
+            for row_idx, value in values_by_row.items():
+                worksheet.cell(row=row_idx, column=col, value=value).font = Font(name="Arial", size=10)
+        save_workbook(workbook, shard_path)
+
+        manifest = load_manifest(workbook_path)
+        shard = _shard_entry(manifest, shard_path)
+        shard["edits"] = shard.get("edits", 0) + 1
+        save_manifest(workbook_path, manifest)
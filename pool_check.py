@@ -0,0 +1,153 @@
+"""Index compatibility checks for library pools.
+
+Every index read in a pool is encoded into a NumPy array once and all pairwise
+Hamming distances are computed column by column, so pools of hundreds of
+libraries are checked instantly.
+
+    python pool_check.py POOL_NAME [--log datalog.xlsx] [--min-distance 3]
+"""
+import sys
+import argparse
+import numpy as np
+
+from index_registry import get_registry, INDEX_DIR
+from logstore import iter_rows, DEFAULT_LOG_PATH
+
+MISSING = 255
+
+# ASCII byte -> base code (A=0, C=1, G=2, T=3); anything else is a missing position
+BASE_CODES = np.full(256, MISSING, dtype=np.uint8)
+for _code, _base in enumerate('ACGT'):
+    BASE_CODES[ord(_base)] = _code
+
+# Two-colour chemistry: A lights both channels, C only red, T only green, G neither
+RED_BASES = [0, 1]
+GREEN_BASES = [0, 3]
+
+
+def encode_reads(reads):
+    """Encode equal-role reads into a (reads, cycles) array, padding short reads as missing"""
+    length = max((len(read) for read in reads), default=0)
+    if length == 0:
+        return np.zeros((len(reads), 0), dtype=np.uint8)
+    raw = np.array(reads, dtype=f'S{length}').view(np.uint8).reshape(len(reads), length)
+    return BASE_CODES[raw]
+
+
+def pairwise_distances(codes):
+    """Hamming distance between every pair of reads, ignoring positions either read lacks"""
+    n = codes.shape[0]
+    distances = np.zeros((n, n), dtype=np.int16)
+    for cycle in range(codes.shape[1]):
+        column = codes[:, cycle]
+        valid = column != MISSING
+        distances += (column[:, None] != column[None, :]) & valid[:, None] & valid[None, :]
+    return distances
+
+
+def dark_cycles(codes, weights):
+    """Return the cycles that give no signal in the red or the green channel"""
+    valid = codes != MISSING
+    flagged = []
+    for cycle in range(codes.shape[1]):
+        column = codes[:, cycle]
+        if not valid[:, cycle].any():
+            continue
+        red = weights[np.isin(column, RED_BASES)].sum()
+        green = weights[np.isin(column, GREEN_BASES)].sum()
+        if red == 0 or green == 0:
+            flagged.append(cycle)
+    return flagged
+
+
+def check_pool(libraries, registry=None, min_distance=3, i5_workflow='b'):
+    """Check a pool given as (library_name, index_id) pairs
+
+    Returns a report dict with the libraries whose index is not in the registry,
+    every pair of libraries closer than min_distance, and the i7/i5 cycles with no
+    signal in one of the two colour channels.
+    """
+    registry = registry or get_registry()
+
+    names, i7_reads, i5_reads, owners, unresolved = [], [], [], [], []
+    for library_name, index_id in libraries:
+        reads = registry.index_reads(index_id, i5_workflow)
+        if not reads:
+            unresolved.append((library_name, index_id))
+            continue
+        for i7, i5 in reads:
+            i7_reads.append(i7)
+            i5_reads.append(i5)
+            owners.append(len(names))
+        names.append(library_name)
+
+    report = {'libraries': len(names), 'unresolved': unresolved, 'collisions': [],
+              'dark_i7_cycles': [], 'dark_i5_cycles': []}
+    if not names:
+        return report
+
+    i7_codes = encode_reads(i7_reads)
+    i5_codes = encode_reads(i5_reads)
+    owners = np.array(owners)
+
+    # Read-level distances, reduced to the closest pair of reads for each pair of libraries
+    distances = pairwise_distances(np.hstack([i7_codes, i5_codes]))
+    starts = np.flatnonzero(np.r_[True, owners[1:] != owners[:-1]])
+    distances = np.minimum.reduceat(np.minimum.reduceat(distances, starts, axis=0), starts, axis=1)
+
+    first, second = np.nonzero(np.triu(distances < min_distance, k=1))
+    report['collisions'] = [(names[a], names[b], int(distances[a, b])) for a, b in zip(first, second)]
+
+    # Each library contributes equally to the cluster mix, split across its oligos
+    weights = 1.0 / np.bincount(owners)[owners]
+    report['dark_i7_cycles'] = [cycle + 1 for cycle in dark_cycles(i7_codes, weights)]
+    report['dark_i5_cycles'] = [cycle + 1 for cycle in dark_cycles(i5_codes, weights)]
+    return report
+
+
+def pool_libraries(workbook_path, pool_name):
+    """Collect (library_name, index_id) for every library assigned to a pool in the log"""
+    libraries = []
+    for row in iter_rows(workbook_path):
+        if row.get('library_pool_name') == pool_name:
+            libraries.append((row.get('library_name'), row.get('r1_index') or row.get('ATAC_index')))
+    return libraries
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check index compatibility of a library pool.")
+    parser.add_argument('pool_name')
+    parser.add_argument('--log', default=DEFAULT_LOG_PATH)
+    parser.add_argument('--min-distance', type=int, default=3)
+    parser.add_argument('--i5-workflow', choices=['a', 'b'], default='b')
+    args = parser.parse_args()
+
+    libraries = pool_libraries(args.log, args.pool_name)
+    if not libraries:
+        print(f"No libraries found in pool {args.pool_name}.")
+        sys.exit(1)
+
+    registry = get_registry()
+    if not registry.kits:
+        print(f"No index sequences are installed, so the pool cannot be checked. "
+              f"Put the 10x index kit CSVs in {INDEX_DIR} (see README.txt there).")
+        sys.exit(1)
+
+    report = check_pool(libraries, registry, min_distance=args.min_distance, i5_workflow=args.i5_workflow)
+    print(f"{report['libraries']} libraries checked in pool {args.pool_name}.")
+    for library_name, index_id in report['unresolved']:
+        print(f"  Unknown index {index_id} for {library_name} (not in the index registry)")
+    for name_a, name_b, distance in report['collisions']:
+        print(f"  Index collision: {name_a} / {name_b} (distance {distance})")
+    if report['dark_i7_cycles']:
+        print(f"  Low diversity i7 cycles: {report['dark_i7_cycles']}")
+    if report['dark_i5_cycles']:
+        print(f"  Low diversity i5 cycles: {report['dark_i5_cycles']}")
+
+    if report['unresolved'] or report['collisions'] or report['dark_i7_cycles'] or report['dark_i5_cycles']:
+        sys.exit(1)
+    print("Pool is compatible.")
+
+
+if __name__ == '__main__':
+    main()
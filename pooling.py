@@ -0,0 +1,130 @@
+"""Equimolar pooling of libraries that have not been assigned to a pool yet.
+
+Molarity is computed for every unpooled library in the log in one vectorized
+pass from ``lib_quantification_ng`` (total ng in the elution volume) and
+``tapestation_avg_size_bp``. Libraries are split into one pool per library
+method (RNA and ATAC are sequenced separately), optionally capped at a number
+of libraries per run, and ``library_pool_name`` is written back in one
+batched update.
+
+    python pooling.py RUN_NAME [--log datalog.xlsx] [--max-libraries 24] [--write]
+"""
+import sys
+import argparse
+
+from index_registry import get_registry, INDEX_DIR
+from journal import update_columns
+from logstore import read_frame, DEFAULT_LOG_PATH
+from pool_check import check_pool
+from protocols import library_volumes
+
+# Average mass of one base pair of double-stranded DNA (g/mol)
+BP_MASS = 660
+
+
+def library_molarity(frame):
+    """Return the nM of each library (NaN where size or quantity is missing)"""
+    import pandas as pd
+
+    quantity_ng = pd.to_numeric(frame['lib_quantification_ng'], errors='coerce')
+    size_bp = pd.to_numeric(frame['tapestation_avg_size_bp'], errors='coerce')
+    volume_ul = frame['library_method'].map(library_volumes())
+    concentration_ng_ul = quantity_ng / volume_ul
+    return concentration_ng_ul * 1e6 / (BP_MASS * size_bp.where(size_bp > 0))
+
+
+def unpooled_libraries(frame):
+    """Select the libraries that can be pooled and are not in a pool yet"""
+    if 'library_pool_name' not in frame:
+        frame = frame.assign(library_pool_name=None)
+    frame = frame.assign(library_nM=library_molarity(frame))
+    pooled = frame['library_pool_name'].notna() & (frame['library_pool_name'].astype(str).str.strip() != '')
+    return frame[~pooled & frame['library_name'].notna() & (frame['library_nM'] > 0)]
+
+
+def propose_pools(frame, run_name, max_libraries=None, pool_nM=2.0, pool_volume_ul=50.0):
+    """Assign unpooled libraries to pools and compute equimolar volumes
+
+    Every library in a pool contributes pool_nM * pool_volume_ul / n fmol, so the
+    finished pool is pool_nM once topped up to pool_volume_ul with buffer.
+    """
+    libraries = unpooled_libraries(frame).copy()
+    if libraries.empty:
+        return libraries
+
+    method_tag = libraries['library_method'].astype(str).str.rsplit('-', n=1).str[-1]
+    pool_name = run_name + '_' + method_tag
+    if max_libraries:
+        chunk = libraries.groupby(pool_name).cumcount() // max_libraries + 1
+        pool_name = pool_name + '_' + chunk.astype(str)
+    libraries['library_pool_name'] = pool_name
+
+    pool_size = libraries.groupby('library_pool_name')['library_name'].transform('count')
+    fmol_per_library = pool_nM * pool_volume_ul / pool_size
+    libraries['pool_volume_ul'] = (fmol_per_library / libraries['library_nM']).round(2)
+    total_volume_ul = libraries.groupby('library_pool_name')['pool_volume_ul'].transform('sum')
+    libraries['buffer_ul'] = (pool_volume_ul - total_volume_ul).round(2)
+    return libraries
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Propose equimolar pools for unpooled libraries.")
+    parser.add_argument('run_name', help="Prefix for the pool names, e.g. the sequencing run ID")
+    parser.add_argument('--log', default=DEFAULT_LOG_PATH)
+    parser.add_argument('--max-libraries', type=int, help="Maximum number of libraries per pool")
+    parser.add_argument('--pool-nm', type=float, default=2.0, help="Final pool concentration (nM)")
+    parser.add_argument('--pool-volume', type=float, default=50.0, help="Final pool volume (µL)")
+    parser.add_argument('--csv', help="Also save the pipetting sheet to this CSV file")
+    parser.add_argument('--write', action='store_true', help="Write library_pool_name back to the log")
+    args = parser.parse_args()
+
+    proposed = {}
+
+    def pool_updates(frame):
+        pools = proposed["pools"] = propose_pools(frame, args.run_name, args.max_libraries, args.pool_nm,
+                                                  args.pool_volume)
+        if pools.empty:
+            return {}
+        locations = zip(pools['_shard'], pools['_sheet'], pools['_row'].tolist())
+        return {'library_pool_name': dict(zip(locations, pools['library_pool_name'].tolist()))}
+
+    try:
+        # With --write the pools are proposed and written under the log lock, so no submission lands in between
+        if args.write:
+            update_columns(args.log, pool_updates)
+        else:
+            pool_updates(read_frame(args.log))
+    except OSError as e:
+        print(f"{e} Nothing was written.")
+        sys.exit(1)
+
+    pools = proposed["pools"]
+    if pools.empty:
+        print("No unpooled libraries with a quantification and size were found.")
+        sys.exit(1)
+
+    columns = ['library_pool_name', 'library_name', 'library_nM', 'pool_volume_ul', 'buffer_ul']
+    print(pools[columns].round({'library_nM': 2}).to_string(index=False))
+    if args.csv:
+        pools[columns].to_csv(args.csv, index=False)
+
+    for pool_name, members in pools.groupby('library_pool_name'):
+        if (members['buffer_ul'] < 0).any():
+            print(f"Warning: {pool_name} needs more than {args.pool_volume} µL; libraries are too dilute.")
+
+    registry = get_registry()
+    if registry.kits:
+        index_ids = pools['r1_index'].where(pools['r1_index'].notna(), pools['ATAC_index'])
+        for pool_name, members in pools.assign(index_id=index_ids).groupby('library_pool_name'):
+            report = check_pool(zip(members['library_name'], members['index_id']), registry)
+            for name_a, name_b, distance in report['collisions']:
+                print(f"Warning: index collision in {pool_name}: {name_a} / {name_b} (distance {distance})")
+    else:
+        print(f"Index collisions were not checked: no index sequences are installed in {INDEX_DIR}.")
+
+    if args.write:
+        print(f"library_pool_name written for {len(pools)} libraries in {args.log}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""Protocol templates: which libraries an assay produces and how their rows are filled in.
+
+``protocols.json`` (bundled with the app; a copy next to the app overrides
+it, see ``logstore.data_path``) defines each protocol's modalities and its
+``sample_suffix``, the assay part of the dissociated cell sample name
+(``250301_CJ24.56.001.BS.05.03.Multiome``). For every modality it gives:
+
+* ``inputs`` -- the group of form fields its library values come from
+  (``RNA``: the cDNA library fields, ``ATAC``: the ATAC library fields)
+* ``cdna`` -- whether reactions go through cDNA amplification first
+* ``library_method``, ``library_type`` (library name prefix),
+  ``library_volume_ul`` and ``amplified_cdna_prefix``
+* ``constants`` -- extra names (volumes, fractions) for its expressions
+* ``columns`` -- Python expressions for the modality-specific columns,
+  evaluated over the values of one reaction, e.g.
+  ``"cdna_concentration * cdna_volume_ul"`` or ``"f'SI-TT-{index}_i7'"``
+* ``fill`` / ``fill_empty`` -- columns filled black, and whether every other
+  empty cell of its rows is filled black too
+* ``qc`` -- thresholds for its pass/fail columns, e.g.
+  ``{"library_prep_pass_fail": {"tapestation_avg_size_bp": {"min": 300, "max": 800}}}``
+  (see qc.py)
+
+The file is read and every expression compiled once, the first time a
+protocol is needed. Adding an assay means adding a template, not code.
+"""
+import re
+import json
+
+from logstore import data_path
+from schema import HEADERS, COLUMNS_BY_NAME, NUMERIC_KINDS
+
+PROTOCOLS_PATH = data_path('protocols.json')
+DEFAULT_PROTOCOL = "10x Multiome"
+# Suffix of protocols that do not set one (templates written before it was configurable)
+DEFAULT_SAMPLE_SUFFIX = "Multiome"
+
+# Form field groups a modality can take its library values from
+INPUT_GROUPS = ("RNA", "ATAC")
+REQUIRED_KEYS = ("inputs", "library_method", "library_type", "library_volume_ul")
+QC_BOUNDS = ("min", "max")
+# Index kit named in an index column expression, e.g. the SI-TT in "f'SI-TT-{index}_i7'"
+KIT_PATTERN = re.compile(r'SI-[A-Z]{2}')
+
+_protocols = None
+
+
+def compile_modality(protocol_name, modality, spec):
+    """Check a modality template and compile its column expressions in place"""
+    label = f"{protocol_name} / {modality}"
+    missing = [key for key in REQUIRED_KEYS if key not in spec]
+    if missing:
+        raise ValueError(f"{label} is missing {', '.join(missing)}")
+    if spec["inputs"] not in INPUT_GROUPS:
+        raise ValueError(f"{label}: inputs must be one of {', '.join(INPUT_GROUPS)}")
+    if spec.get("cdna") and "amplified_cdna_prefix" not in spec:
+        raise ValueError(f"{label} has cDNA amplification but no amplified_cdna_prefix")
+
+    for flag, checks in spec.get("qc", {}).items():
+        if flag not in HEADERS:
+            raise ValueError(f"{label}: unknown QC column {flag}")
+        for column_name, bounds in checks.items():
+            col = COLUMNS_BY_NAME.get(column_name)
+            if col is None or col.kind not in NUMERIC_KINDS:
+                raise ValueError(f"{label}: QC for {flag} must check a numeric column, not {column_name}")
+            if not bounds or set(bounds) - set(QC_BOUNDS):
+                raise ValueError(f"{label}: QC bounds for {column_name} must be min and/or max")
+
+    compiled = {}
+    for column_name, expression in spec.get("columns", {}).items():
+        if column_name not in HEADERS:
+            raise ValueError(f"{label}: unknown column {column_name}")
+        try:
+            compiled[column_name] = compile(expression, f"<{label} / {column_name}>", 'eval')
+        except SyntaxError as e:
+            raise ValueError(f"{label}: invalid expression for {column_name}: {expression}") from e
+    spec["compiled"] = compiled
+    return spec
+
+
+def load_protocols(path=PROTOCOLS_PATH):
+    with open(path, 'r') as f:
+        protocols = json.load(f)
+    for protocol_name, protocol in protocols.items():
+        for modality, spec in protocol["modalities"].items():
+            compile_modality(protocol_name, modality, spec)
+    return protocols
+
+
+def get_protocols():
+    """All protocol templates, loaded and compiled on first use"""
+    global _protocols
+    if _protocols is None:
+        _protocols = load_protocols()
+    return _protocols
+
+
+def get_protocol(name=None):
+    protocols = get_protocols()
+    return protocols[name or DEFAULT_PROTOCOL]
+
+
+def input_groups(protocol):
+    """Form field groups a protocol needs values from"""
+    return {spec["inputs"] for spec in protocol["modalities"].values()}
+
+
+def index_kit(protocol, group):
+    """The index kit (e.g. SI-TT) of a group's libraries, from its index column expressions; None if not one kit"""
+    kits = {kit for spec in protocol["modalities"].values() if spec["inputs"] == group
+            for column_name, expression in spec.get("columns", {}).items() if column_name.endswith("index")
+            for kit in KIT_PATTERN.findall(expression)}
+    return kits.pop() if len(kits) == 1 else None
+
+
+def sample_suffix(protocol):
+    return protocol.get("sample_suffix", DEFAULT_SAMPLE_SUFFIX)
+
+
+def needs_cdna(protocol):
+    return any(spec.get("cdna") for spec in protocol["modalities"].values())
+
+
+def library_volumes():
+    """Elution volume (µL) of every library method in any protocol"""
+    return {spec["library_method"]: spec["library_volume_ul"]
+            for protocol in get_protocols().values() for spec in protocol["modalities"].values()}
+
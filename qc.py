@@ -0,0 +1,134 @@
+"""QC pass/fail flags from per-protocol thresholds.
+
+Each modality in ``protocols.json`` can give thresholds for its pass/fail
+columns, checked against the measured columns of its rows:
+
+    "qc": {
+        "rna_amplification_pass_fail": {"percent_cdna_longer_than_400bp": {"min": 50}},
+        "library_prep_pass_fail": {"tapestation_avg_size_bp": {"min": 300, "max": 800},
+                                   "lib_quantification_ng": {"min": 10}}
+    }
+
+A row passes when every checked value is within its bounds; a missing value
+fails. Flags are computed for all rows of a modality at once, both for a new
+submission and when re-checking the whole log after a threshold change:
+
+    python qc.py [--log datalog.xlsx] [--write]
+"""
+import sys
+import argparse
+
+import numpy as np
+
+from journal import update_columns
+from logstore import read_frame, DEFAULT_LOG_PATH
+from protocols import get_protocols
+
+PASS = "Pass"
+FAIL = "Fail"
+
+
+def rules_by_method():
+    """QC rules of every library method in any protocol"""
+    return {spec["library_method"]: spec["qc"]
+            for protocol in get_protocols().values() for spec in protocol["modalities"].values()
+            if spec.get("qc")}
+
+
+def as_float(values):
+    """Values as a float array, with NaN for anything missing or not a number"""
+    try:
+        return np.asarray(values, dtype=float)
+    except (TypeError, ValueError):
+        measured = np.full(len(values), np.nan)
+        for i, value in enumerate(values):
+            try:
+                measured[i] = float(str(value).replace(',', ''))
+            except (TypeError, ValueError):
+                pass
+        return measured
+
+
+def evaluate(rules, columns, count):
+    """Pass/Fail arrays for each flag with rules, given the checked columns of count rows
+
+    Checks on columns the log does not have are skipped.
+    """
+    flags = {}
+    for flag, checks in rules.items():
+        passed = np.ones(count, dtype=bool)
+        for column_name, bounds in checks.items():
+            if column_name not in columns:
+                continue
+            measured = as_float(columns[column_name])
+            if "min" in bounds:
+                passed &= measured >= bounds["min"]
+            if "max" in bounds:
+                passed &= measured <= bounds["max"]
+        flags[flag] = np.where(passed, PASS, FAIL)
+    return flags
+
+
+def apply_to_rows(rules, headers, rows):
+    """Set the flag cells of a block of rows (lists in header order) in place"""
+    if not rules or not rows:
+        return
+    positions = {header: i for i, header in enumerate(headers)}
+    columns = {column_name: [row[positions[column_name]] for row in rows]
+               for checks in rules.values() for column_name in checks if column_name in positions}
+    for flag, values in evaluate(rules, columns, len(rows)).items():
+        if flag in positions:
+            for row, value in zip(rows, values.tolist()):
+                row[positions[flag]] = value
+
+
+def check_log(frame, rules=None):
+    """Flags that differ from the log, as {flag: {(shard name, sheet name, row number): value}}"""
+    rules = rules_by_method() if rules is None else rules
+    changes = {}
+    if frame.empty or 'library_method' not in frame:
+        return changes
+
+    for method, group in frame.groupby('library_method', sort=False):
+        if method not in rules:
+            continue
+        columns = {column_name: group[column_name].to_numpy() for column_name in group.columns}
+        for flag, values in evaluate(rules[method], columns, len(group)).items():
+            current = group[flag].to_numpy() if flag in group else np.full(len(group), None)
+            changed = current != values
+            if not changed.any():
+                continue
+            locations = zip(group['_shard'].to_numpy()[changed], group['_sheet'].to_numpy()[changed],
+                            group['_row'].to_numpy()[changed].tolist())
+            changes.setdefault(flag, {}).update(zip(locations, values[changed].tolist()))
+    return changes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-check the QC flags of the log against the thresholds in protocols.json.")
+    parser.add_argument('--log', default=DEFAULT_LOG_PATH)
+    parser.add_argument('--write', action='store_true', help="Write the changed flags to the log")
+    args = parser.parse_args()
+
+    try:
+        # With --write the log is checked and written under its lock, so no submission lands in between
+        changes = update_columns(args.log, check_log) if args.write else check_log(read_frame(args.log))
+    except OSError as e:
+        print(f"{e} Nothing was written.")
+        sys.exit(1)
+    if not changes:
+        print("All QC flags match the current thresholds.")
+        return
+
+    for flag, values in changes.items():
+        failed = sum(value == FAIL for value in values.values())
+        print(f"{flag}: {len(values)} rows change ({failed} to {FAIL}, {len(values) - failed} to {PASS})")
+
+    if not args.write:
+        print("Run with --write to update the log.")
+        return
+    print(f"QC flags written to {args.log}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""Reaction-batch stage of a submission.
+
+The per-reaction inputs of a submission (the comma-separated form fields)
+are turned into NumPy arrays once. Library names are allocated reaction by
+reaction, in the order the rows are written, then each modality's rows are
+built and QC-flagged as one block (see qc.py) and the blocks are
+interleaved per reaction for the writer (RNA1, ATAC1, RNA2, ATAC2, ...):
+
+    rows, fills = build_submission(protocol, headers, values, reactions, group_inputs, counter_data)
+"""
+import numpy as np
+
+from library_names import allocate_library_name, allocate_amplified_cdna_name
+from qc import apply_to_rows
+from protocols import sample_suffix
+from schema import HEADERS, compile_block_builders
+
+
+def as_array(values):
+    """Numeric per-reaction values as an array; anything else (indices, empty inputs) stays a list"""
+    array = np.asarray(values)
+    return array if array.dtype.kind in 'iuf' else list(values)
+
+
+def split_inputs(inputs):
+    """Split a group of inputs into (shared values, per-reaction arrays)"""
+    shared = {}
+    per_reaction = {}
+    for key, value in inputs.items():
+        if isinstance(value, (list, tuple, np.ndarray)):
+            per_reaction[key] = as_array(value)
+        else:
+            shared[key] = value
+    return shared, per_reaction
+
+
+def allocate_names(protocol, counter_data, values, group_inputs, rxn_number):
+    """Library prep sets, library names and amplified cDNA names of every reaction, by modality"""
+    names = {modality: {"library_prep_set": [], "library_name": [], "amplified_cdna_name": []}
+             for modality in protocol["modalities"]}
+    # Without a seeded index names start at set 1; the journal moves any taken ones on (journal.submit)
+    index_counter = counter_data.setdefault("index_counter", {})
+    for x in range(rxn_number):
+        for modality, spec in protocol["modalities"].items():
+            inputs = group_inputs[spec["inputs"]]
+            # Allocate the next library prep set not used anywhere in the log for this index
+            library_prep_set, library_name = allocate_library_name(
+                index_counter, spec["library_type"], inputs["library_prep_date"], inputs["index"][x])
+            amplified_cdna_name = allocate_amplified_cdna_name(
+                counter_data["amp_counter"], values["current_date"], values["cdna_amplification_date"],
+                spec["amplified_cdna_prefix"]) if spec.get("cdna") else None
+
+            names[modality]["library_prep_set"].append(library_prep_set)
+            names[modality]["library_name"].append(library_name)
+            names[modality]["amplified_cdna_name"].append(amplified_cdna_name)
+    return names
+
+
+def build_submission(protocol, headers, values, reactions, group_inputs, counter_data):
+    """Rows and black fill columns of a submission, in the order they are written
+
+    values holds the values shared by every row, reactions the per-reaction
+    values common to all modalities (one item per reaction) and group_inputs
+    the library inputs of each form group, which a modality's template picks
+    from. Library names are allocated from counter_data, and the dissociated
+    cell sample name takes the protocol's sample suffix.
+    """
+    values = {**values, "dissociated_cell_sample_name":
+              f"{values['current_date']}_{values['tissue_name']}.{sample_suffix(protocol)}"}
+    shared, per_reaction = split_inputs(reactions)
+    rxn_number = len(reactions["reaction"])
+    names = allocate_names(protocol, counter_data, values, group_inputs, rxn_number)
+
+    blocks = []
+    for modality, build_block in compile_block_builders(protocol, headers).items():
+        spec = protocol["modalities"][modality]
+        group_shared, group_per_reaction = split_inputs(group_inputs[spec["inputs"]])
+        block_rows, block_fills = build_block({**values, **shared, **group_shared},
+                                              {**per_reaction, **group_per_reaction, **names[modality]}, rxn_number)
+        apply_to_rows(spec.get("qc"), HEADERS if headers is None else headers, block_rows)
+        blocks.append((block_rows, block_fills))
+
+    rows = []
+    fills = []
+    for x in range(rxn_number):
+        for block_rows, block_fills in blocks:
+            rows.append(block_rows[x])
+            fills.append(block_fills[x])
+    return rows, fills
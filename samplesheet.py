@@ -0,0 +1,122 @@
+"""Demultiplexing sample sheets generated straight from the log.
+
+Rows are streamed from the workbook and each one is written to the sheet of
+its ``library_pool_name`` as soon as it is read, so memory stays bounded and
+any number of run sheets are produced in a single pass.
+
+    python samplesheet.py --pool RUN1_RSeq --pool RUN1_ASeq [--out sheets/]
+    python samplesheet.py --since 250301 --until 250331 --format bclconvert
+
+The default ``10x`` format is the simple ``Lane,Sample,Index`` CSV read by
+``cellranger-arc mkfastq``. The ``bclconvert`` format writes the index
+sequences from the index registry instead of the index names.
+"""
+import os
+import re
+import sys
+import csv
+import argparse
+from contextlib import ExitStack
+
+from index_registry import get_registry, short_index_name
+from logstore import iter_rows, DEFAULT_LOG_PATH
+
+UNPOOLED = "unpooled"
+
+BCLCONVERT_HEADER = [
+    ["[Header]"],
+    ["FileFormatVersion", "2"],
+    [],
+    ["[BCLConvert_Settings]"],
+    ["CreateFastqForIndexReads", "0"],
+    [],
+    ["[BCLConvert_Data]"],
+]
+
+
+def select_rows(rows, pools=None, since=None, until=None):
+    """Filter streamed rows by pool name and/or library_creation_date (YYMMDD, inclusive)"""
+    for row in rows:
+        if not row.get('library_name'):
+            continue
+        if pools and row.get('library_pool_name') not in pools:
+            continue
+        library_date = str(row.get('library_creation_date') or '')
+        if since and library_date < since:
+            continue
+        if until and library_date > until:
+            continue
+        yield row
+
+
+def sheet_lines(row, sheet_format, registry, i5_workflow):
+    """Return the sample sheet lines for one library"""
+    index_id = row.get('r1_index') or row.get('ATAC_index')
+    library_name = row['library_name']
+    if sheet_format == '10x':
+        index_name = short_index_name(index_id)
+        return [["*", library_name, index_name]] if index_name else []
+
+    reads = registry.index_reads(index_id, i5_workflow) or []
+    return [[library_name, i7, i5] for i7, i5 in reads]
+
+
+def sheet_file_name(pool_name):
+    return re.sub(r'[^A-Za-z0-9._-]', '_', pool_name) + "_samplesheet.csv"
+
+
+def write_sample_sheets(workbook_path, out_dir, pools=None, since=None, until=None,
+                        sheet_format='10x', i5_workflow='b'):
+    """Write one sample sheet per pool and return {pool_name: number of libraries}"""
+    registry = get_registry() if sheet_format == 'bclconvert' else None
+    os.makedirs(out_dir, exist_ok=True)
+
+    counts = {}
+    writers = {}
+    with ExitStack() as stack:
+        rows = iter_rows(workbook_path, date_column='library_creation_date', since=since, until=until)
+        for row in select_rows(rows, pools, since, until):
+            pool_name = row.get('library_pool_name') or UNPOOLED
+            lines = sheet_lines(row, sheet_format, registry, i5_workflow)
+            if not lines:
+                print(f"Skipping {row['library_name']}: index {row.get('r1_index') or row.get('ATAC_index')} "
+                      f"could not be resolved", file=sys.stderr)
+                continue
+
+            if pool_name not in writers:
+                f = stack.enter_context(open(os.path.join(out_dir, sheet_file_name(pool_name)), 'w', newline=''))
+                writer = csv.writer(f)
+                if sheet_format == '10x':
+                    writer.writerow(["Lane", "Sample", "Index"])
+                else:
+                    writer.writerows(BCLCONVERT_HEADER)
+                    writer.writerow(["Sample_ID", "index", "index2"])
+                writers[pool_name] = writer
+
+            writers[pool_name].writerows(lines)
+            counts[pool_name] = counts.get(pool_name, 0) + 1
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate demultiplexing sample sheets from the log.")
+    parser.add_argument('--log', default=DEFAULT_LOG_PATH)
+    parser.add_argument('--pool', action='append', help="Pool to include (repeat for several run sheets)")
+    parser.add_argument('--since', help="First library creation date to include (YYMMDD)")
+    parser.add_argument('--until', help="Last library creation date to include (YYMMDD)")
+    parser.add_argument('--format', dest='sheet_format', choices=['10x', 'bclconvert'], default='10x')
+    parser.add_argument('--i5-workflow', choices=['a', 'b'], default='b')
+    parser.add_argument('--out', default='.', help="Directory to write the sample sheets to")
+    args = parser.parse_args()
+
+    counts = write_sample_sheets(args.log, args.out, set(args.pool) if args.pool else None,
+                                 args.since, args.until, args.sheet_format, args.i5_workflow)
+    if not counts:
+        print("No libraries matched.")
+        sys.exit(1)
+    for pool_name, count in counts.items():
+        print(f"{os.path.join(args.out, sheet_file_name(pool_name))}: {count} libraries")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,183 @@
+"""The HMBA columns of the log, declared once.
+
+Each column has a name, a kind (used by the typed export), the source it is
+filled from on every row, and whether its cell is always filled black. A
+source is the key of a value in the per-row ``values`` the front ends
+collect, a function of them, or None for an empty cell. Columns that depend
+on the assay (cDNA metrics, index names) are left to the modality templates
+in ``protocols.json``, whose compiled expressions take precedence.
+
+``compile_block_builder`` resolves the columns of a worksheet against the
+schema and a modality template once. A block builder then makes the rows of
+one modality for all reactions of a submission: the numeric columns of the
+schema are evaluated once over arrays holding every reaction's values, and
+so is each template expression (derived metrics such as
+``cdna_concentration * cdna_volume_ul``). An expression that does not give a
+number per reaction that way (string formatting, ``if``, ``max`` of two
+values, a division by zero) is evaluated row by row over the plain values of
+one reaction instead, as are the text columns:
+
+    builders = compile_block_builders(protocol, headers)
+    rows, fills = builders["RNA"](values, per_reaction, rxn_number)
+"""
+from collections import namedtuple, ChainMap
+
+import numpy as np
+
+Column = namedtuple('Column', ['name', 'kind', 'source', 'fill'])
+
+FILL_ALWAYS = "always"
+
+# Column kinds computed for all reactions at once
+NUMERIC_KINDS = ('int', 'float')
+
+# Builtins available to template expressions
+EXPRESSION_BUILTINS = {"round": round, "int": int, "float": float, "str": str, "min": min, "max": max, "abs": abs}
+
+
+def column(name, kind='string', source=None, fill=None):
+    return Column(name, kind, source, fill)
+
+
+def identifier(v):
+    return (f"{v['current_date']}_HMBA_{v['mit_name']}_Slab{int(v['slab'])}_Tile{int(v['tile'])}_"
+            f"{v['sort_method']}_{v['modality']}{v['reaction']}")
+
+
+COLUMNS = [
+    column('krienen_lab_identifier', source=identifier),
+    column('seq_portal', source='seq_portal'),
+    column('elab_link', source='elab_link'),
+    column('experiment_start_date', 'date', source='current_date'),
+    column('mit_name', source='mit_name'),
+    column('donor_name', source='donor_name'),
+    column('tissue_name', source='tissue_name'),
+    column('tissue_name_old', fill=FILL_ALWAYS),
+    column('dissociated_cell_sample_name', source='dissociated_cell_sample_name'),
+    column('facs_population_plan', source='facs_population'),
+    column('cell_prep_type', source='cell_prep_type'),
+    column('study', source='study'),
+    column('enriched_cell_sample_container_name', source='enriched_cell_sample_container_name'),
+    column('expc_cell_capture', 'int', source='expected_cell_capture'),
+    column('port_well', 'int', source='port_well'),
+    column('enriched_cell_sample_name',
+           source=lambda v: f"MPXM_{v['current_date']}_{v['sorting_status']}_{v['sorter_initials']}_{v['port_well']}"),
+    column('enriched_cell_sample_quantity_count', 'int', source='enriched_cell_sample_quantity_count'),
+    column('barcoded_cell_sample_name', source='barcoded_cell_sample_name'),
+    column('library_method', source='library_method'),
+    column('cDNA_amplification_method'),
+    column('cDNA_amplification_date', 'date'),
+    column('amplified_cdna_name'),
+    column('cDNA_pcr_cycles', 'int'),
+    column('rna_amplification_pass_fail'),
+    column('percent_cdna_longer_than_400bp', 'float'),
+    column('cdna_amplified_quantity_ng', 'float'),
+    column('cDNA_library_input_ng', 'float'),
+    column('library_creation_date', 'date', source='library_prep_date'),
+    column('library_prep_set', source='library_prep_set'),
+    column('library_name', source='library_name'),
+    column('tapestation_avg_size_bp', 'int', source='size'),
+    column('library_num_cycles', 'int', source='library_cycles'),
+    column('lib_quantification_ng', 'float', source=lambda v: v['library_concentration'] * v['library_volume_ul']),
+    column('library_prep_pass_fail'),
+    column('r1_index'),
+    column('r2_index'),
+    column('ATAC_index'),
+    column('library_pool_name'),
+]
+
+HEADERS = [c.name for c in COLUMNS]
+COLUMNS_BY_NAME = {c.name: c for c in COLUMNS}
+
+# Generated names shown first when a submission is previewed
+PREVIEW_COLUMNS = ['krienen_lab_identifier', 'barcoded_cell_sample_name', 'amplified_cdna_name',
+                   'library_prep_set', 'library_name']
+
+
+def _getter(source):
+    if source is None:
+        return lambda values: None
+    if callable(source):
+        return source
+    return lambda values: values[source]
+
+
+def _expression_getter(code):
+    scope = {"__builtins__": EXPRESSION_BUILTINS}
+    return lambda values: eval(code, scope, values)
+
+
+def _evaluate_batch(get, scope, count):
+    """Values of an expression for every reaction from one evaluation over arrays, or None if it cannot be done so"""
+    try:
+        with np.errstate(all='raise'):
+            result = get(scope)
+    except Exception:
+        return None  # e.g. max() or an if over arrays; row by row raises the expression's own errors
+    if not isinstance(result, (bool, int, float, np.generic, np.ndarray)):
+        return None  # strings, lists
+    result = np.asarray(result)
+    if result.shape not in ((), (count,)) or not (np.issubdtype(result.dtype, np.number) or result.dtype == bool):
+        return None
+    return np.broadcast_to(result, (count,)).tolist()
+
+
+def compile_block_builder(modality, spec, headers=None):
+    """Return a function building the rows and black fill column numbers of one modality
+
+    spec is the modality's compiled template from protocols.json. headers is the
+    header row of the worksheet being written (default: the full schema), so
+    older logs with fewer columns get rows in their own layout. Columns not in
+    the schema are left empty.
+
+    The function takes the values shared by the submission, the per-reaction
+    values (arrays or lists, one item per reaction) and the number of reactions.
+    """
+    headers = HEADERS if headers is None else list(headers)
+    names = {"modality": modality, "library_method": spec["library_method"],
+             "library_type": spec["library_type"], "library_volume_ul": spec["library_volume_ul"],
+             **spec.get("constants", {})}
+    black_columns = set(spec.get("fill", []))
+
+    getters = []
+    always_filled = []
+    filled_if_empty = []
+    for col_num, header in enumerate(headers, start=1):
+        col = COLUMNS_BY_NAME.get(header)
+        if header in spec["compiled"]:
+            getters.append((_expression_getter(spec["compiled"][header]), None))  # batch if it evaluates so
+        else:
+            getters.append((_getter(col.source if col else None), bool(col) and col.kind in NUMERIC_KINDS))
+
+        if header in black_columns or (col and col.fill == FILL_ALWAYS):
+            always_filled.append(col_num)
+        elif spec.get("fill_empty"):
+            filled_if_empty.append(col_num)
+
+    def build_block(values, per_reaction, count):
+        batch_scope = ChainMap(per_reaction, values, names)
+        items = {key: value.tolist() if isinstance(value, np.ndarray) else value
+                 for key, value in per_reaction.items()}
+        row_scopes = [ChainMap({key: value[x] for key, value in items.items()}, values, names)
+                      for x in range(count)]
+
+        columns = []
+        for get, vectorized in getters:
+            if vectorized:
+                columns.append(np.broadcast_to(np.asarray(get(batch_scope)), (count,)).tolist())
+                continue
+            batch = _evaluate_batch(get, batch_scope, count) if vectorized is None else None
+            columns.append(batch if batch is not None else [get(scope) for scope in row_scopes])
+
+        rows = [list(row_data) for row_data in zip(*columns)]
+        fills = [always_filled + [col_num for col_num in filled_if_empty if row_data[col_num - 1] is None]
+                 for row_data in rows]
+        return rows, fills
+
+    return build_block
+
+
+def compile_block_builders(protocol, headers=None):
+    """Block builders for every modality of a protocol, keyed by modality"""
+    return {modality: compile_block_builder(modality, spec, headers)
+            for modality, spec in protocol["modalities"].items()}
@@ -0,0 +1,16 @@
+import os
+
+import pytest
+
+from instruments import read_exports, select_plate, match_reactions, field_values
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+def test_ladder_well_is_not_a_reaction():
+    wells = select_plate(read_exports([os.path.join(FIXTURES, 'tapestation_ladder.csv')]))
+
+    records = match_reactions(wells, count=3)
+
+    assert field_values(records, 'size') == [1200, 1300, 1350]
+    assert field_values(records, 'concentration') == pytest.approx([2.5, 3.1, 2.8])
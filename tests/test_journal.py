@@ -0,0 +1,91 @@
+import json
+
+from aggregates import load_aggregates, build_aggregates
+from journal import submit, undo_last, make_entry, load_counters, apply_pending, _journal
+from library_names import allocate_library_name
+from logstore import iter_rows, load_manifest
+from schema import HEADERS
+
+
+def batch(counters, indices):
+    """Rows of one submission with library names allocated from counters, as the front ends do"""
+    rows = []
+    for index in indices:
+        row = [f"reaction_{index}"] + [None] * (len(HEADERS) - 1)
+        row[HEADERS.index('library_prep_set')], row[HEADERS.index('library_name')] = allocate_library_name(
+            counters.setdefault("index_counter", {}), "LPLCXR", "250301", index)
+        rows.append(row)
+    return rows
+
+
+def submit_batch(log, counter_file, indices, renames):
+    counters = load_counters(counter_file)
+    rows = batch(counters, indices)
+    entry = make_entry(log, 2, HEADERS, rows, [[] for _ in rows], counters)
+    assert submit(log, counter_file, entry, on_rename=renames.append)
+    return [row[HEADERS.index('library_name')] for row in rows]
+
+
+def test_undo_hands_library_names_back(tmp_path):
+    log, counter_file = str(tmp_path / "datalog.xlsx"), str(tmp_path / "counters.json")
+    renames = []
+
+    first = submit_batch(log, counter_file, ["A01", "B01"], renames)
+    undo_last(log, counter_file)
+    again = submit_batch(log, counter_file, ["A01", "B01"], renames)
+
+    assert first == again == ["LPLCXR_250301_1_A01", "LPLCXR_250301_1_B01"]
+    assert renames == []
+    assert [row["library_name"] for row in iter_rows(log)] == again
+    with open(tmp_path / "datalog.manifest.json") as f:
+        assert json.load(f)["library_sets"] == {"LPLCXR_250301_A01": 1, "LPLCXR_250301_B01": 1}
+
+
+def test_names_taken_by_another_station_are_moved_on(tmp_path):
+    log = str(tmp_path / "datalog.xlsx")
+    renames = []
+
+    submit_batch(log, str(tmp_path / "station_1.json"), ["A01"], renames)
+    second = submit_batch(log, str(tmp_path / "station_2.json"), ["A01"], renames)
+
+    assert second == ["LPLCXR_250301_2_A01"]
+    assert renames == [{"LPLCXR_250301_1_A01": "LPLCXR_250301_2_A01"}]
+
+
+def journal_only(log, first_row, reactions):
+    """Journal a submission without applying it, as when the log was open in Excel"""
+    rows = []
+    for reaction in reactions:
+        row = [None] * len(HEADERS)
+        row[HEADERS.index('barcoded_cell_sample_name')] = reaction
+        row[HEADERS.index('library_method')] = "10xMultiome-RSeq"
+        row[HEADERS.index('library_prep_pass_fail')] = "Pass"
+        rows.append(row)
+    entry = make_entry(log, first_row, HEADERS, rows, [[] for _ in rows], {})
+    del entry["counters"]
+    _journal(log, {"op": "append", **entry, "counter_changes": []})
+
+
+def test_pending_entries_are_counted_once_without_aggregates(tmp_path):
+    log, counter_file = str(tmp_path / "datalog.xlsx"), str(tmp_path / "counters.json")
+    journal_only(log, 2, ["rxn1", "rxn2"])
+    journal_only(log, 4, ["rxn3"])
+
+    assert apply_pending(log, counter_file)
+
+    aggregates = load_aggregates(log)
+    assert (aggregates["rows"], aggregates["reactions"]) == (3, 3)
+    assert aggregates["groups"]["library_method"]["10xMultiome-RSeq"] == {"libraries": 3, "passed": 3}
+    assert aggregates == build_aggregates(log)
+
+
+def test_pending_entries_are_counted_once_without_row_counts(tmp_path):
+    log, counter_file = str(tmp_path / "datalog.xlsx"), str(tmp_path / "counters.json")
+    journal_only(log, 2, ["rxn1", "rxn2"])
+    journal_only(log, 4, ["rxn3"])
+
+    assert apply_pending(log, counter_file)
+
+    shard = load_manifest(log)["shards"][0]
+    assert shard["rows"] == 3
+    assert shard["sheets"]["HMBA"]["rows"] == 3